@@ -1,53 +1,102 @@
 import streamlit as st
 import yaml
 import os
-from components import id_to_a4, id_front_back, id_center, multi_id_center, pdf_merger, image_to_pdf
+import importlib
+from utils.cache_utils import configure_cache, cache_stats
+from utils.artifact_utils import configure_artifacts
+from utils.session_utils import configure_session_store, session_store_stats
+from utils.upload_utils import configure_uploads, upload_stats
+from utils.encoding_utils import encoding_profiles, profile_for_dpi, describe_profile
+from utils.trace_utils import configure_tracing, trace_run, new_session_id
 
-# Load config
-with open('config.yaml', 'r') as f:
-    config = yaml.safe_load(f)
+@st.cache_resource
+def load_config():
+    """Read config.yaml and apply process-wide settings once per process, not on every rerun."""
+    with open('config.yaml', 'r') as f:
+        config = yaml.safe_load(f)
+    configure_cache(config)
+    configure_artifacts(config)
+    configure_session_store(config)
+    configure_uploads(config)
+    configure_tracing(config)
+    return config
+
+# Shallow copy: the per-session settings below must not leak into the shared config
+config = dict(load_config())
+if "session_id" not in st.session_state:
+    st.session_state.session_id = new_session_id()
 
 # Sidebar: Help, Settings, Reset
 st.sidebar.title("🛠️ Settings & Help")
 st.sidebar.markdown("**DPI (Print Quality):**")
 dpi = st.sidebar.slider("DPI", 72, 600, 300, 10, key="dpi_global")
+profile_name = st.sidebar.selectbox("PDF encoding", ["Auto (from DPI)"] + list(encoding_profiles(config)), index=0, key="pdf_profile_global", help="How images are compressed in PDFs. Auto picks the profile whose DPI cap covers the slider: draft for screen and email, office for everyday printing, archival for lossless masters.")
+pdf_profile = profile_for_dpi(config, dpi, None if profile_name.startswith("Auto") else profile_name)
+st.sidebar.caption(describe_profile(pdf_profile))
+pdf_max_mb = st.sidebar.number_input("Fit PDF under (MB, 0 = no limit)", 0.0, 500.0, 0.0, 0.5, key="pdf_max_mb_global", help="Lowers JPEG quality, then image DPI, until the PDF fits. Each try is a full re-encode.")
+raster_format = st.sidebar.selectbox("Also export as raster", ["None", "PNG", "TIFF"], index=0, key="raster_format_global", help="For printers and RIPs that want bitmap input. The page is rendered in strips, so high DPI stays light on memory.")
+raster_1200 = st.sidebar.checkbox("Raster at 1200 DPI", value=False, key="raster_1200_global", disabled=raster_format == "None")
 st.sidebar.markdown("---")
 st.sidebar.markdown("**About:**\nThis app helps you print ID cards, documents, and photos in custom layouts, with cropping, enhancement, and batch support.\n\n**Tips:**\n- Use the crop sliders to trim your image.\n- Adjust brightness/contrast for best print results.\n- Choose the right page and document size for your needs.\n- Download as PDF or Word for easy printing.")
+stats = cache_stats()
+st.sidebar.caption(f"Image cache: {stats['bytes'] / 1e6:.0f}/{stats['max_bytes'] / 1e6:.0f} MB, {stats['entries']} entries, {stats['hits']} hits / {stats['misses']} misses")
+sessions = session_store_stats()
+st.sidebar.caption(f"Session memory: {sessions['memory_bytes'] / 1e6:.0f}/{sessions['global_budget_bytes'] / 1e6:.0f} MB across {sessions['sessions']} session(s), {sessions['spilled_bytes'] / 1e6:.0f} MB spilled to disk")
+uploads = upload_stats()
+st.sidebar.caption(f"Uploads: {uploads['uploads']} file(s), {uploads['memory_bytes'] / 1e6:.0f} MB in memory, {uploads['spooled_bytes'] / 1e6:.0f} MB memory-mapped from disk")
+show_diagnostics = st.sidebar.checkbox("📊 Show diagnostics", value=False, key="show_diagnostics")
 if st.sidebar.button("🔁 Reset All"):
     st.session_state.clear()
     st.rerun()
 
 # Pass global settings to config/session
 config['dpi'] = dpi
+config['raster_format'] = None if raster_format == "None" else raster_format.lower()
+config['raster_dpi'] = 1200 if raster_1200 else dpi
+config['pdf_profile'] = pdf_profile
+config['pdf_max_bytes'] = int(pdf_max_mb * 1e6) or None
+config['show_diagnostics'] = show_diagnostics
 
 st.title("🪪 Card Printing Suite")
 
-# Tabs for each feature
-TABS = [
-    "ID to A4 (8 per page)",
-    "ID to A4 (Front & Back)",
-    "Single ID Centered",
-    "Multiple IDs Centered",
-    "PDF merger",
-    "Image to PDF"
+# Tools: (tab label, description, component module). Components are imported on first use.
+TOOLS = [
+    ("ID to A4 (8 per page)", "Easily print 8 documents per page. [Tip: Use crop and enhancement for best results!]", "id_to_a4"),
+    ("ID to A4 (Front & Back)", "Print front and back of a document on a single page.", "id_front_back"),
+    ("Single ID Centered", "Print a single document centered on the page.", "id_center"),
+    ("Multiple IDs Centered", "Print up to 4 documents, spaced and centered.", "multi_id_center"),
+    ("PDF merger", "Merge multiple PDF files into a single PDF.", "pdf_merger"),
+    ("Image to PDF", "Convert images to PDF.", "image_to_pdf"),
+    ("Mixed Sheets (Auto-Pack)", "Pack many different documents and sizes onto as few pages as possible.", "imposition"),
 ]
-tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(TABS)
-
-with tab1:
-    st.markdown("Easily print 8 documents per page. [Tip: Use crop and enhancement for best results!]")
-    id_to_a4.render(st, config)
-with tab2:
-    st.markdown("Print front and back of a document on a single page.")
-    id_front_back.render(st, config)
-with tab3:
-    st.markdown("Print a single document centered on the page.")
-    id_center.render(st, config)
-with tab4:
-    st.markdown("Print up to 4 documents, spaced and centered.")
-    multi_id_center.render(st, config) 
-with tab5:
-    st.markdown("Merge multiple PDF files into a single PDF.")
-    pdf_merger.render(st, config)
-with tab6:
-    st.markdown("Convert images to PDF.")
-    image_to_pdf.render(st, config)
\ No newline at end of file
+
+def render_diagnostics(run):
+    """Per-stage timings of one tool render, drawn inside the tool's fragment so they follow its own reruns."""
+    with st.expander(f"📊 Diagnostics: {run['ms']:.0f} ms, {run['mem_delta_mb']:+.1f} MB"):
+        if not run["stages"]:
+            st.caption("No processing stages ran.")
+            return
+        st.dataframe([
+            {
+                "stage": "  " * s["depth"] + s["stage"],
+                "ms": s["ms"],
+                "megapixels": round(s["pixels"] / 1e6, 2),
+                "KB out": round(s["bytes"] / 1024, 1),
+                "MB delta": s["mem_delta_mb"],
+            }
+            for s in run["stages"]
+        ], hide_index=True)
+
+@st.fragment
+def render_tool(module_name, config):
+    # Each tool is a fragment: interacting with its widgets reruns only this tool, not every tab
+    component = importlib.import_module(f"components.{module_name}")
+    with trace_run(module_name, st.session_state.session_id) as run:
+        component.render(st, config)
+    if config['show_diagnostics']:
+        render_diagnostics(run)
+
+for tab, (_, description, module_name) in zip(st.tabs([label for label, _, _ in TOOLS]), TOOLS):
+    with tab:
+        st.markdown(description)
+        render_tool(module_name, config)
@@ -0,0 +1,57 @@
+"""Headless batch renderer.
+
+Usage:
+    python batch.py manifest.csv --out output/ [--workers N] [--config config.yaml]
+
+Each manifest row (CSV) or list entry (YAML, optionally under a top-level "jobs" key) describes one sheet:
+    name, mode (grid | center | front_back | multi | image_to_pdf | merge | split), images (";"-separated in CSV),
+    page_size, document_type, dpi, grid (e.g. "2x4"), auto_rotate, spacing,
+    left_crop, top_crop, right_crop, bottom_crop (percent), deskew (degrees), brightness, contrast, sharpness, grayscale,
+    auto_crop (detect the card and fill in deskew/crop), formats ("pdf;docx"),
+    profile (PDF encoding: draft | office | archival, default from dpi), max_mb (fit the PDF under this size)
+
+image_to_pdf writes one page per image (fit_to_page), merge joins the PDFs listed in images
+(compact: share identical fonts/images and compress the structure), and split cuts the first one by page_ranges (e.g. "1-3, 5") into a ZIP.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import yaml
+from utils.artifact_utils import configure_artifacts
+from utils.job_utils import load_manifest, render_job
+
+def _run(job, config, output_dir):
+    configure_artifacts(config)
+    return job["name"], render_job(job, config, output_dir)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render card layouts from a CSV/YAML manifest.")
+    parser.add_argument("manifest", help="CSV or YAML manifest listing the jobs")
+    parser.add_argument("--out", default="output", help="Output directory for PDF/DOCX files")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yaml"), help="Page and document sizes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f)
+    jobs = load_manifest(args.manifest, config)
+    os.makedirs(args.out, exist_ok=True)
+
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(_run, job, config, args.out): job["name"] for job in jobs}
+        for future in as_completed(futures):
+            try:
+                name, written = future.result()
+                print(f"✅ {name}: {', '.join(os.path.basename(p) for p in written)}")
+            except Exception as e:
+                failed += 1
+                print(f"❌ {futures[future]}: {e}", file=sys.stderr)
+    print(f"{len(jobs) - failed}/{len(jobs)} jobs done in {time.perf_counter() - start:.1f}s")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""Benchmarks for the image, layout and export paths.
+
+Run every case (each in a fresh worker process so peak RSS is per case) and save the results:
+    python -m benchmarks.bench run --out bench.json [--filter layout] [--quick]
+
+Compare two runs; exits non-zero if any case got slower (or bigger) than the threshold:
+    python -m benchmarks.bench compare before.json after.json [--threshold 0.10]
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+
+import numpy as np
+import yaml
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.image_utils import enhance_image, crop_image_relative, make_canvas_with_image
+from utils.layout_utils import get_valid_grids, grid_positions, center_position, front_back_positions, stacked_positions
+from utils.pdf_utils import save_image_as_pdf, save_layout_as_pdf
+from utils.word_utils import save_image_as_word
+from utils.merge_utils import split_pdf_to_zip, merge_pdfs
+from utils.raster_utils import compose_page, save_layout_as_raster
+from utils.ingest_utils import decode_full, decode_proxy
+
+DPIS = (72, 150, 300, 600)
+QUICK_DPIS = (150, 300)
+IMAGE_SIZES = {
+    "1000px": (1000, 630),
+    "4000px": (4000, 2520),
+    "12mp": (4000, 3000),
+}
+ENHANCE = dict(brightness=1.15, contrast=1.2, sharpness=1.5, grayscale=False)
+
+def load_config():
+    with open(os.path.join(ROOT, "config.yaml"), "r") as f:
+        return yaml.safe_load(f)
+
+@lru_cache(maxsize=None)
+def synthetic_image(size_name):
+    """Deterministic photo-like image: smooth gradients plus sensor-like noise (compresses like a real scan)."""
+    w, h = IMAGE_SIZES[size_name]
+    rng = np.random.default_rng(0)
+    out = np.empty((h, w, 3), dtype=np.uint8)
+    x = np.arange(w, dtype=np.float32)
+    # Built in bands so the setup does not dominate the peak RSS of the case being measured
+    for top in range(0, h, 256):
+        y = np.arange(top, min(top + 256, h), dtype=np.float32)[:, None]
+        band = out[top:top + len(y)]
+        band[..., 0] = np.clip(x / w * 200 + rng.normal(0, 12, (len(y), w)), 0, 255)
+        band[..., 1] = np.clip(y / h * 200 + rng.normal(0, 12, (len(y), w)), 0, 255)
+        band[..., 2] = np.clip((x + y) / (w + h) * 255 + rng.normal(0, 12, (len(y), w)), 0, 255)
+    return Image.fromarray(out)
+
+@lru_cache(maxsize=None)
+def synthetic_jpeg(size_name):
+    buffer = BytesIO()
+    synthetic_image(size_name).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+@lru_cache(maxsize=None)
+def synthetic_pdf(n_pages):
+    buffer = save_layout_as_pdf([synthetic_image("1000px")], [(1.0, 1.0, False)], 8.27, 11.69, 3.375, 2.125, dpi=150)
+    merged = merge_pdfs([BytesIO(buffer.getvalue()) for _ in range(n_pages)])
+    return merged.getvalue()
+
+def _output_size(result):
+    if isinstance(result, BytesIO):
+        return result.getbuffer().nbytes
+    if isinstance(result, tuple) and result and isinstance(result[0], BytesIO):
+        return result[0].getbuffer().nbytes
+    if isinstance(result, Image.Image):
+        return result.width * result.height * len(result.getbands())
+    return 0
+
+# --- cases -----------------------------------------------------------------------------------------
+
+def _layout(mode, config, page_name, doc_name, dpi):
+    page = config["page_sizes"][page_name]
+    doc = config["document_sizes"][doc_name]
+    pw, ph, dw, dh = page["width_inch"], page["height_inch"], doc["width_inch"], doc["height_inch"]
+    if mode == "grid":
+        grids = get_valid_grids(pw, ph, dw, dh)
+        if not grids:
+            return None
+        cols, rows, rot = max(grids, key=lambda g: g[0] * g[1])
+        positions = grid_positions(pw, ph, dw, dh, cols, rows, rotate=rot, dpi=dpi)
+    elif mode == "center":
+        positions = [center_position(pw, ph, dw, dh, dpi=dpi)]
+    elif mode == "front_back":
+        positions = front_back_positions(pw, ph, dw, dh, dpi=dpi)
+    else:
+        positions, _ = stacked_positions(pw, ph, dw, dh, 4, dpi=dpi)
+    return pw, ph, dw, dh, positions
+
+def build_cases(quick=False):
+    """Return {case_name: (function_name, args)}; functions are looked up in this module in the worker."""
+    config = load_config()
+    dpis = QUICK_DPIS if quick else DPIS
+    sizes = ("1000px", "12mp") if quick else tuple(IMAGE_SIZES)
+    cases = {}
+    for size in sizes:
+        cases[f"enhance/{size}"] = ("case_enhance", (size,))
+        cases[f"crop/{size}"] = ("case_crop", (size,))
+        cases[f"ingest_proxy/{size}"] = ("case_ingest", (size, 400))
+        cases[f"ingest_full/{size}"] = ("case_ingest", (size, None))
+    for page_name in config["page_sizes"]:
+        for dpi in dpis:
+            cases[f"canvas/{page_name}/{dpi}"] = ("case_canvas", (page_name, dpi))
+            cases[f"pdf_bitmap/{page_name}/{dpi}"] = ("case_pdf_bitmap", (page_name, dpi))
+            for doc_name in config["document_sizes"]:
+                for mode in ("grid", "center", "front_back", "multi"):
+                    cases[f"layout_pdf/{mode}/{page_name}/{doc_name}/{dpi}"] = ("case_layout_pdf", (mode, page_name, doc_name, dpi))
+                cases[f"layout_word/grid/{page_name}/{doc_name}/{dpi}"] = ("case_layout_word", ("grid", page_name, doc_name, dpi))
+                cases[f"compose/grid/{page_name}/{doc_name}/{dpi}"] = ("case_compose", ("grid", page_name, doc_name, dpi))
+                for fmt in ("png", "tiff"):
+                    cases[f"raster_{fmt}/grid/{page_name}/{doc_name}/{dpi}"] = ("case_raster", (fmt, page_name, doc_name, dpi))
+    for n_pages in ((20,) if quick else (20, 300)):
+        cases[f"split/{n_pages}"] = ("case_split", (n_pages,))
+        cases[f"merge/{n_pages}"] = ("case_merge", (n_pages,))
+    return cases
+
+def case_enhance(size):
+    return lambda: enhance_image(synthetic_image(size), **ENHANCE)
+
+def case_crop(size):
+    return lambda: crop_image_relative(synthetic_image(size), 0.05, 0.05, 0.05, 0.05)
+
+def case_ingest(size, max_width):
+    data = synthetic_jpeg(size)
+    return lambda: decode_proxy(data, max_width) if max_width else decode_full(data)
+
+def case_canvas(page_name, dpi):
+    page = load_config()["page_sizes"][page_name]
+    return lambda: make_canvas_with_image(page["width_inch"], page["height_inch"], synthetic_image("1000px"), 3.375, 2.125, dpi=dpi)
+
+def case_pdf_bitmap(page_name, dpi):
+    page = load_config()["page_sizes"][page_name]
+    bitmap = make_canvas_with_image(page["width_inch"], page["height_inch"], synthetic_image("1000px"), 3.375, 2.125, dpi=dpi)
+    return lambda: save_image_as_pdf(bitmap, page["width_inch"], page["height_inch"])
+
+def case_layout_pdf(mode, page_name, doc_name, dpi):
+    layout = _layout(mode, load_config(), page_name, doc_name, dpi)
+    if layout is None:
+        return None
+    pw, ph, dw, dh, positions = layout
+    img = synthetic_image("4000px")
+    return lambda: save_layout_as_pdf([img] * len(positions), positions, pw, ph, dw, dh, dpi=dpi)
+
+def case_layout_word(mode, page_name, doc_name, dpi):
+    layout = _layout(mode, load_config(), page_name, doc_name, dpi)
+    if layout is None:
+        return None
+    pw, ph, dw, dh, positions = layout
+    img = synthetic_image("4000px")
+    return lambda: save_image_as_word([img] * len(positions), positions, pw, ph, dw, dh, dpi=dpi)
+
+def case_compose(mode, page_name, doc_name, dpi):
+    layout = _layout(mode, load_config(), page_name, doc_name, dpi)
+    if layout is None:
+        return None
+    pw, ph, dw, dh, positions = layout
+    img = synthetic_image("4000px")
+    return lambda: compose_page([img] * len(positions), positions, pw, ph, dw, dh, dpi=dpi)
+
+def case_raster(fmt, page_name, doc_name, dpi):
+    layout = _layout("grid", load_config(), page_name, doc_name, dpi)
+    if layout is None:
+        return None
+    pw, ph, dw, dh, positions = layout
+    img = synthetic_image("4000px")
+    return lambda: save_layout_as_raster([img] * len(positions), positions, pw, ph, dw, dh, dpi=dpi, fmt=fmt)
+
+def case_split(n_pages):
+    data = synthetic_pdf(n_pages)
+    return lambda: split_pdf_to_zip(BytesIO(data))
+
+def case_merge(n_pages):
+    data = synthetic_pdf(n_pages)
+    return lambda: merge_pdfs([BytesIO(data), BytesIO(data)])
+
+# --- runner ----------------------------------------------------------------------------------------
+
+def _rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_case(name, function_name, args, repeat):
+    setup = globals()[function_name](*args)
+    if setup is None:
+        return name, None
+    start_rss = _rss_mb()
+    times = []
+    size = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = setup()
+        times.append(time.perf_counter() - t0)
+        size = _output_size(result)
+        del result
+    return name, {
+        "seconds": min(times),
+        "peak_rss_mb": _rss_mb(),
+        "rss_delta_mb": _rss_mb() - start_rss,
+        "output_bytes": size,
+    }
+
+def run(args):
+    cases = build_cases(quick=args.quick)
+    if args.filter:
+        cases = {k: v for k, v in cases.items() if args.filter in k}
+    results = {}
+    # One task per worker process so each case starts from a clean memory high-water mark
+    with ProcessPoolExecutor(max_workers=args.workers, max_tasks_per_child=1) as pool:
+        futures = [pool.submit(run_case, name, fn, fargs, args.repeat) for name, (fn, fargs) in cases.items()]
+        for future in futures:
+            name, result = future.result()
+            if result is None:
+                continue
+            results[name] = result
+            print(f"{name:55s} {result['seconds'] * 1000:9.1f} ms {result['peak_rss_mb']:8.1f} MB {result['output_bytes'] / 1024:10.1f} KB")
+    with open(args.out, "w") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, indent=1, sort_keys=True)
+    print(f"Saved {len(results)} results to {args.out}")
+    return 0
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)["results"]
+    with open(args.after) as f:
+        after = json.load(f)["results"]
+    regressions = 0
+    for name in sorted(set(before) & set(after)):
+        old, new = before[name], after[name]
+        flags = []
+        # Peak RSS includes the interpreter and the inputs; the delta is what the case itself allocated
+        for metric in ("seconds", "rss_delta_mb", "output_bytes"):
+            if old[metric] and new[metric] > old[metric] * (1 + args.threshold):
+                flags.append(f"{metric} {new[metric] / old[metric]:.2f}x")
+        ratio = new["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+        if flags or args.verbose:
+            print(f"{'REGRESSION' if flags else 'ok':10s} {name:55s} time {ratio:6.2f}x {', '.join(flags)}")
+        regressions += bool(flags)
+    for name in sorted(set(before) ^ set(after)):
+        print(f"{'only in ' + ('before' if name in before else 'after'):10s} {name}")
+    print(f"{regressions} regression(s) over {args.threshold:.0%} in {len(set(before) & set(after))} shared cases")
+    return 1 if regressions else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the card-print rendering paths.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="Run the benchmarks and save results as JSON")
+    run_parser.add_argument("--out", default="bench.json")
+    run_parser.add_argument("--filter", default="", help="Only run cases whose name contains this string")
+    run_parser.add_argument("--quick", action="store_true", help="Fewer DPIs, image sizes and PDF sizes")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the fastest is reported")
+    run_parser.add_argument("--workers", type=int, default=1, help="Parallel workers (1 gives the most stable timings)")
+    compare_parser = sub.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative increase (default 10%%)")
+    compare_parser.add_argument("--verbose", action="store_true", help="Also list cases without regressions")
+    args = parser.parse_args(argv)
+    return run(args) if args.command == "run" else compare(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,11 @@
 import streamlit as st
-from PIL import Image
-from io import BytesIO
-from utils.image_utils import enhance_image, crop_image_relative, make_canvas_with_image
-from utils.pdf_utils import save_image_as_pdf
-from utils.word_utils import save_image_as_word
-
-@st.cache_data
-def load_and_resize_image(file_bytes, max_width=1000):
-    img = Image.open(BytesIO(file_bytes)).convert("RGB")
-    if img.width > max_width:
-        ratio = max_width / img.width
-        img = img.resize((max_width, int(img.height * ratio)))
-    return img
-
-@st.cache_data
-def cached_enhance_image(img_bytes, brightness, contrast, sharpness, grayscale):
-    img = Image.open(BytesIO(img_bytes))
-    return enhance_image(img, brightness, contrast, sharpness, grayscale)
+from utils.image_utils import make_canvas_with_image, render_layout_preview
+from utils.cache_utils import load_image, deskew_stage, crop_stage, enhance_stage, export_source_cached
+from utils.autocrop_utils import autocrop_into
+from utils.session_utils import session_store
+from utils.upload_utils import session_uploads, forget_uploads
+from utils.layout_utils import center_position
+from utils.export_utils import EXPORT_MIME
 
 def render(st, config):
     PREVIEW_WIDTH = 600
@@ -31,6 +20,10 @@ def render(st, config):
     DOC_WIDTH_INCH = doc_size['width_inch']
     DOC_HEIGHT_INCH = doc_size['height_inch']
     dpi = config.get('dpi', 300)
+    pdf_profile = config.get('pdf_profile')
+    pdf_max_bytes = config.get('pdf_max_bytes')
+    raster_format = config.get('raster_format')
+    raster_dpi = config.get('raster_dpi', dpi)
 
     auto_rotate = st.checkbox('Auto-Rotate', value=False, key='auto_rotate_id_center')
 
@@ -40,12 +33,16 @@ def render(st, config):
         st.session_state.preview_ready_center = False
     if 'cropped_img_center' not in st.session_state:
         st.session_state.cropped_img_center = None
+    # The upload (spooled to disk if large, see upload_utils), the layout preview and export buffers live in
+    # the session store, which may spill the latter two to disk
+    store = session_store(st.session_state)
 
     if not st.session_state.image_uploaded_center:
         uploaded_file1 = st.file_uploader("Upload a document image.", type=["jpg", "jpeg", "png"], key="center")
         if uploaded_file1:
-            img_bytes = uploaded_file1.read()
-            st.session_state.original_image_center = load_and_resize_image(img_bytes)
+            upload = session_uploads(st.session_state, "center", uploaded_file1)
+            store.put("original_upload_center", upload)
+            st.session_state.original_key_center, st.session_state.original_image_center = load_image(upload, max_width=PREVIEW_WIDTH)
             st.session_state.image_uploaded_center = True
             st.success("✅ Image uploaded. You can now crop and edit it below.")
 
@@ -53,14 +50,17 @@ def render(st, config):
         st.subheader("✂️ Crop Image (relative to width/height)")
         img = st.session_state.original_image_center
         st.image(img, caption="Original Image", width=PREVIEW_WIDTH)
+        st.button("✨ Auto-crop", key="autocrop_center", on_click=autocrop_into, args=(st.session_state, img, dict(left="left_crop_center", top="top_crop_center", right="right_crop_center", bottom="bottom_crop_center", deskew="deskew_center"), st.toast))
+        deskew = st.slider("Deskew (°)", -10.0, 10.0, 0.0, 0.1, key="deskew_center")
         col1, col2 = st.columns(2)
         with col1:
-            rel_left = st.slider("Left Crop (%)", 0, 50, 0, 1, key="left_crop_center") / 100.0
-            rel_right = st.slider("Right Crop (%)", 0, 50, 0, 1, key="right_crop_center") / 100.0
+            rel_left = st.slider("Left Crop (%)", 0.0, 50.0, 0.0, 0.1, key="left_crop_center") / 100.0
+            rel_right = st.slider("Right Crop (%)", 0.0, 50.0, 0.0, 0.1, key="right_crop_center") / 100.0
         with col2:
-            rel_top = st.slider("Top Crop (%)", 0, 50, 0, 1, key="top_crop_center") / 100.0
-            rel_bottom = st.slider("Bottom Crop (%)", 0, 50, 0, 1, key="bottom_crop_center") / 100.0
-        cropped_img = crop_image_relative(img, rel_left, rel_top, rel_right, rel_bottom)
+            rel_top = st.slider("Top Crop (%)", 0.0, 50.0, 0.0, 0.1, key="top_crop_center") / 100.0
+            rel_bottom = st.slider("Bottom Crop (%)", 0.0, 50.0, 0.0, 0.1, key="bottom_crop_center") / 100.0
+        deskew_key, deskewed_img = deskew_stage(st.session_state.original_key_center, img, deskew)
+        crop_key, cropped_img = crop_stage(deskew_key, deskewed_img, rel_left, rel_top, rel_right, rel_bottom)
         st.session_state.cropped_img_center = cropped_img
         st.image(cropped_img, caption="Cropped Image", width=PREVIEW_WIDTH)
 
@@ -70,49 +70,50 @@ def render(st, config):
         contrast = st.slider("Contrast", 0.1, 5.0, 1.0, 0.05, key="contrast_center")
         sharpness = st.slider("Sharpness", 0.1, 5.0, 1.0, 0.05, key="sharpness_center")
 
-        img_bytes = BytesIO()
-        cropped_img.save(img_bytes, format='PNG')
-        img_bytes = img_bytes.getvalue()
-        edited_preview = cached_enhance_image(img_bytes, brightness, contrast, sharpness, grayscale)
+        _, edited_preview = enhance_stage(crop_key, cropped_img, brightness, contrast, sharpness, grayscale)
         preview_img = edited_preview.copy()
         preview_img.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH))
         st.image(preview_img, caption="🔍 Edited Preview", width=PREVIEW_WIDTH)
+        # Edit list: previews run on the proxy, the export replays it once on the full-resolution original
+        st.session_state.edits_center = [
+            ("deskew", deskew),
+            ("crop", (rel_left, rel_top, rel_right, rel_bottom)),
+            ("enhance", dict(brightness=brightness, contrast=contrast, sharpness=sharpness, grayscale=grayscale)),
+        ]
 
         if st.button("🧱 Place on Center & Generate PDF/Word"):
-            # Use reusable utility to make canvas and place image at center
-            if auto_rotate and DOC_WIDTH_INCH < DOC_HEIGHT_INCH:
-                img_w, img_h = DOC_HEIGHT_INCH, DOC_WIDTH_INCH
-                rotated = True
-            else:
-                img_w, img_h = DOC_WIDTH_INCH, DOC_HEIGHT_INCH
-                rotated = False
-            page_px = (int(PAGE_WIDTH_INCH * dpi), int(PAGE_HEIGHT_INCH * dpi))
-            img_px = (int(img_w * dpi), int(img_h * dpi))
-            page = Image.new("RGB", page_px, "white")
-            img_to_paste = edited_preview.rotate(90, expand=True) if rotated else edited_preview
-            x = (page_px[0] - img_px[0]) // 2
-            y = (page_px[1] - img_px[1]) // 2
-            page.paste(img_to_paste.resize(img_px), (x, y))
-            images = [edited_preview]
-            positions = [(x / dpi, y / dpi, rotated)]
+            from utils.pdf_utils import save_layout_as_pdf
+            from utils.word_utils import save_image_as_word
+            rotated = auto_rotate and DOC_WIDTH_INCH < DOC_HEIGHT_INCH
+            images = [export_source_cached(store.get("original_upload_center"), st.session_state.edits_center)]
+            positions = [center_position(PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, rotate=rotated, dpi=dpi)]
             st.session_state.preview_ready_center = True
-            st.session_state.preview_img_center = page.copy()
-            st.session_state.pdf_data_center = save_image_as_pdf(page, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH)
-            st.session_state.word_data_center = save_image_as_word(images, positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi=dpi, auto_rotate=rotated)
+            store.put("preview_img_center", render_layout_preview([edited_preview], positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, width=PREVIEW_WIDTH))
+            store.put("pdf_data_center", save_layout_as_pdf(images, positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi=dpi, profile=pdf_profile, max_bytes=pdf_max_bytes))
+            store.put("word_data_center", save_image_as_word(images, positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi=dpi, auto_rotate=rotated))
+            store.put("raster_data_center", None)
+            st.session_state.raster_format_center = raster_format
+            if raster_format:
+                from utils.raster_utils import save_layout_as_raster
+                store.put("raster_data_center", save_layout_as_raster(images, positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi=raster_dpi, fmt=raster_format))
 
     if st.session_state.get("preview_ready_center", False):
         st.subheader("🖼 Final Layout (Document Centered on Page)")
-        preview_img = st.session_state.preview_img_center.copy()
+        preview_img = store.get("preview_img_center").copy()
         preview_img.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH))
         st.image(preview_img, use_container_width=True)
-        st.download_button("📄 Download PDF", data=st.session_state.pdf_data_center, file_name="Document_Centered.pdf", mime="application/pdf")
-        st.download_button("📝 Download Word", data=st.session_state.word_data_center, file_name="Document_Centered.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+        st.download_button("📄 Download PDF", data=store.reader("pdf_data_center"), file_name="Document_Centered.pdf", mime=EXPORT_MIME["pdf"])
+        st.download_button("📝 Download Word", data=store.reader("word_data_center"), file_name="Document_Centered.docx", mime=EXPORT_MIME["docx"])
+        if "raster_data_center" in store:
+            fmt = st.session_state.raster_format_center
+            st.download_button(f"🖨️ Download {fmt.upper()}", data=store.reader("raster_data_center"), file_name=f"Document_Centered.{fmt}", mime=EXPORT_MIME[fmt])
         if st.button("🔁 Reset Center"):
             st.session_state.image_uploaded_center = False
             st.session_state.preview_ready_center = False
             st.session_state.cropped_img_center = None
             st.session_state.original_image_center = None
-            st.session_state.preview_img_center = None
-            st.session_state.pdf_data_center = None
-            st.session_state.word_data_center = None
+            forget_uploads(st.session_state, "center")
+            for name in ("original_upload_center", "preview_img_center", "pdf_data_center", "word_data_center", "raster_data_center"):
+                store.pop(name)
+            st.session_state.edits_center = None
             st.rerun() 
\ No newline at end of file
@@ -1,25 +1,128 @@
 import streamlit as st
-from PIL import Image
-from io import BytesIO
-from utils.image_utils import enhance_image, crop_image_relative, make_canvas_with_image
-from utils.pdf_utils import save_image_as_pdf
-from utils.word_utils import save_image_as_word
+from utils.image_utils import make_canvas_with_image, render_layout_preview
+from utils.cache_utils import load_image, deskew_stage, crop_stage, enhance_stage, export_source_cached, load_preview, edit_previews, map_images
+from utils.export_utils import export_fingerprint, session_exports, layout_encoders, pages_encoders, download_buttons
+from utils.autocrop_utils import autocrop_into
+from utils.layout_utils import front_back_positions, get_valid_grids, duplex_positions
+from utils.upload_utils import session_uploads
 
-@st.cache_data
-def load_and_resize_image(file_bytes, max_width=1000):
-    img = Image.open(BytesIO(file_bytes)).convert("RGB")
-    if img.width > max_width:
-        ratio = max_width / img.width
-        img = img.resize((max_width, int(img.height * ratio)))
-    return img
+DUPLEX_PREVIEW_WIDTH = 280
+# Appended to a back's edit list when the sheet turns the card top over bottom; PIL transposes it losslessly
+TURN_180 = ("deskew", 180)
 
-@st.cache_data
-def cached_enhance_image(img_bytes, brightness, contrast, sharpness, grayscale):
-    img = Image.open(BytesIO(img_bytes))
-    return enhance_image(img, brightness, contrast, sharpness, grayscale)
+def _side_controls(st, label, suffix, img, original_preview):
+    """One card side's auto-crop, deskew, crop and enhancement widgets; returns (edit list, slot for the edited preview)."""
+    st.image(original_preview, caption=f"Original {label}", width=DUPLEX_PREVIEW_WIDTH)
+    keys = dict(left=f"left_crop_{suffix}", top=f"top_crop_{suffix}", right=f"right_crop_{suffix}", bottom=f"bottom_crop_{suffix}", deskew=f"deskew_{suffix}")
+    st.button(f"✨ Auto-crop ({label})", key=f"autocrop_{suffix}", on_click=autocrop_into, args=(st.session_state, img, keys, st.toast))
+    deskew = st.slider(f"Deskew (°) ({label})", -10.0, 10.0, 0.0, 0.1, key=keys["deskew"])
+    rel_left = st.slider(f"Left Crop % ({label})", 0.0, 50.0, 0.0, 0.1, key=keys["left"]) / 100.0
+    rel_right = st.slider(f"Right Crop % ({label})", 0.0, 50.0, 0.0, 0.1, key=keys["right"]) / 100.0
+    rel_top = st.slider(f"Top Crop % ({label})", 0.0, 50.0, 0.0, 0.1, key=keys["top"]) / 100.0
+    rel_bottom = st.slider(f"Bottom Crop % ({label})", 0.0, 50.0, 0.0, 0.1, key=keys["bottom"]) / 100.0
+    grayscale = st.toggle(f"Grayscale ({label})", key=f"grayscale_{suffix}")
+    brightness = st.slider(f"Brightness ({label})", 0.1, 5.0, 1.0, 0.05, key=f"brightness_{suffix}")
+    contrast = st.slider(f"Contrast ({label})", 0.1, 5.0, 1.0, 0.05, key=f"contrast_{suffix}")
+    sharpness = st.slider(f"Sharpness ({label})", 0.1, 5.0, 1.0, 0.05, key=f"sharpness_{suffix}")
+    edits = [
+        ("deskew", deskew),
+        ("crop", (rel_left, rel_top, rel_right, rel_bottom)),
+        ("enhance", dict(brightness=brightness, contrast=contrast, sharpness=sharpness, grayscale=grayscale)),
+    ]
+    return edits, st.empty()
+
+def render_duplex(st, config):
+    """
+    Many front/back pairs on double-sided sheets: fronts N-up on odd pages, each back on the next page in the
+    slot mirrored about the sheet's flip edge, so they register when printed duplex. One PDF for all sheets.
+    """
+    page_sizes = config['page_sizes']
+    doc_sizes = config['document_sizes']
+    page_size_name = st.selectbox('Select page size', list(page_sizes.keys()), index=0, key="page_size_duplex")
+    doc_type = st.selectbox('Select document type', list(doc_sizes.keys()), index=0, key="doc_type_duplex")
+    PAGE_WIDTH_INCH = page_sizes[page_size_name]['width_inch']
+    PAGE_HEIGHT_INCH = page_sizes[page_size_name]['height_inch']
+    DOC_WIDTH_INCH = doc_sizes[doc_type]['width_inch']
+    DOC_HEIGHT_INCH = doc_sizes[doc_type]['height_inch']
+    dpi = config.get('dpi', 300)
+    pdf_profile = config.get('pdf_profile')
+    pdf_max_bytes = config.get('pdf_max_bytes')
+
+    auto_rotate = st.checkbox('Auto-Rotate for Best Fit', value=False, key='auto_rotate_duplex')
+    valid_grids = get_valid_grids(PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, allow_rotate=auto_rotate)
+    if not valid_grids:
+        st.warning("This document does not fit on the selected page.")
+        return
+    grid_labels = [f"{cols} x {rows} ({cols*rows} per sheet){' (rotated)' if rot else ''}" for cols, rows, rot in valid_grids]
+    # Default to the grid that fits the most cards, preferring no rotation
+    best = max(range(len(valid_grids)), key=lambda i: (valid_grids[i][0] * valid_grids[i][1], not valid_grids[i][2]))
+    columns, rows, use_rotate = valid_grids[grid_labels.index(st.selectbox("Cards per sheet", grid_labels, index=best, key="grid_duplex"))]
+    flip = st.radio("Printer duplex setting", ["Flip on long edge", "Flip on short edge"], horizontal=True, key="flip_duplex", help="Use the same setting in the print dialog. Backs are mirrored about that edge so each one lands behind its front.")
+
+    fronts = st.file_uploader("Upload front sides", type=["jpg", "jpeg", "png"], accept_multiple_files=True, key="duplex_fronts")
+    backs = st.file_uploader("Upload back sides (in the same order as the fronts)", type=["jpg", "jpeg", "png"], accept_multiple_files=True, key="duplex_backs")
+    if not fronts or not backs:
+        return
+    if len(fronts) != len(backs):
+        st.warning(f"{len(fronts)} front(s) but {len(backs)} back(s); upload one back per front.")
+        return
+    n_cards = len(fronts)
+    # Fronts then backs; every side is decoded and edited on its own (and cached on its own)
+    sources = session_uploads(st.session_state, "duplex_fronts", fronts) + session_uploads(st.session_state, "duplex_backs", backs)
+    loaded = map_images(load_preview, sources, [DUPLEX_PREVIEW_WIDTH] * len(sources))
+    source_keys = [key for key, _, _ in loaded]
+    proxies = [img for _, img, _ in loaded]
+    edits = [None] * len(sources)
+    slots = [None] * len(sources)
+    for card in range(n_cards):
+        with st.expander(f"Card {card + 1}: {fronts[card].name} / {backs[card].name}", expanded=n_cards == 1):
+            col_front, col_back = st.columns(2)
+            for col, side, index in ((col_front, "Front", card), (col_back, "Back", n_cards + card)):
+                with col:
+                    _, img, original_preview = loaded[index]
+                    edits[index], slots[index] = _side_controls(st, f"{side} {card + 1}", f"duplex_{side.lower()}_{card}", img, original_preview)
+    results = map_images(edit_previews, source_keys, proxies, edits, [DUPLEX_PREVIEW_WIDTH] * len(sources))
+    for index, (_, _, edited_preview) in enumerate(results):
+        slots[index].image(edited_preview, caption="Edited", width=DUPLEX_PREVIEW_WIDTH)
+
+    front_positions, back_positions, turn_backs = duplex_positions(PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, columns, rows, rotate=use_rotate, flip="long" if "long" in flip else "short", dpi=dpi)
+    export_edits = [e + [TURN_180] if turn_backs and index >= n_cards else e for index, e in enumerate(edits)]
+    per_sheet = len(front_positions)
+    pages = []
+    for first in range(0, n_cards, per_sheet):
+        cards = list(range(first, min(n_cards, first + per_sheet)))
+        sizes = [(DOC_WIDTH_INCH, DOC_HEIGHT_INCH)] * len(cards)
+        pages.append((cards, front_positions[:len(cards)], sizes))
+        pages.append(([n_cards + card for card in cards], back_positions[:len(cards)], sizes))
+
+    st.markdown("---")
+    st.subheader(f"🖼 {n_cards} card(s) on {len(pages) // 2} sheet(s)")
+    edited = [img.rotate(180) if turn_backs and index >= n_cards else img for index, (img, _, _) in enumerate(results)]
+    for sheet in range(len(pages) // 2):
+        with st.expander(f"Sheet {sheet + 1} (pages {2 * sheet + 1}-{2 * sheet + 2})", expanded=sheet == 0):
+            for col, (indices, positions, sizes), side in zip(st.columns(2), pages[2 * sheet:2 * sheet + 2], ("Fronts", "Backs (as printed on the next page)")):
+                with col:
+                    preview_img = render_layout_preview([edited[i] for i in indices], positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, None, None, width=DUPLEX_PREVIEW_WIDTH, sizes=sizes)
+                    st.image(preview_img, caption=side, width=DUPLEX_PREVIEW_WIDTH)
+
+    exports = session_exports(st.session_state, "exports_duplex", "id_front_back.duplex")
+    fingerprint = export_fingerprint(source_keys, export_edits, pages, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, dpi, pdf_profile, pdf_max_bytes)
+    def export_source(index):
+        # Produced page by page while the PDF is written, rather than every card up front
+        return export_source_cached(sources[index], export_edits[index])
+    exports.update(
+        fingerprint,
+        lambda: export_source,
+        pages_encoders(pages, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, dpi=dpi, profile=pdf_profile, max_bytes=pdf_max_bytes),
+    )
+    download_buttons(st, exports, "Duplex_Cards", key="download_duplex")
 
 def render(st, config):
     PREVIEW_WIDTH = 600
+    mode = st.radio("Layout", ["Single card", "Duplex sheets (many cards)"], horizontal=True, key="mode_front_back", help="Duplex puts many cards on double-sided sheets: fronts on one page, backs behind them on the next.")
+    if mode != "Single card":
+        render_duplex(st, config)
+        return
     page_sizes = config['page_sizes']
     doc_sizes = config['document_sizes']
     page_size_name = st.selectbox('Select page size', list(page_sizes.keys()), index=0, key="page_size_id_front_back")
@@ -31,6 +134,10 @@ def render(st, config):
     DOC_WIDTH_INCH = doc_size['width_inch']
     DOC_HEIGHT_INCH = doc_size['height_inch']
     dpi = config.get('dpi', 300)
+    pdf_profile = config.get('pdf_profile')
+    pdf_max_bytes = config.get('pdf_max_bytes')
+    raster_format = config.get('raster_format')
+    raster_dpi = config.get('raster_dpi', dpi)
 
     st.subheader("Upload Front and Back Images")
     front = st.file_uploader("Upload Front Side", type=["jpg", "jpeg", "png"], key="front")
@@ -39,77 +146,76 @@ def render(st, config):
         st.success("Both images uploaded. You can now crop and edit them below.")
         # --- Front ---
         st.markdown("---\n**Front Side**")
-        img_bytes = front.read()
-        img_front = load_and_resize_image(img_bytes)
+        front_upload = session_uploads(st.session_state, "front", front)
+        key_front, img_front = load_image(front_upload, max_width=PREVIEW_WIDTH)
         st.image(img_front, caption="Original Front", width=PREVIEW_WIDTH)
+        st.button("✨ Auto-crop (Front)", key="autocrop_front", on_click=autocrop_into, args=(st.session_state, img_front, dict(left="left_crop_front", top="top_crop_front", right="right_crop_front", bottom="bottom_crop_front", deskew="deskew_front"), st.toast))
+        deskew_f = st.slider("Deskew (°) (Front)", -10.0, 10.0, 0.0, 0.1, key="deskew_front")
         col1, col2 = st.columns(2)
         with col1:
-            rel_left = st.slider("Left Crop % (Front)", 0, 50, 0, 1, key="left_crop_front") / 100.0
-            rel_right = st.slider("Right Crop % (Front)", 0, 50, 0, 1, key="right_crop_front") / 100.0
+            rel_left = st.slider("Left Crop % (Front)", 0.0, 50.0, 0.0, 0.1, key="left_crop_front") / 100.0
+            rel_right = st.slider("Right Crop % (Front)", 0.0, 50.0, 0.0, 0.1, key="right_crop_front") / 100.0
         with col2:
-            rel_top = st.slider("Top Crop % (Front)", 0, 50, 0, 1, key="top_crop_front") / 100.0
-            rel_bottom = st.slider("Bottom Crop % (Front)", 0, 50, 0, 1, key="bottom_crop_front") / 100.0
-        cropped_front = crop_image_relative(img_front, rel_left, rel_top, rel_right, rel_bottom)
+            rel_top = st.slider("Top Crop % (Front)", 0.0, 50.0, 0.0, 0.1, key="top_crop_front") / 100.0
+            rel_bottom = st.slider("Bottom Crop % (Front)", 0.0, 50.0, 0.0, 0.1, key="bottom_crop_front") / 100.0
+        deskew_key_front, deskewed_front = deskew_stage(key_front, img_front, deskew_f)
+        crop_key_front, cropped_front = crop_stage(deskew_key_front, deskewed_front, rel_left, rel_top, rel_right, rel_bottom)
         st.image(cropped_front, caption="Cropped Front", width=PREVIEW_WIDTH)
         grayscale_f = st.toggle("Grayscale (Front)", key="grayscale_front")
         brightness_f = st.slider("Brightness (Front)", 0.1, 5.0, 1.0, 0.05, key="brightness_front")
         contrast_f = st.slider("Contrast (Front)", 0.1, 5.0, 1.0, 0.05, key="contrast_front")
         sharpness_f = st.slider("Sharpness (Front)", 0.1, 5.0, 1.0, 0.05, key="sharpness_front")
-        img_bytes_f = BytesIO()
-        cropped_front.save(img_bytes_f, format='PNG')
-        img_bytes_f = img_bytes_f.getvalue()
-        edited_front = cached_enhance_image(img_bytes_f, brightness_f, contrast_f, sharpness_f, grayscale_f)
+        _, edited_front = enhance_stage(crop_key_front, cropped_front, brightness_f, contrast_f, sharpness_f, grayscale_f)
         preview_img_f = edited_front.copy()
         preview_img_f.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH))
         st.image(preview_img_f, caption="Edited Front Preview", width=PREVIEW_WIDTH)
+        # Edit lists: previews run on the proxy, the export replays them once on the full-resolution originals
+        edits_front = [
+            ("deskew", deskew_f),
+            ("crop", (rel_left, rel_top, rel_right, rel_bottom)),
+            ("enhance", dict(brightness=brightness_f, contrast=contrast_f, sharpness=sharpness_f, grayscale=grayscale_f)),
+        ]
         # --- Back ---
         st.markdown("---\n**Back Side**")
-        img_bytes = back.read()
-        img_back = load_and_resize_image(img_bytes)
+        back_upload = session_uploads(st.session_state, "back", back)
+        key_back, img_back = load_image(back_upload, max_width=PREVIEW_WIDTH)
         st.image(img_back, caption="Original Back", width=PREVIEW_WIDTH)
+        st.button("✨ Auto-crop (Back)", key="autocrop_back", on_click=autocrop_into, args=(st.session_state, img_back, dict(left="left_crop_back", top="top_crop_back", right="right_crop_back", bottom="bottom_crop_back", deskew="deskew_back"), st.toast))
+        deskew_b = st.slider("Deskew (°) (Back)", -10.0, 10.0, 0.0, 0.1, key="deskew_back")
         col1, col2 = st.columns(2)
         with col1:
-            rel_left = st.slider("Left Crop % (Back)", 0, 50, 0, 1, key="left_crop_back") / 100.0
-            rel_right = st.slider("Right Crop % (Back)", 0, 50, 0, 1, key="right_crop_back") / 100.0
+            rel_left = st.slider("Left Crop % (Back)", 0.0, 50.0, 0.0, 0.1, key="left_crop_back") / 100.0
+            rel_right = st.slider("Right Crop % (Back)", 0.0, 50.0, 0.0, 0.1, key="right_crop_back") / 100.0
         with col2:
-            rel_top = st.slider("Top Crop % (Back)", 0, 50, 0, 1, key="top_crop_back") / 100.0
-            rel_bottom = st.slider("Bottom Crop % (Back)", 0, 50, 0, 1, key="bottom_crop_back") / 100.0
-        cropped_back = crop_image_relative(img_back, rel_left, rel_top, rel_right, rel_bottom)
+            rel_top = st.slider("Top Crop % (Back)", 0.0, 50.0, 0.0, 0.1, key="top_crop_back") / 100.0
+            rel_bottom = st.slider("Bottom Crop % (Back)", 0.0, 50.0, 0.0, 0.1, key="bottom_crop_back") / 100.0
+        deskew_key_back, deskewed_back = deskew_stage(key_back, img_back, deskew_b)
+        crop_key_back, cropped_back = crop_stage(deskew_key_back, deskewed_back, rel_left, rel_top, rel_right, rel_bottom)
         st.image(cropped_back, caption="Cropped Back", width=PREVIEW_WIDTH)
         grayscale_b = st.toggle("Grayscale (Back)", key="grayscale_back")
         brightness_b = st.slider("Brightness (Back)", 0.1, 5.0, 1.0, 0.05, key="brightness_back")
         contrast_b = st.slider("Contrast (Back)", 0.1, 5.0, 1.0, 0.05, key="contrast_back")
         sharpness_b = st.slider("Sharpness (Back)", 0.1, 5.0, 1.0, 0.05, key="sharpness_back")
-        img_bytes_b = BytesIO()
-        cropped_back.save(img_bytes_b, format='PNG')
-        img_bytes_b = img_bytes_b.getvalue()
-        edited_back = cached_enhance_image(img_bytes_b, brightness_b, contrast_b, sharpness_b, grayscale_b)
+        _, edited_back = enhance_stage(crop_key_back, cropped_back, brightness_b, contrast_b, sharpness_b, grayscale_b)
         preview_img_b = edited_back.copy()
         preview_img_b.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH))
         st.image(preview_img_b, caption="Edited Back Preview", width=PREVIEW_WIDTH)
+        edits_back = [
+            ("deskew", deskew_b),
+            ("crop", (rel_left, rel_top, rel_right, rel_bottom)),
+            ("enhance", dict(brightness=brightness_b, contrast=contrast_b, sharpness=sharpness_b, grayscale=grayscale_b)),
+        ]
         # --- Layout ---
-        if st.button("🧱 Arrange & Generate PDF/Word"):
-            from PIL import Image as PILImage
-            page_px = (int(PAGE_WIDTH_INCH * dpi), int(PAGE_HEIGHT_INCH * dpi))
-            doc_px = (int(DOC_WIDTH_INCH * dpi), int(DOC_HEIGHT_INCH * dpi))
-            page = PILImage.new("RGB", page_px, "white")
-            # Place front on upper half, back on lower half, both centered
-            x = (page_px[0] - doc_px[0]) // 2
-            y_front = int(page_px[1] * 0.15)  # 15% from top
-            y_back = int(page_px[1] * 0.6)    # 60% from top
-            page.paste(edited_front.resize(doc_px), (x, y_front))
-            page.paste(edited_back.resize(doc_px), (x, y_back))
-            preview_img = page.copy()
-            preview_img.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH))
-            st.image(preview_img, caption="Final Layout Preview", width=PREVIEW_WIDTH)
-            images = [edited_front, edited_back]
-            positions = [
-                (x / dpi, y_front / dpi, False),
-                (x / dpi, y_back / dpi, False)
-            ]
-            pdf_data = save_image_as_pdf(page, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH)
-            word_data = save_image_as_word(images, positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi=dpi, auto_rotate=False)
-            st.download_button("📄 Download PDF", data=pdf_data, file_name="Front_Back.pdf", mime="application/pdf")
-            st.download_button("📝 Download Word", data=word_data, file_name="Front_Back.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
-            if st.button("🔁 Reset Front/Back"):
-                st.rerun() 
\ No newline at end of file
+        st.markdown("---")
+        positions = front_back_positions(PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi=dpi)
+        preview_img = render_layout_preview([edited_front, edited_back], positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, width=PREVIEW_WIDTH)
+        st.image(preview_img, caption="Final Layout Preview", width=PREVIEW_WIDTH)
+        # Kept in session state across reruns; encoded only when a download is clicked and the inputs changed
+        exports = session_exports(st.session_state, "exports_front_back", "id_front_back")
+        fingerprint = export_fingerprint(key_front, key_back, edits_front, edits_back, positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi, raster_format, raster_dpi, pdf_profile, pdf_max_bytes)
+        exports.update(
+            fingerprint,
+            lambda: [export_source_cached(front_upload, edits_front), export_source_cached(back_upload, edits_back)],
+            layout_encoders(positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi=dpi, auto_rotate=False, raster_format=raster_format, raster_dpi=raster_dpi, profile=pdf_profile, max_bytes=pdf_max_bytes),
+        )
+        download_buttons(st, exports, "Front_Back", key="download_front_back")
@@ -1,45 +1,14 @@
 import streamlit as st
-from PIL import Image
-from io import BytesIO
-from utils.image_utils import enhance_image, resize_image, crop_image_relative, make_canvas_with_image
-from utils.pdf_utils import save_image_as_pdf
-from utils.word_utils import save_image_as_word
+from utils.image_utils import resize_image, make_canvas_with_image, render_layout_preview
+from utils.cache_utils import load_image, deskew_stage, crop_stage, enhance_stage, export_source_cached
+from utils.autocrop_utils import autocrop_into
+from utils.session_utils import session_store
+from utils.upload_utils import session_uploads
+from utils.layout_utils import get_valid_grids, grid_positions
+from utils.export_utils import EXPORT_MIME
 from datetime import datetime
 import math
 
-@st.cache_data
-def load_and_resize_image(file_bytes, max_width=1000):
-    img = Image.open(BytesIO(file_bytes)).convert("RGB")
-    if img.width > max_width:
-        ratio = max_width / img.width
-        img = img.resize((max_width, int(img.height * ratio)))
-    return img
-
-@st.cache_data
-def cached_enhance_image(img_bytes, brightness, contrast, sharpness, grayscale):
-    img = Image.open(BytesIO(img_bytes))
-    return enhance_image(img, brightness, contrast, sharpness, grayscale)
-
-def get_valid_grids(page_w, page_h, doc_w, doc_h, min_space_inch=0.25, allow_rotate=False):
-    # Try all grid options up to 8 per page, return only those that fit
-    valid = []
-    for cols in range(1, 5):
-        for rows in range(1, 9):
-            n = cols * rows
-            if n > 8: continue
-            # Try without rotation
-            total_w = cols * doc_w + (cols - 1) * min_space_inch
-            total_h = rows * doc_h + (rows - 1) * min_space_inch
-            if total_w <= page_w and total_h <= page_h:
-                valid.append((cols, rows, False))
-            # Try with rotation if allowed
-            if allow_rotate and (doc_w != doc_h):
-                total_w_r = cols * doc_h + (cols - 1) * min_space_inch
-                total_h_r = rows * doc_w + (rows - 1) * min_space_inch
-                if total_w_r <= page_w and total_h_r <= page_h:
-                    valid.append((cols, rows, True))
-    return valid
-
 def render(st, config):
     PREVIEW_WIDTH = 600
     page_sizes = config['page_sizes']
@@ -53,6 +22,10 @@ def render(st, config):
     DOC_WIDTH_INCH = doc_size['width_inch']
     DOC_HEIGHT_INCH = doc_size['height_inch']
     dpi = config.get('dpi', 300)
+    pdf_profile = config.get('pdf_profile')
+    pdf_max_bytes = config.get('pdf_max_bytes')
+    raster_format = config.get('raster_format')
+    raster_dpi = config.get('raster_dpi', dpi)
 
     auto_rotate = st.checkbox('Auto-Rotate for Best Fit', value=False, key='auto_rotate_id_to_a4')
     valid_grids = get_valid_grids(PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, allow_rotate=auto_rotate)
@@ -69,12 +42,16 @@ def render(st, config):
         st.session_state.preview_ready = False
     if 'cropped_img' not in st.session_state:
         st.session_state.cropped_img = None
+    # The upload (spooled to disk if large, see upload_utils), the layout preview and export buffers live in
+    # the session store, which may spill the latter two to disk
+    store = session_store(st.session_state)
 
     if not st.session_state.image_uploaded:
         uploaded_file1 = st.file_uploader("Upload a document image.", type=["jpg", "jpeg", "png"])
         if uploaded_file1:
-            img_bytes = uploaded_file1.read()
-            st.session_state.original_image = load_and_resize_image(img_bytes)
+            upload = session_uploads(st.session_state, "id_to_a4", uploaded_file1)
+            store.put("original_upload", upload)
+            st.session_state.original_key, st.session_state.original_image = load_image(upload, max_width=PREVIEW_WIDTH)
             st.session_state.image_uploaded = True
             st.success("✅ Image uploaded. You can now crop and edit it below.")
 
@@ -82,14 +59,18 @@ def render(st, config):
         st.subheader("✂️ Crop Image (relative to width/height)")
         img = st.session_state.original_image
         st.image(img, caption="Original Image", width=PREVIEW_WIDTH)
+        # Detection writes the slider values before the sliders render; they stay adjustable afterwards
+        st.button("✨ Auto-crop", on_click=autocrop_into, args=(st.session_state, img, dict(left="left_crop", top="top_crop", right="right_crop", bottom="bottom_crop", deskew="deskew"), st.toast))
+        deskew = st.slider("Deskew (°)", -10.0, 10.0, 0.0, 0.1, key="deskew")
         col1, col2 = st.columns(2)
         with col1:
-            rel_left = st.slider("Left Crop (%)", 0, 50, 0, 1, key="left_crop") / 100.0
-            rel_right = st.slider("Right Crop (%)", 0, 50, 0, 1, key="right_crop") / 100.0
+            rel_left = st.slider("Left Crop (%)", 0.0, 50.0, 0.0, 0.1, key="left_crop") / 100.0
+            rel_right = st.slider("Right Crop (%)", 0.0, 50.0, 0.0, 0.1, key="right_crop") / 100.0
         with col2:
-            rel_top = st.slider("Top Crop (%)", 0, 50, 0, 1, key="top_crop") / 100.0
-            rel_bottom = st.slider("Bottom Crop (%)", 0, 50, 0, 1, key="bottom_crop") / 100.0
-        cropped_img = crop_image_relative(img, rel_left, rel_top, rel_right, rel_bottom)
+            rel_top = st.slider("Top Crop (%)", 0.0, 50.0, 0.0, 0.1, key="top_crop") / 100.0
+            rel_bottom = st.slider("Bottom Crop (%)", 0.0, 50.0, 0.0, 0.1, key="bottom_crop") / 100.0
+        deskew_key, deskewed_img = deskew_stage(st.session_state.original_key, img, deskew)
+        crop_key, cropped_img = crop_stage(deskew_key, deskewed_img, rel_left, rel_top, rel_right, rel_bottom)
         st.session_state.cropped_img = cropped_img
         st.image(cropped_img, caption="Cropped Image", width=PREVIEW_WIDTH)
 
@@ -99,50 +80,43 @@ def render(st, config):
         contrast = st.slider("Contrast", 0.1, 5.0, 1.0, 0.05)
         sharpness = st.slider("Sharpness", 0.1, 5.0, 1.0, 0.05)
 
-        img_bytes = BytesIO()
-        cropped_img.save(img_bytes, format='PNG')
-        img_bytes = img_bytes.getvalue()
-        edited_preview = cached_enhance_image(img_bytes, brightness, contrast, sharpness, grayscale)
+        _, edited_preview = enhance_stage(crop_key, cropped_img, brightness, contrast, sharpness, grayscale)
         preview_img = edited_preview.copy()
         preview_img.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH))
         st.image(preview_img, caption="🔍 Edited Preview", width=PREVIEW_WIDTH)
+        # Edit list: previews run on the proxy, the export replays it once on the full-resolution original
+        st.session_state.edits = [
+            ("deskew", deskew),
+            ("crop", (rel_left, rel_top, rel_right, rel_bottom)),
+            ("enhance", dict(brightness=brightness, contrast=contrast, sharpness=sharpness, grayscale=grayscale)),
+        ]
 
         if st.button("🧱 Apply to Layout & Generate PDF/Word"):
-            h_spacing = v_spacing = 0.25
-            page_px = (int(PAGE_WIDTH_INCH * dpi), int(PAGE_HEIGHT_INCH * dpi))
-            if use_rotate:
-                img_w, img_h = DOC_HEIGHT_INCH, DOC_WIDTH_INCH
-            else:
-                img_w, img_h = DOC_WIDTH_INCH, DOC_HEIGHT_INCH
-            doc_img = edited_preview.rotate(90, expand=True) if use_rotate else edited_preview
-            doc_img = doc_img.resize((int(img_w * dpi), int(img_h * dpi)))
-            total_width = columns * int(img_w * dpi) + (columns - 1) * int(h_spacing * dpi)
-            total_height = rows * int(img_h * dpi) + (rows - 1) * int(v_spacing * dpi)
-            left_margin = (page_px[0] - total_width) // 2
-            top_margin = (page_px[1] - total_height) // 2
-            page = Image.new("RGB", page_px, "white")
-            images = []
-            positions = []
-            for row in range(rows):
-                for col in range(columns):
-                    x = left_margin + col * (int(img_w * dpi) + int(h_spacing * dpi))
-                    y = top_margin + row * (int(img_h * dpi) + int(v_spacing * dpi))
-                    page.paste(doc_img, (x, y))
-                    # For Word: positions in inches, rotation flag
-                    positions.append((x / dpi, y / dpi, use_rotate))
-                    images.append(edited_preview)
+            from utils.pdf_utils import save_layout_as_pdf
+            from utils.word_utils import save_image_as_word
+            positions = grid_positions(PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, columns, rows, rotate=use_rotate, dpi=dpi)
+            full_img = export_source_cached(store.get("original_upload"), st.session_state.edits)
+            images = [full_img] * len(positions)
             st.session_state.preview_ready = True
-            st.session_state.preview_img = page.copy()
-            st.session_state.pdf_data = save_image_as_pdf(page, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH)
-            st.session_state.word_data = save_image_as_word(images, positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi=dpi, auto_rotate=use_rotate)
+            store.put("preview_img", render_layout_preview([edited_preview] * len(positions), positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, width=PREVIEW_WIDTH))
+            store.put("pdf_data", save_layout_as_pdf(images, positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi=dpi, profile=pdf_profile, max_bytes=pdf_max_bytes))
+            store.put("word_data", save_image_as_word(images, positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi=dpi, auto_rotate=use_rotate))
+            store.put("raster_data", None)
+            st.session_state.raster_format = raster_format
+            if raster_format:
+                from utils.raster_utils import save_layout_as_raster
+                store.put("raster_data", save_layout_as_raster(images, positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi=raster_dpi, fmt=raster_format))
 
     if st.session_state.get("preview_ready", False):
         st.subheader(f"🖼 Final Layout ({columns*rows} documents on page)")
-        preview_img = st.session_state.preview_img.copy()
+        preview_img = store.get("preview_img").copy()
         preview_img.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH))
         st.image(preview_img, use_container_width=True)
-        st.download_button("📄 Download PDF", data=st.session_state.pdf_data, file_name="Documents.pdf", mime="application/pdf")
-        st.download_button("📝 Download Word", data=st.session_state.word_data, file_name="Documents.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+        st.download_button("📄 Download PDF", data=store.reader("pdf_data"), file_name="Documents.pdf", mime=EXPORT_MIME["pdf"])
+        st.download_button("📝 Download Word", data=store.reader("word_data"), file_name="Documents.docx", mime=EXPORT_MIME["docx"])
+        if "raster_data" in store:
+            fmt = st.session_state.raster_format
+            st.download_button(f"🖨️ Download {fmt.upper()}", data=store.reader("raster_data"), file_name=f"Documents.{fmt}", mime=EXPORT_MIME[fmt])
         if st.button("🔁 Reset"):
             st.session_state.clear()
             st.rerun() 
\ No newline at end of file
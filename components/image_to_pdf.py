@@ -1,11 +1,14 @@
 import streamlit as st
-from PIL import Image
-from io import BytesIO
-from utils.image_utils import crop_image_relative, enhance_image
+from utils.image_utils import iter_export_sources
+from utils.cache_utils import load_preview, edit_previews, map_images
+from utils.autocrop_utils import autocrop_into, autocrop_all_into
+from utils.upload_utils import session_uploads
 
 def render(st, config):
     st.header("Image to PDF Converter")
     dpi = config.get('dpi', 300)
+    pdf_profile = config.get('pdf_profile')
+    pdf_max_bytes = config.get('pdf_max_bytes')
     page_sizes = config.get('page_sizes', {'A4': {'width_inch': 8.27, 'height_inch': 11.69}})
     page_size_name = st.selectbox('Select page size', list(page_sizes.keys()), index=0, key="page_size_image_to_pdf")
     page_size = page_sizes[page_size_name]
@@ -14,41 +17,59 @@ def render(st, config):
     PREVIEW_WIDTH = 400
 
     image_files = st.file_uploader("Upload images to convert to PDF", type=["png", "jpg", "jpeg"], accept_multiple_files=True)
-    processed_images = []
+    sources = []
+    edits_list = []
+    proxies = []
+    autocrop_keys = []
+    fits = []
     if image_files:
-        for idx, img_file in enumerate(image_files):
+        sources = session_uploads(st.session_state, "image_to_pdf", image_files)
+        # Previews and edits run on a proxy; the full-resolution image is only decoded during conversion.
+        # Proxies are decoded on the pipeline pool, all at once: the wait is the slowest upload, not the sum
+        loaded = map_images(load_preview, sources, [PREVIEW_WIDTH] * len(sources))
+        cropped_slots = []
+        edited_slots = []
+        keys = []
+        for idx, (key, img, original_preview) in enumerate(loaded):
             st.markdown(f"---\n**Image {idx+1}**")
-            img = Image.open(img_file).convert("RGB")
-            st.image(img, caption=f"Original Image {idx+1}", width=PREVIEW_WIDTH)
+            keys.append(key)
+            st.image(original_preview, caption=f"Original Image {idx+1}", width=PREVIEW_WIDTH)
+            autocrop_keys.append(dict(left=f"left_crop_img2pdf_{idx}", top=f"top_crop_img2pdf_{idx}", right=f"right_crop_img2pdf_{idx}", bottom=f"bottom_crop_img2pdf_{idx}", deskew=f"deskew_img2pdf_{idx}"))
+            proxies.append(img)
+            st.button(f"✨ Auto-crop (Image {idx+1})", key=f"autocrop_img2pdf_{idx}", on_click=autocrop_into, args=(st.session_state, img, autocrop_keys[-1], st.toast))
+            deskew = st.slider(f"Deskew (°) (Image {idx+1})", -10.0, 10.0, 0.0, 0.1, key=f"deskew_img2pdf_{idx}")
             col1, col2 = st.columns(2)
             with col1:
-                rel_left = st.slider(f"Left Crop % (Image {idx+1})", 0, 50, 0, 1, key=f"left_crop_img2pdf_{idx}") / 100.0
-                rel_right = st.slider(f"Right Crop % (Image {idx+1})", 0, 50, 0, 1, key=f"right_crop_img2pdf_{idx}") / 100.0
+                rel_left = st.slider(f"Left Crop % (Image {idx+1})", 0.0, 50.0, 0.0, 0.1, key=f"left_crop_img2pdf_{idx}") / 100.0
+                rel_right = st.slider(f"Right Crop % (Image {idx+1})", 0.0, 50.0, 0.0, 0.1, key=f"right_crop_img2pdf_{idx}") / 100.0
             with col2:
-                rel_top = st.slider(f"Top Crop % (Image {idx+1})", 0, 50, 0, 1, key=f"top_crop_img2pdf_{idx}") / 100.0
-                rel_bottom = st.slider(f"Bottom Crop % (Image {idx+1})", 0, 50, 0, 1, key=f"bottom_crop_img2pdf_{idx}") / 100.0
-            cropped_img = crop_image_relative(img, rel_left, rel_top, rel_right, rel_bottom)
-            st.image(cropped_img, caption=f"Cropped Image {idx+1}", width=PREVIEW_WIDTH)
+                rel_top = st.slider(f"Top Crop % (Image {idx+1})", 0.0, 50.0, 0.0, 0.1, key=f"top_crop_img2pdf_{idx}") / 100.0
+                rel_bottom = st.slider(f"Bottom Crop % (Image {idx+1})", 0.0, 50.0, 0.0, 0.1, key=f"bottom_crop_img2pdf_{idx}") / 100.0
+            cropped_slots.append(st.empty())
             grayscale = st.toggle(f"Grayscale (Image {idx+1})", key=f"grayscale_img2pdf_{idx}")
             brightness = st.slider(f"Brightness (Image {idx+1})", 0.1, 5.0, 1.0, 0.05, key=f"brightness_img2pdf_{idx}")
             contrast = st.slider(f"Contrast (Image {idx+1})", 0.1, 5.0, 1.0, 0.05, key=f"contrast_img2pdf_{idx}")
             sharpness = st.slider(f"Sharpness (Image {idx+1})", 0.1, 5.0, 1.0, 0.05, key=f"sharpness_img2pdf_{idx}")
-            edited_img = enhance_image(cropped_img, brightness, contrast, sharpness, grayscale)
-            preview_img = edited_img.copy()
-            preview_img.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH))
-            st.image(preview_img, caption=f"Edited Preview {idx+1}", width=PREVIEW_WIDTH)
+            edited_slots.append(st.empty())
             fit_to_page = st.checkbox(f"Fit to page (Image {idx+1})", value=True, key=f"fit2page_img2pdf_{idx}")
-            if fit_to_page:
-                # Resize to fit page
-                img_w, img_h = PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH
-                img_px = (int(img_w * dpi), int(img_h * dpi))
-                final_img = edited_img.resize(img_px)
-            else:
-                final_img = edited_img
-            processed_images.append(final_img)
-    if st.button("Convert Images to PDF") and processed_images:
-        pdf_bytes = BytesIO()
-        processed_images[0].save(pdf_bytes, format="PDF", save_all=True, append_images=processed_images[1:])
-        pdf_bytes.seek(0)
+            edits_list.append([
+                ("deskew", deskew),
+                ("crop", (rel_left, rel_top, rel_right, rel_bottom)),
+                ("enhance", dict(brightness=brightness, contrast=contrast, sharpness=sharpness, grayscale=grayscale)),
+            ])
+            fits.append(fit_to_page)
+        # Every image's edits run at once too; images whose own settings did not change are cache hits
+        for idx, (_, cropped_preview, edited_preview) in enumerate(map_images(edit_previews, keys, proxies, edits_list, [PREVIEW_WIDTH] * len(sources))):
+            cropped_slots[idx].image(cropped_preview, caption=f"Cropped Image {idx+1}", width=PREVIEW_WIDTH)
+            edited_slots[idx].image(edited_preview, caption=f"Edited Preview {idx+1}", width=PREVIEW_WIDTH)
+        st.button("✨ Auto-crop all", key="autocrop_all_img2pdf", on_click=autocrop_all_into, args=(st.session_state, proxies, autocrop_keys, st.toast))
+    if st.button("Convert Images to PDF") and sources:
+        from utils.pdf_utils import save_images_as_pdf
+        progress_bar = st.progress(0.0, text="Converting...")
+        # A factory rather than one generator: fitting under a size budget takes several passes
+        pages = lambda: zip(iter_export_sources(sources, edits_list), fits)
+        pdf_bytes = save_images_as_pdf(pages, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, dpi=dpi, progress=lambda done: progress_bar.progress(done / len(sources), text=f"Page {done}/{len(sources)}"), profile=pdf_profile, max_bytes=pdf_max_bytes)
         st.success("Images converted to PDF!")
+        if pdf_max_bytes and pdf_bytes.getbuffer().nbytes > pdf_max_bytes:
+            st.warning(f"Could not get under {pdf_max_bytes / 1e6:.1f} MB; this is the smallest version found ({pdf_bytes.getbuffer().nbytes / 1e6:.1f} MB).")
         st.download_button("Download PDF", data=pdf_bytes, file_name="images.pdf", mime="application/pdf")
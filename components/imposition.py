@@ -0,0 +1,69 @@
+import streamlit as st
+from utils.image_utils import render_layout_preview
+from utils.cache_utils import load_image, export_source_cached
+from utils.layout_utils import impose, unpack_page
+from utils.session_utils import session_store
+from utils.upload_utils import session_uploads
+
+def render(st, config):
+    PREVIEW_WIDTH = 400
+    THUMB_WIDTH = 120
+    page_sizes = config['page_sizes']
+    doc_sizes = config['document_sizes']
+    page_size_name = st.selectbox('Select page size', list(page_sizes.keys()), index=0, key="page_size_imposition")
+    page_size = page_sizes[page_size_name]
+    PAGE_WIDTH_INCH = page_size['width_inch']
+    PAGE_HEIGHT_INCH = page_size['height_inch']
+    dpi = config.get('dpi', 300)
+    pdf_profile = config.get('pdf_profile')
+    pdf_max_bytes = config.get('pdf_max_bytes')
+
+    allow_rotate = st.checkbox('Allow rotation', value=True, key='rotate_imposition')
+    spacing = st.slider("Spacing between documents (inches)", 0.0, 1.0, 0.25, 0.05, key="spacing_imposition")
+    uploaded_files = st.file_uploader("Upload document images (each can have its own type and copies).", type=["jpg", "jpeg", "png"], accept_multiple_files=True, key="imposition")
+    if not uploaded_files:
+        return
+
+    sources = session_uploads(st.session_state, "imposition", uploaded_files)
+    proxies = [load_image(upload, max_width=PREVIEW_WIDTH)[1] for upload in sources]
+    items = []
+    doc_types = list(doc_sizes.keys())
+    for idx, uploaded_file in enumerate(uploaded_files):
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            st.image(proxies[idx], width=THUMB_WIDTH)
+        with col2:
+            doc_type = st.selectbox(f"Document type ({uploaded_file.name})", doc_types, index=0, key=f"doc_type_imposition_{idx}")
+        with col3:
+            copies = st.number_input("Copies", 0, 100, 1, 1, key=f"copies_imposition_{idx}")
+        items.append((idx, doc_type, copies))
+
+    try:
+        pages = impose(items, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, doc_sizes, spacing=spacing, allow_rotate=allow_rotate)
+    except ValueError as e:
+        st.warning(str(e))
+        return
+    if not pages:
+        return
+    st.markdown("---")
+    st.subheader(f"🖼 {sum(len(p) for p in pages)} documents on {len(pages)} page(s)")
+    for page_no, page in enumerate(pages):
+        with st.expander(f"Page {page_no + 1} ({len(page)} documents)", expanded=page_no == 0):
+            keys, positions, sizes = unpack_page(page)
+            preview_img = render_layout_preview([proxies[key] for key in keys], positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, None, None, width=PREVIEW_WIDTH, sizes=sizes)
+            st.image(preview_img, width=PREVIEW_WIDTH)
+
+    store = session_store(st.session_state)
+    if st.button("🧱 Generate PDF", key="generate_imposition"):
+        from utils.pdf_utils import save_pages_as_pdf
+        full_images = {}
+        pdf_pages = []
+        for page in pages:
+            keys, positions, sizes = unpack_page(page)
+            for key in keys:
+                if key not in full_images:
+                    full_images[key] = export_source_cached(sources[key], [])
+            pdf_pages.append(([full_images[key] for key in keys], positions, sizes))
+        store.put("pdf_data_imposition", save_pages_as_pdf(pdf_pages, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, dpi=dpi, profile=pdf_profile, max_bytes=pdf_max_bytes))
+    if "pdf_data_imposition" in store:
+        st.download_button("📄 Download PDF", data=store.reader("pdf_data_imposition"), file_name="Packed_Documents.pdf", mime="application/pdf")
@@ -1,22 +1,10 @@
 import streamlit as st
-from PIL import Image
-from io import BytesIO
-from utils.image_utils import enhance_image, crop_image_relative, make_canvas_with_image
-from utils.pdf_utils import save_image_as_pdf
-from utils.word_utils import save_image_as_word
-
-@st.cache_data
-def load_and_resize_image(file_bytes, max_width=1000):
-    img = Image.open(BytesIO(file_bytes)).convert("RGB")
-    if img.width > max_width:
-        ratio = max_width / img.width
-        img = img.resize((max_width, int(img.height * ratio)))
-    return img
-
-@st.cache_data
-def cached_enhance_image(img_bytes, brightness, contrast, sharpness, grayscale):
-    img = Image.open(BytesIO(img_bytes))
-    return enhance_image(img, brightness, contrast, sharpness, grayscale)
+from utils.image_utils import make_canvas_with_image, render_layout_preview
+from utils.cache_utils import load_preview, edit_previews, map_images, export_source_cached
+from utils.export_utils import export_fingerprint, session_exports, layout_encoders, download_buttons
+from utils.autocrop_utils import autocrop_into, autocrop_all_into
+from utils.layout_utils import stacked_positions
+from utils.upload_utils import session_uploads
 
 def render(st, config):
     PREVIEW_WIDTH = 600
@@ -31,6 +19,10 @@ def render(st, config):
     DOC_WIDTH_INCH = doc_size['width_inch']
     DOC_HEIGHT_INCH = doc_size['height_inch']
     dpi = config.get('dpi', 300)
+    pdf_profile = config.get('pdf_profile')
+    pdf_max_bytes = config.get('pdf_max_bytes')
+    raster_format = config.get('raster_format')
+    raster_dpi = config.get('raster_dpi', dpi)
 
     max_images = 4
     uploaded_files = st.file_uploader("Upload up to 4 document images.", type=["jpg", "jpeg", "png"], accept_multiple_files=True, key="multi")
@@ -40,59 +32,62 @@ def render(st, config):
             st.warning(f"Maximum {max_images} images allowed.")
             return
         images = []
-        positions = []
-        doc_w, doc_h = DOC_WIDTH_INCH, DOC_HEIGHT_INCH
-        page_px = (int(PAGE_WIDTH_INCH * dpi), int(PAGE_HEIGHT_INCH * dpi))
-        doc_px = (int(doc_w * dpi), int(doc_h * dpi))
+        edits = []
+        source_keys = []
+        proxies = []
+        autocrop_keys = []
         n_images = len(uploaded_files)
         spacing = st.slider("Spacing between images (inches)", 0.0, 2.0, 0.25, 0.05, key="spacing_multi")
-        # Determine if rotation allows better fit
-        use_rotate = False
-        if auto_rotate and doc_w > doc_h and n_images * doc_h + (n_images - 1) * spacing <= PAGE_WIDTH_INCH:
-            use_rotate = True
-            doc_px = (int(doc_h * dpi), int(doc_w * dpi))
-        total_height = n_images * doc_px[1] + (n_images - 1) * int(spacing * dpi)
-        y_start = (page_px[1] - total_height) // 2
-        page = Image.new("RGB", page_px, "white")
-        for idx, uploaded_file in enumerate(uploaded_files):
+        # Rotation is used only if the rotated stack fits the page width
+        positions, use_rotate = stacked_positions(PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, n_images, spacing=spacing, auto_rotate=auto_rotate, dpi=dpi)
+        sources = session_uploads(st.session_state, "multi", uploaded_files)
+        # Proxies are decoded on the pipeline pool, all at once: the wait is the slowest upload, not the sum
+        loaded = map_images(load_preview, sources, [PREVIEW_WIDTH] * n_images)
+        cropped_slots = []
+        edited_slots = []
+        for idx, (key, img, original_preview) in enumerate(loaded):
             st.markdown(f"---\n**Image {idx+1}**")
-            img_bytes = uploaded_file.read()
-            img = load_and_resize_image(img_bytes)
-            st.image(img, caption=f"Original Image {idx+1}", width=PREVIEW_WIDTH)
+            source_keys.append(key)
+            st.image(original_preview, caption=f"Original Image {idx+1}", width=PREVIEW_WIDTH)
+            autocrop_keys.append(dict(left=f"left_crop_multi_{idx}", top=f"top_crop_multi_{idx}", right=f"right_crop_multi_{idx}", bottom=f"bottom_crop_multi_{idx}", deskew=f"deskew_multi_{idx}"))
+            proxies.append(img)
+            st.button(f"✨ Auto-crop (Image {idx+1})", key=f"autocrop_multi_{idx}", on_click=autocrop_into, args=(st.session_state, img, autocrop_keys[-1], st.toast))
+            deskew = st.slider(f"Deskew (°) (Image {idx+1})", -10.0, 10.0, 0.0, 0.1, key=f"deskew_multi_{idx}")
             col1, col2 = st.columns(2)
             with col1:
-                rel_left = st.slider(f"Left Crop % (Image {idx+1})", 0, 50, 0, 1, key=f"left_crop_multi_{idx}") / 100.0
-                rel_right = st.slider(f"Right Crop % (Image {idx+1})", 0, 50, 0, 1, key=f"right_crop_multi_{idx}") / 100.0
+                rel_left = st.slider(f"Left Crop % (Image {idx+1})", 0.0, 50.0, 0.0, 0.1, key=f"left_crop_multi_{idx}") / 100.0
+                rel_right = st.slider(f"Right Crop % (Image {idx+1})", 0.0, 50.0, 0.0, 0.1, key=f"right_crop_multi_{idx}") / 100.0
             with col2:
-                rel_top = st.slider(f"Top Crop % (Image {idx+1})", 0, 50, 0, 1, key=f"top_crop_multi_{idx}") / 100.0
-                rel_bottom = st.slider(f"Bottom Crop % (Image {idx+1})", 0, 50, 0, 1, key=f"bottom_crop_multi_{idx}") / 100.0
-            cropped_img = crop_image_relative(img, rel_left, rel_top, rel_right, rel_bottom)
-            st.image(cropped_img, caption=f"Cropped Image {idx+1}", width=PREVIEW_WIDTH)
+                rel_top = st.slider(f"Top Crop % (Image {idx+1})", 0.0, 50.0, 0.0, 0.1, key=f"top_crop_multi_{idx}") / 100.0
+                rel_bottom = st.slider(f"Bottom Crop % (Image {idx+1})", 0.0, 50.0, 0.0, 0.1, key=f"bottom_crop_multi_{idx}") / 100.0
+            cropped_slots.append(st.empty())
             grayscale = st.toggle(f"Grayscale (Image {idx+1})", key=f"grayscale_multi_{idx}")
             brightness = st.slider(f"Brightness (Image {idx+1})", 0.1, 5.0, 1.0, 0.05, key=f"brightness_multi_{idx}")
             contrast = st.slider(f"Contrast (Image {idx+1})", 0.1, 5.0, 1.0, 0.05, key=f"contrast_multi_{idx}")
             sharpness = st.slider(f"Sharpness (Image {idx+1})", 0.1, 5.0, 1.0, 0.05, key=f"sharpness_multi_{idx}")
-            img_bytes2 = BytesIO()
-            cropped_img.save(img_bytes2, format='PNG')
-            img_bytes2 = img_bytes2.getvalue()
-            edited_img = cached_enhance_image(img_bytes2, brightness, contrast, sharpness, grayscale)
-            preview_img = edited_img.copy()
-            preview_img.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH))
-            st.image(preview_img, caption=f"Edited Preview {idx+1}", width=PREVIEW_WIDTH)
-            # For Word: positions in inches, rotation flag
-            x = (page_px[0] - doc_px[0]) // 2
-            y = y_start + idx * (doc_px[1] + int(spacing * dpi))
-            page.paste(edited_img.rotate(90, expand=True) if use_rotate else edited_img, (x, y))
-            positions.append((x / dpi, y / dpi, use_rotate))
+            edited_slots.append(st.empty())
+            # Edit list: previews run on the proxy, the export replays it once on the full-resolution original
+            edits.append([
+                ("deskew", deskew),
+                ("crop", (rel_left, rel_top, rel_right, rel_bottom)),
+                ("enhance", dict(brightness=brightness, contrast=contrast, sharpness=sharpness, grayscale=grayscale)),
+            ])
+        # Every image's edits run at once too; images whose own settings did not change are cache hits
+        for idx, (edited_img, cropped_preview, edited_preview) in enumerate(map_images(edit_previews, source_keys, proxies, edits, [PREVIEW_WIDTH] * n_images)):
+            cropped_slots[idx].image(cropped_preview, caption=f"Cropped Image {idx+1}", width=PREVIEW_WIDTH)
+            edited_slots[idx].image(edited_preview, caption=f"Edited Preview {idx+1}", width=PREVIEW_WIDTH)
             images.append(edited_img)
+        st.button("✨ Auto-crop all", key="autocrop_all_multi", on_click=autocrop_all_into, args=(st.session_state, proxies, autocrop_keys, st.toast))
         st.markdown("---")
         st.subheader("🖼 Layout Options")
-        preview_img = page.copy()
-        preview_img.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH))
+        preview_img = render_layout_preview(images, positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, width=PREVIEW_WIDTH)
         st.image(preview_img, caption="Final Layout Preview", width=PREVIEW_WIDTH)
-        pdf_data = save_image_as_pdf(page, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH)
-        word_data = save_image_as_word(images, positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi=dpi, auto_rotate=use_rotate)
-        st.download_button("📄 Download PDF", data=pdf_data, file_name="Multi_Documents.pdf", mime="application/pdf")
-        st.download_button("📝 Download Word", data=word_data, file_name="Multi_Documents.docx", mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
-        if st.button("🔁 Reset Multi"):
-            st.rerun() 
\ No newline at end of file
+        # Exports are encoded only when a download is clicked, and only again once these inputs change
+        exports = session_exports(st.session_state, "exports_multi", "multi_id_center")
+        fingerprint = export_fingerprint(source_keys, edits, positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi, use_rotate, raster_format, raster_dpi, pdf_profile, pdf_max_bytes)
+        exports.update(
+            fingerprint,
+            lambda: [export_source_cached(src, edit) for src, edit in zip(sources, edits)],
+            layout_encoders(positions, PAGE_WIDTH_INCH, PAGE_HEIGHT_INCH, DOC_WIDTH_INCH, DOC_HEIGHT_INCH, dpi=dpi, auto_rotate=use_rotate, raster_format=raster_format, raster_dpi=raster_dpi, profile=pdf_profile, max_bytes=pdf_max_bytes),
+        )
+        download_buttons(st, exports, "Multi_Documents", key="download_multi")
@@ -1,7 +1,6 @@
 import streamlit as st
-from PyPDF2 import PdfMerger, PdfReader
-from io import BytesIO
-import tempfile
+from contextlib import ExitStack
+from utils.upload_utils import session_uploads
 
 def render(st, config):
     st.header("PDF Tools")
@@ -9,33 +8,37 @@ def render(st, config):
 
     with tab1:
         st.subheader("Merge Multiple PDFs")
-        pdf_files = st.file_uploader("Upload PDF files to merge", type="pdf", accept_multiple_files=True)
+        pdf_files = session_uploads(st.session_state, "merge_pdfs", st.file_uploader("Upload PDF files to merge", type="pdf", accept_multiple_files=True))
+        compact = st.checkbox("Compact output", value=False, key="merge_compact", help="Keep one copy of fonts, images and other resources shared between the files, drop unused objects and compress the document structure. Pages look exactly the same.")
         if st.button("Merge PDFs") and pdf_files:
-            merger = PdfMerger()
-            for pdf in pdf_files:
-                merger.append(BytesIO(pdf.read()))
-            merged_pdf = BytesIO()
-            merger.write(merged_pdf)
-            merger.close()
-            merged_pdf.seek(0)
-            st.success("PDFs merged successfully!")
+            # PyPDF2 is imported on first use, not at app start
+            from utils.merge_utils import merge_pdfs, merge_pdfs_compact
+            # Each reader parses its upload in place, from the session's buffer (memory-mapped if spooled)
+            with ExitStack() as stack:
+                streams = [stack.enter_context(upload.open()) for upload in pdf_files]
+                if compact:
+                    merged_pdf, stats = merge_pdfs_compact(streams)
+                else:
+                    merged_pdf = merge_pdfs(streams)
+            if compact:
+                saved = stats.merged_bytes - stats.output_bytes
+                st.success(f"PDFs merged successfully! {stats.output_bytes / 1e6:.2f} MB instead of {stats.merged_bytes / 1e6:.2f} MB, {saved / 1e6:.2f} MB ({saved / max(1, stats.merged_bytes):.0%}) saved by sharing {stats.duplicates} duplicate object(s).")
+            else:
+                st.success("PDFs merged successfully!")
             st.download_button("Download Merged PDF", data=merged_pdf, file_name="merged.pdf", mime="application/pdf")
 
     with tab2:
         st.subheader("Split PDF into Pages")
-        pdf_file = st.file_uploader("Upload a PDF to split", type="pdf", key="split_pdf")
+        pdf_file = session_uploads(st.session_state, "split_pdf", st.file_uploader("Upload a PDF to split", type="pdf", key="split_pdf"))
+        page_ranges = st.text_input("Page ranges (e.g. 1-3, 5, 8-). Leave empty for one file per page.", key="split_ranges")
         if st.button("Split PDF") and pdf_file:
-            reader = PdfReader(BytesIO(pdf_file.read()))
-            for i, page in enumerate(reader.pages):
-                writer = PdfMerger()
-                temp_pdf = BytesIO()
-                # Use PdfMerger to write a single page
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-                    temp_writer = PdfMerger()
-                    temp_writer.append(BytesIO(pdf_file.getvalue()), pages=(i, i+1))
-                    temp_writer.write(temp_file)
-                    temp_writer.close()
-                    temp_file.seek(0)
-                    temp_pdf.write(temp_file.read())
-                temp_pdf.seek(0)
-                st.download_button(f"Download Page {i+1}", data=temp_pdf, file_name=f"page_{i+1}.pdf", mime="application/pdf")
+            from utils.merge_utils import split_pdf_to_zip, pdf_basename
+            base_name = pdf_basename(pdf_file.name)
+            try:
+                with pdf_file.open() as stream:
+                    zip_data, n_files = split_pdf_to_zip(stream, page_ranges, base_name=base_name)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.success(f"Split into {n_files} file(s).")
+                st.download_button("Download ZIP", data=zip_data, file_name=f"{base_name}_split.zip", mime="application/zip")
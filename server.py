@@ -0,0 +1,175 @@
+"""Local render service: submit print jobs over HTTP and fetch the results by job ID.
+
+Usage:
+    python server.py [--host 127.0.0.1] [--port 8600] [--workers N] [--config config.yaml]
+
+Endpoints (JSON in and out):
+    POST   /jobs                      job fields as in a batch.py manifest row, plus
+                                      "files": [{"name": "front.jpg", "data": "<base64>"}, ...] in order.
+                                      202 with the job, 429 (Retry-After) when the queue is full,
+                                      503 when too many uploads are in flight, 413 when the body is too big.
+    GET    /jobs/<id>[?wait=S]        job state (queued | running | done | failed | timed_out | cancelled);
+                                      wait blocks up to S seconds (max 60) for it to finish.
+    GET    /jobs/<id>/<artifact>      download a finished file (names are listed in "artifacts").
+    DELETE /jobs/<id>                 cancel a queued/running job, or delete a finished one.
+    GET    /metrics                   queue depth, running jobs, totals, wait and run times.
+    GET    /health
+
+Modes: grid, center, front_back, multi, image_to_pdf, merge, split (see batch.py).
+Limits (workers, queue size, per-job timeout, request size, result retention) come from the
+service block in config.yaml.
+"""
+import argparse
+import base64
+import binascii
+import json
+import mimetypes
+import os
+import shutil
+import signal
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import yaml
+from utils.service_utils import QueueFull, RenderService, service_settings
+
+MAX_WAIT_S = 60
+
+class JobHandler(BaseHTTPRequestHandler):
+    service = None
+    uploads = None  # semaphore bounding request bodies held in memory at once
+    quiet = True
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message, headers=None):
+        self._send_json(status, {"error": message}, headers)
+
+    def _parts(self):
+        url = urlparse(self.path)
+        return [p for p in url.path.split("/") if p], parse_qs(url.query)
+
+    def do_GET(self):
+        parts, query = self._parts()
+        if parts == ["health"]:
+            return self._send_json(200, {"ok": True})
+        if parts == ["metrics"]:
+            return self._send_json(200, self.service.metrics())
+        if len(parts) == 2 and parts[0] == "jobs":
+            try:
+                wait = min(MAX_WAIT_S, float(query.get("wait", ["0"])[0]))
+            except ValueError:
+                return self._error(400, "wait must be a number of seconds")
+            job = self.service.status(parts[1], wait=wait)
+            return self._send_json(200, job) if job else self._error(404, "Unknown job")
+        if len(parts) == 3 and parts[0] == "jobs":
+            path = self.service.artifact_path(parts[1], parts[2])
+            if path is None or not os.path.exists(path):
+                return self._error(404, "No such artifact")
+            self.send_response(200)
+            self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(os.path.getsize(path)))
+            self.send_header("Content-Disposition", f'attachment; filename="{parts[2]}"')
+            self.end_headers()
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, self.wfile)
+            return
+        self._error(404, "Not found")
+
+    def do_POST(self):
+        parts, _ = self._parts()
+        if parts != ["jobs"]:
+            return self._error(404, "Not found")
+        length = self.headers.get("Content-Length")
+        if length is None:
+            return self._error(411, "Content-Length required")
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            return self._error(400, "invalid Content-Length")
+        if length > self.service.settings["max_request_mb"] * 1024 * 1024:
+            self.close_connection = True
+            return self._error(413, f"Request body over {self.service.settings['max_request_mb']} MB")
+        if not self.uploads.acquire(blocking=False):
+            self.close_connection = True
+            return self._error(503, "Too many uploads in progress", {"Retry-After": 1})
+        try:
+            try:
+                raw = json.loads(self.rfile.read(length))
+                files = [(f.get("name", ""), base64.b64decode(f["data"], validate=True)) for f in raw.pop("files", [])]
+            except (ValueError, KeyError, TypeError, AttributeError, binascii.Error) as e:
+                return self._error(400, f"Bad request body: {e}")
+            try:
+                job = self.service.submit(raw, files)
+            except QueueFull as e:
+                return self._error(429, str(e), {"Retry-After": e.retry_after})
+            except (ValueError, KeyError, TypeError) as e:
+                return self._error(400, str(e))
+            self._send_json(202, job, {"Location": f"/jobs/{job['id']}"})
+        finally:
+            self.uploads.release()
+
+    def do_DELETE(self):
+        parts, _ = self._parts()
+        if len(parts) != 2 or parts[0] != "jobs":
+            return self._error(404, "Not found")
+        if not self.service.cancel(parts[1]):
+            return self._error(404, "Unknown job")
+        self._send_json(200, {"id": parts[1], "cancelled": True})
+
+def make_server(service, host, port, verbose=False):
+    """A threaded HTTP server bound to service (port 0 picks a free port)."""
+    handler = type("BoundJobHandler", (JobHandler,), {
+        "service": service,
+        "uploads": threading.BoundedSemaphore(max(1, int(service.settings["max_uploads"]))),
+        "quiet": not verbose,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the card layouts as an HTTP job queue.")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yaml"), help="Page/document sizes and the service block")
+    parser.add_argument("--host", help="Bind address (default from config: 127.0.0.1)")
+    parser.add_argument("--port", type=int, help="Port (default from config: 8600)")
+    parser.add_argument("--workers", type=int, help="Render processes (default from config)")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args(argv)
+
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f)
+    settings = service_settings(config, host=args.host, port=args.port, workers=args.workers)
+    service = RenderService(config, settings)
+    service.start()
+    server = make_server(service, settings["host"], settings["port"], verbose=args.verbose)
+    # Stop cleanly (workers and spooled files) on SIGTERM as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Serving on http://{settings['host']}:{server.server_port} with {settings['workers']} worker(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+from io import BytesIO
+import pytest
+from PIL import Image
+from PyPDF2 import PdfReader
+from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas
+from utils.merge_utils import merge_pdfs, merge_pdfs_compact
+from utils.pdf_utils import save_layout_as_pdf
+
+def _text_pdf(title, pages):
+    """A PDF with text on every page, one outline entry per page, an external link and a link back to page 1."""
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=(4 * inch, 3 * inch))
+    for page in range(pages):
+        c.setFont("Helvetica", 12)
+        c.drawString(20, 150, f"{title} page {page + 1}")
+        c.bookmarkPage(f"{title}-{page}")
+        c.addOutlineEntry(f"{title} {page + 1}", f"{title}-{page}", level=0)
+        c.linkURL(f"https://example.com/{title}/{page}", (20, 100, 120, 120), relative=0)
+        if page:
+            c.linkAbsolute("first page", f"{title}-0", (20, 60, 120, 80))
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+def _card_pdf(img):
+    # The same card image in every file: a plain merge stores it once per file, compaction once in total
+    return save_layout_as_pdf([img, img], [(0.5, 0.5, False), (0.5, 3.0, True)], 8.27, 11.69, 3.375, 2.125, dpi=150).getvalue()
+
+@pytest.fixture(scope="module")
+def inputs():
+    card = Image.effect_noise((500, 320), 60).convert("RGB")
+    return [_card_pdf(card), _text_pdf("alpha", 3), _card_pdf(card), _text_pdf("beta", 2)]
+
+def _links(page):
+    uris, internal = [], 0
+    for annot in page.get("/Annots") or []:
+        annot = annot.get_object()
+        action = annot.get("/A")
+        if action is not None and action.get_object().get("/URI"):
+            uris.append(action.get_object()["/URI"])
+        elif annot.get("/Dest") is not None or action is not None:
+            internal += 1
+    return uris, internal
+
+def _outline_titles(outline):
+    titles = []
+    for item in outline:
+        titles.extend(_outline_titles(item) if isinstance(item, list) else [item.title])
+    return titles
+
+def test_compact_round_trip(inputs):
+    plain = PdfReader(merge_pdfs([BytesIO(data) for data in inputs]))
+    out, stats = merge_pdfs_compact([BytesIO(data) for data in inputs])
+    compact = PdfReader(out)
+
+    assert stats.duplicates > 0
+    assert stats.output_bytes == len(out.getvalue())
+    assert stats.output_bytes < stats.merged_bytes
+    assert compact.pdf_header.startswith("%PDF-1.5")
+
+    assert len(compact.pages) == len(plain.pages) == 1 + 3 + 1 + 2
+    for before, after in zip(plain.pages, compact.pages):
+        assert after.extract_text() == before.extract_text()
+        assert [float(v) for v in after.mediabox] == [float(v) for v in before.mediabox]
+        assert _links(after) == _links(before)
+    assert "alpha page 3" in compact.pages[3].extract_text()
+    assert _links(compact.pages[6]) == (["https://example.com/beta/1"], 1)
+
+    titles = _outline_titles(compact.outline)
+    assert titles == _outline_titles(plain.outline)
+    assert titles == ["alpha 1", "alpha 2", "alpha 3", "beta 1", "beta 2"]
+    # Outline entries still point at the right pages after renumbering
+    for item in compact.outline:
+        assert compact.get_destination_page_number(item) == next(
+            plain.get_destination_page_number(p) for p in plain.outline if p.title == item.title
+        )
+
+def _page_images(reader, index):
+    return {ref.idnum for ref in _image_refs(reader.pages[index]["/Resources"]["/XObject"])}
+
+def test_compact_shares_identical_images(inputs):
+    # Pages 1 and 5 come from two copies of the same card PDF
+    plain = PdfReader(merge_pdfs([BytesIO(data) for data in inputs]))
+    assert len(_page_images(plain, 0)) == len(_page_images(plain, 4)) == 1
+    assert _page_images(plain, 0) != _page_images(plain, 4)
+    out, _ = merge_pdfs_compact([BytesIO(data) for data in inputs])
+    compact = PdfReader(out)
+    assert len(_page_images(compact, 0)) == 1
+    assert _page_images(compact, 0) == _page_images(compact, 4)
+
+def _image_refs(xobjects):
+    for ref in xobjects.values():
+        obj = ref.get_object()
+        if obj.get("/Subtype") == "/Image":
+            yield ref
+        elif obj.get("/Resources") is not None and "/XObject" in obj["/Resources"]:
+            yield from _image_refs(obj["/Resources"]["/XObject"])
+
+def test_compact_output_appends_to_stream(inputs):
+    # Offsets are relative to where the PDF starts, so it can be written after other data
+    out = BytesIO(b"leading bytes")
+    out.seek(0, 2)
+    merge_pdfs_compact([BytesIO(data) for data in inputs[1:2]], out=out)
+    reader = PdfReader(BytesIO(out.getvalue()[len(b"leading bytes"):]))
+    assert len(reader.pages) == 3
+    assert "alpha page 1" in reader.pages[0].extract_text()
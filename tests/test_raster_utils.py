@@ -0,0 +1,84 @@
+from io import BytesIO
+import numpy as np
+import pytest
+from PIL import Image
+from utils.image_utils import JpegSource
+from utils.raster_utils import iter_page_strips, save_layout_as_raster, write_tiff
+
+def _card(seed, size=(320, 200)):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+
+def _jpeg_card():
+    buffer = BytesIO()
+    _card(7, (400, 260)).save(buffer, format="JPEG", quality=90)
+    return JpegSource(buffer.getvalue(), (400, 260), (20, 10, 380, 250))
+
+# Page layouts: repeated and rotated cards, one hanging off the right edge, a JPEG passthrough, per-card sizes
+LAYOUTS = {
+    "grid": dict(
+        images=[_card(1)] * 4 + [_card(2)] * 2,
+        positions=[(0.2, 0.2, False), (3.8, 0.2, False), (0.2, 2.5, False), (3.8, 2.5, False), (0.2, 5.0, True), (7.5, 5.0, False)],
+        page=(8.27, 11.69), card=(3.375, 2.125), sizes=None,
+    ),
+    "mixed": dict(
+        images=[_jpeg_card(), _card(3, (150, 190)), _card(4)],
+        positions=[(0.25, 0.25, False), (4.0, 0.25, True), (0.25, 3.0, False)],
+        page=(6.01, 5.0), card=(None, None), sizes=[(3.375, 2.125), (1.38, 1.77), (4.921, 1.5)],
+    ),
+}
+
+def _args(layout):
+    return layout["images"], layout["positions"], *layout["page"], *layout["card"]
+
+def _reference_page(layout, dpi):
+    """The whole page pasted with plain PIL, placed like the ID tools: pixel positions and sizes truncated from inches * dpi."""
+    page_w, page_h = layout["page"]
+    page = Image.new("RGB", (int(page_w * dpi), int(page_h * dpi)), "white")
+    sizes = layout["sizes"] or [layout["card"]] * len(layout["positions"])
+    for img, (x_inch, y_inch, rotate90), (w, h) in zip(layout["images"], layout["positions"], sizes):
+        card = (img.to_image() if isinstance(img, JpegSource) else img).convert("RGB")
+        if rotate90:
+            card, w, h = card.rotate(90, expand=True), h, w
+        page.paste(card.resize((max(1, int(w * dpi)), max(1, int(h * dpi)))), (int(x_inch * dpi), int(y_inch * dpi)))
+    return np.asarray(page)
+
+@pytest.mark.parametrize("fmt", ["png", "tiff"])
+@pytest.mark.parametrize("name", sorted(LAYOUTS))
+@pytest.mark.parametrize("dpi", [100, 143])
+def test_raster_decodes_to_reference_page(fmt, name, dpi):
+    layout = LAYOUTS[name]
+    expected = _reference_page(layout, dpi)
+    data = save_layout_as_raster(*_args(layout), dpi=dpi, fmt=fmt, sizes=layout["sizes"]).getvalue()
+    decoded = Image.open(BytesIO(data))
+    assert decoded.format == fmt.upper()
+    assert decoded.mode == "RGB"
+    assert decoded.info["dpi"] == pytest.approx((dpi, dpi), abs=0.01)
+    assert np.array_equal(np.asarray(decoded), expected)
+
+@pytest.mark.parametrize("strip_height", [1, 100, 5000])
+def test_tiff_strip_layouts(strip_height):
+    # One row per strip, uneven strips, and a single strip (its offset and count stored inline in the IFD)
+    layout = LAYOUTS["mixed"]
+    dpi = 61  # odd page width and height
+    width, height = int(layout["page"][0] * dpi), int(layout["page"][1] * dpi)
+    strips = iter_page_strips(*_args(layout), dpi=dpi, sizes=layout["sizes"], strip_height=strip_height)
+    out = BytesIO(b"prefix")
+    out.seek(0, 2)
+    write_tiff(strips, width, height, dpi, out, rows_per_strip=strip_height)
+    decoded = Image.open(BytesIO(out.getvalue()[len(b"prefix"):]))
+    assert np.array_equal(np.asarray(decoded), _reference_page(layout, dpi))
+
+def test_fixed_pixel_boxes():
+    # Solid cards on a 2 x 1 inch page at 100 dpi; x = 0.29 inch truncates to column 28, as the ID tools place it
+    red, blue = Image.new("RGB", (40, 20), (255, 0, 0)), Image.new("RGB", (30, 10), (0, 0, 255))
+    data = save_layout_as_raster([red, blue], [(0.29, 0.25, False), (1.5, 0.0, True)], 2.0, 1.0, None, None,
+                                 dpi=100, fmt="png", sizes=[(1.0, 0.5), (0.5, 0.25)]).getvalue()
+    expected = np.full((100, 200, 3), 255, dtype=np.uint8)
+    expected[25:75, 28:128] = (255, 0, 0)
+    expected[0:50, 150:175] = (0, 0, 255)  # rotated: 0.25 x 0.5 inch
+    assert np.array_equal(np.asarray(Image.open(BytesIO(data))), expected)
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        save_layout_as_raster(*_args(LAYOUTS["grid"]), fmt="bmp")
@@ -0,0 +1,203 @@
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+from PIL import Image
+from utils.cache_utils import hash_bytes, stage_key
+from utils.image_utils import JpegSource
+
+DEFAULT_MAX_MB = 1024
+# Part of every key. The cache outlives deploys: bump this whenever an exporter (PDF, DOCX, raster, job
+# renders) or a pipeline stage (whose images are keyed by upload digest and edits) can produce different
+# bytes for the same inputs, so earlier files are no longer looked up
+ARTIFACT_VERSION = 1
+_TMP_PREFIX = ".tmp-"
+_STALE_TMP_S = 3600  # temp files older than this were left by a crashed writer
+
+class ArtifactCache:
+    """
+    Finished exports on disk, one file per key, bounded by total bytes (least recently used first).
+    Writes go to a temp file in the same directory and are renamed into place, so several processes
+    can share the directory and a reader never sees a partial file. A hit bumps the file's mtime.
+    The total size is scanned from the directory at startup and then kept as a running count of this
+    process's writes; the directory is rescanned (picking up other processes' files) only once that
+    count goes over budget.
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._total = 0
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            # Missing, or evicted by another process between open and utime
+            data = None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=_TMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.chmod(tmp, 0o644)  # mkstemp creates 0600; other processes sharing the directory must read it
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        with self._lock:
+            self._total += len(data) - replaced
+            over = self._total > self.max_bytes
+        if over:
+            self._evict()
+
+    def _evict(self):
+        """Rescan the directory, drop least recently used files down to max_bytes, and reset the running total."""
+        entries, total, now = [], 0, time.time()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.startswith(_TMP_PREFIX):
+                    if now - stat.st_mtime > _STALE_TMP_S:
+                        self._remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if self._remove(path):
+                total -= size
+                with self._lock:
+                    self.evictions += 1
+        with self._lock:
+            self._total = total
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+# One per process; None (the default, e.g. in benchmarks) disables artifact caching
+_cache = None
+
+def configure_artifacts(config):
+    """Apply the artifact cache settings from config.yaml (artifacts.dir, artifacts.max_mb); no dir disables it."""
+    global _cache
+    settings = config.get('artifacts', {}) or {}
+    directory = settings.get("dir")
+    _cache = ArtifactCache(directory, int(settings.get("max_mb", DEFAULT_MAX_MB) * 1024 * 1024)) if directory else None
+
+def artifact_stats():
+    return _cache.stats() if _cache is not None else None
+
+def artifact_key(*parts):
+    """
+    Digest of an export's full input: source digests plus every parameter (page and document size, DPI, edits...),
+    salted with ARTIFACT_VERSION so files written by an older exporter are never served.
+    """
+    return hashlib.blake2b(repr((ARTIFACT_VERSION,) + parts).encode(), digest_size=20).hexdigest()
+
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _image_digest(img):
+    """Content hash of an image's pixels, read a band of rows at a time rather than copied out whole."""
+    digest = hashlib.blake2b(digest_size=16)
+    rows = max(1, (1 << 20) // max(1, img.width * len(img.getbands())))
+    for top in range(0, img.height, rows):
+        digest.update(img.crop((0, top, img.width, min(img.height, top + rows))).tobytes())
+    return digest.hexdigest()
+
+def _digest(value, memo):
+    """
+    Stable stand-in for an argument: a pipeline image by its stage key (upload digest plus edits), any other
+    image by content (each distinct object hashed once), JPEG passthroughs by upload digest, the rest by value.
+    """
+    if isinstance(value, JpegSource):
+        return ("jpeg", hash_bytes(value.data), value.box)
+    if isinstance(value, Image.Image):
+        key = stage_key(value)
+        if key is not None:
+            return ("stage", key)
+        if id(value) not in memo:
+            memo[id(value)] = ("image", value.mode, value.size, _image_digest(value))
+        return memo[id(value)]
+    if isinstance(value, (list, tuple)):
+        return tuple(_digest(v, memo) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _digest(v, memo)) for k, v in value.items()))
+    return value
+
+def lookup(key):
+    """Cached bytes for key, or None (also when caching is off)."""
+    return _cache.get(key) if _cache is not None else None
+
+def store(key, data):
+    if _cache is not None:
+        _cache.put(key, data)
+
+def artifact_cached(kind):
+    """
+    Decorator for exporters returning a BytesIO: serve repeats from the artifact cache.
+    The key is the cache_key keyword if the caller already has one (e.g. from upload hashes and edit
+    lists, so it can check before decoding anything), else a digest of kind and every argument.
+    Calls that write into a caller's out stream are not cached.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, cache_key=None, **kwargs):
+            if _cache is None or kwargs.get("out") is not None:
+                return func(*args, **kwargs)
+            memo = {}
+            key = cache_key or artifact_key(kind, _digest(args, memo), _digest(kwargs, memo))
+            data = _cache.get(key)
+            if data is not None:
+                return BytesIO(data)
+            result = func(*args, **kwargs)
+            with result.getbuffer() as view:
+                _cache.put(key, view)
+            return result
+        return wrapper
+    return decorator
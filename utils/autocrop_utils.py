@@ -0,0 +1,139 @@
+from collections import namedtuple
+import numpy as np
+from PIL import Image
+from utils.cache_utils import map_images
+from utils.trace_utils import traced
+
+DETECT_SIZE = 512
+MAX_SKEW = 10.0
+MAX_CROP = 0.5  # the crop sliders go up to 50% per side
+
+# angle: degrees counter-clockwise (as PIL's rotate) that squares the card up;
+# crop: (rel_left, rel_top, rel_right, rel_bottom) of the card in the deskewed (expanded) image;
+# confidence: how much of that rectangle the detected card fills (0-1)
+CardDetection = namedtuple("CardDetection", "angle crop confidence")
+
+def _foreground_mask(rgb):
+    """Pixels that differ from the background, estimated from a frame around the image border."""
+    h, w, _ = rgb.shape
+    band = max(2, min(h, w) // 25)
+    border = np.concatenate([
+        rgb[:band].reshape(-1, 3), rgb[-band:].reshape(-1, 3),
+        rgb[:, :band].reshape(-1, 3), rgb[:, -band:].reshape(-1, 3),
+    ])
+    background = np.median(border, axis=0)
+    border_dist = np.sqrt(((border - background) ** 2).sum(axis=1))
+    dist = np.sqrt(((rgb - background) ** 2).sum(axis=2))
+    threshold = max(30.0, 1.5 * float(np.percentile(border_dist, 95)))
+    return dist > threshold
+
+def _edge_points(mask):
+    # Boundary of the mask: set pixels with at least one unset 4-neighbour
+    interior = mask.copy()
+    interior[1:] &= mask[:-1]
+    interior[:-1] &= mask[1:]
+    interior[:, 1:] &= mask[:, :-1]
+    interior[:, :-1] &= mask[:, 1:]
+    ys, xs = np.nonzero(mask & ~interior)
+    return xs - mask.shape[1] / 2.0, ys - mask.shape[0] / 2.0
+
+def _projection_scores(xs, ys, angles_deg):
+    """For each angle, how sharply the edge points pile up when projected on the rotated axes (all angles at once)."""
+    theta = np.radians(angles_deg)[:, None]
+    cos, sin = np.cos(theta), np.sin(theta)
+    scores = np.zeros(len(angles_deg))
+    for proj in (xs * cos + ys * sin, -xs * sin + ys * cos):
+        bins = np.rint(proj).astype(np.int64)
+        bins -= bins.min(axis=1, keepdims=True)
+        width = int(bins.max()) + 1
+        counts = np.bincount((bins + np.arange(len(angles_deg))[:, None] * width).ravel(), minlength=len(angles_deg) * width)
+        scores += (counts.reshape(len(angles_deg), width).astype(np.float64) ** 2).sum(axis=1)
+    return scores
+
+def _estimate_skew(mask, max_angle):
+    xs, ys = _edge_points(mask)
+    if len(xs) < 20:
+        return 0.0
+    best = 0.0
+    for span, step in ((max_angle, 0.5), (0.5, 0.1)):
+        angles = best + np.arange(-span, span + 1e-9, step)
+        # Smallest rotation first, so ties (e.g. an already straight scan) keep the image as it is
+        angles = angles[np.argsort(np.abs(angles), kind="stable")]
+        best = float(angles[np.argmax(_projection_scores(xs, ys, angles))])
+    return best
+
+def _extent(counts, fraction=0.3):
+    """First and last index (exclusive) where the projection reaches fraction of its peak."""
+    idx = np.nonzero(counts >= fraction * counts.max())[0]
+    return int(idx[0]), int(idx[-1]) + 1
+
+@traced("autocrop")
+def detect_card(img, max_angle=MAX_SKEW):
+    """
+    Find the card in a photo or scan (works on any size; the analysis runs on a copy at most DETECT_SIZE wide).
+    Returns a CardDetection in relative terms, so it applies unchanged to the full-resolution image,
+    or None if no card-like rectangle stands out from the background.
+    """
+    small = img.convert("RGB")
+    if max(small.size) > DETECT_SIZE:
+        small = small.copy()
+        small.thumbnail((DETECT_SIZE, DETECT_SIZE), Image.Resampling.BILINEAR)
+    mask = _foreground_mask(np.asarray(small, dtype=np.float32))
+    coverage = mask.mean()
+    if coverage < 0.02 or coverage > 0.98:
+        return None
+    angle = _estimate_skew(mask, max_angle)
+    # Rotate the mask exactly as deskew_image rotates the picture, so the crop lines up in the expanded frame
+    mask_img = Image.fromarray(mask.astype(np.uint8) * 255)
+    if angle:
+        mask_img = mask_img.rotate(angle, resample=Image.Resampling.NEAREST, expand=True, fillcolor=0)
+    rotated = np.asarray(mask_img) > 127
+    h, w = rotated.shape
+    left, right = _extent(rotated.sum(axis=0))
+    top, bottom = _extent(rotated.sum(axis=1))
+    confidence = float(rotated[top:bottom, left:right].mean())
+    if confidence < 0.6:
+        return None
+    crop = (left / w, top / h, (w - right) / w, (h - bottom) / h)
+    return CardDetection(round(angle, 1) + 0.0, tuple(min(MAX_CROP, max(0.0, c)) for c in crop), round(confidence, 3))
+
+def detect_cards(images, max_angle=MAX_SKEW):
+    """detect_card for each image (e.g. every upload in a multi-image tool), in order, on the pipeline pool."""
+    images = list(images)
+    return map_images(detect_card, images, [max_angle] * len(images))
+
+def detection_edits(detection):
+    """The deskew and crop edits for a detection (an empty list if nothing was found)."""
+    if detection is None:
+        return []
+    return [("deskew", detection.angle), ("crop", detection.crop)]
+
+def _write_state(state, keys, detection):
+    for side, value in zip(("left", "top", "right", "bottom"), detection.crop):
+        state[keys[side]] = round(value * 100, 1)
+    state[keys["deskew"]] = detection.angle
+
+def autocrop_into(state, img, keys, notify=None):
+    """
+    Detect the card in img and write the result into widget state (e.g. st.session_state) before the sliders render.
+    keys: dict with "left", "top", "right", "bottom" (percent crop slider keys) and "deskew" (degrees slider key).
+    notify: optional callback(message) when nothing is found, e.g. st.toast.
+    """
+    detection = detect_card(img)
+    if detection is None:
+        if notify:
+            notify("No card edges found; crop left unchanged.")
+        return None
+    _write_state(state, keys, detection)
+    return detection
+
+def autocrop_all_into(state, images, keys_list, notify=None):
+    """autocrop_into for several images at once (multi-image tools); returns how many cards were found."""
+    found = 0
+    for keys, detection in zip(keys_list, detect_cards(images)):
+        if detection is not None:
+            _write_state(state, keys, detection)
+            found += 1
+    if notify:
+        notify(f"Auto-cropped {found} of {len(images)} image(s).")
+    return found
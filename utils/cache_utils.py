@@ -0,0 +1,224 @@
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image
+from utils.image_utils import enhance_image, crop_image_relative, deskew_image, jpeg_passthrough
+from utils.ingest_utils import decode_full, decode_proxy
+from utils.trace_utils import span
+
+DEFAULT_MAX_MB = 512
+
+def hash_bytes(data):
+    """Cheap content hash of uploaded bytes, used as the root of every stage key (an Upload's is computed once)."""
+    digest = getattr(data, "digest", None)
+    if isinstance(digest, str):
+        return digest
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def size_of(value):
+    """Approximate memory held by a cached value, in bytes."""
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, BytesIO):
+        return value.getbuffer().nbytes
+    return 0
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by total bytes rather than entry count."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        size = size_of(value)
+        with self._lock:
+            if key in self._items:
+                self.bytes -= self._items.pop(key)[1]
+            if size > self.max_bytes:
+                return value
+            self._items[key] = (value, size)
+            self.bytes += size
+            self._evict()
+        return value
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self._items:
+            _, (_, size) = self._items.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+# One cache per process, shared by every tab and session
+PIPELINE_CACHE = LRUCache()
+# Per-image preview work of the multi-image tools; decode, resampling, filters and encoders all release the GIL
+_POOL = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="pipeline")
+
+def configure_cache(config):
+    """Apply the cache byte budget from config.yaml (cache.max_mb)."""
+    max_mb = config.get('cache', {}).get('max_mb', DEFAULT_MAX_MB)
+    PIPELINE_CACHE.resize(int(max_mb * 1024 * 1024))
+
+def cache_stats():
+    return PIPELINE_CACHE.stats()
+
+# id(image) -> (weak reference, stage key) for every image a stage returned, so exporters can name an
+# image by the key it was produced under instead of hashing its pixels (see stage_key)
+_IMAGE_KEYS = {}
+
+def _forget_image(ref, ident):
+    if _IMAGE_KEYS.get(ident, (None,))[0] is ref:
+        _IMAGE_KEYS.pop(ident, None)
+
+def stage_key(img):
+    """The pipeline key img was produced under, or None if it did not come from a stage."""
+    entry = _IMAGE_KEYS.get(id(img))
+    return entry[1] if entry is not None and entry[0]() is img else None
+
+def _cached(key, compute):
+    value = PIPELINE_CACHE.get(key)
+    if value is None:
+        value = PIPELINE_CACHE.put(key, compute())
+    if isinstance(value, Image.Image) and stage_key(value) is None:
+        _IMAGE_KEYS[id(value)] = (weakref.ref(value, lambda ref, ident=id(value): _forget_image(ref, ident)), key)
+    return value
+
+# Each stage returns (key, image); the key is the parent stage's key plus this stage's parameters,
+# so cached results are never mutated in place by callers (PIL operations return new images).
+
+def load_image(file_bytes, max_width=None):
+    """Decode an upload to upright RGB: a draft-decoded proxy no wider than max_width, or full resolution for None."""
+    key = (hash_bytes(file_bytes), "decode", max_width)
+    def compute():
+        with span("decode", bytes=len(file_bytes)) as record:
+            img = decode_proxy(file_bytes, max_width) if max_width else decode_full(file_bytes)
+            record["pixels"] = img.width * img.height
+        return img
+    return key, _cached(key, compute)
+
+def deskew_stage(key, img, angle):
+    if not angle:
+        return key, img
+    key = (key, "deskew", angle)
+    return key, _cached(key, lambda: deskew_image(img, angle))
+
+def crop_stage(key, img, rel_left, rel_top, rel_right, rel_bottom):
+    params = (rel_left, rel_top, rel_right, rel_bottom)
+    if not any(params):
+        return key, img
+    key = (key, "crop", params)
+    return key, _cached(key, lambda: crop_image_relative(img, *params))
+
+def enhance_stage(key, img, brightness=1.0, contrast=1.0, sharpness=1.0, grayscale=False):
+    if (brightness, contrast, sharpness, grayscale) == (1.0, 1.0, 1.0, False):
+        return key, img
+    key = (key, "enhance", brightness, contrast, sharpness, grayscale)
+    return key, _cached(key, lambda: enhance_image(img, brightness, contrast, sharpness, grayscale))
+
+def resize_stage(key, img, width_inch, height_inch, dpi=300):
+    key = (key, "resize", width_inch, height_inch, dpi)
+    return key, _cached(key, lambda: img.resize((int(width_inch * dpi), int(height_inch * dpi))))
+
+def encoded_stage(key, img, box=None):
+    """
+    JPEG bytes of img for st.image, shrunk to fit box (width, height) if given. Cached, so a rerun does not
+    re-encode images whose edits did not change (st.image encodes PIL images on every call).
+    """
+    key = (key, "encoded", box)
+    def compute():
+        preview = img
+        if box is not None and (img.width > box[0] or img.height > box[1]):
+            preview = img.copy()
+            preview.thumbnail(box)
+        buffer = BytesIO()
+        preview.convert("RGB").save(buffer, format="JPEG", quality=90)
+        return buffer.getvalue()
+    return key, _cached(key, compute)
+
+def apply_edits_cached(key, img, edits):
+    """Cached equivalent of image_utils.apply_edits."""
+    for op, params in edits:
+        if op == "deskew":
+            key, img = deskew_stage(key, img, params)
+        elif op == "crop":
+            key, img = crop_stage(key, img, *params)
+        elif op == "enhance":
+            key, img = enhance_stage(key, img, **params)
+        else:
+            raise ValueError(f"Unknown edit operation: {op}")
+    return key, img
+
+def load_preview(file_bytes, width):
+    """(key, proxy, proxy as st.image bytes) for an upload, the proxy no wider than width."""
+    key, img = load_image(file_bytes, max_width=width)
+    return key, img, encoded_stage(key, img)[1]
+
+def edit_previews(key, img, edits, width):
+    """
+    Replay edits on a proxy for display: (edited image, st.image bytes before enhancement, st.image bytes
+    of the edited image fitted in width x width). Every step is a pipeline-cache hit if its inputs did not change.
+    """
+    crop_key, cropped = apply_edits_cached(key, img, [edit for edit in edits if edit[0] != "enhance"])
+    edit_key, edited = apply_edits_cached(crop_key, cropped, [edit for edit in edits if edit[0] == "enhance"])
+    return edited, encoded_stage(crop_key, cropped)[1], encoded_stage(edit_key, edited, (width, width))[1]
+
+def map_images(fn, *iterables):
+    """
+    fn over the items on the pipeline thread pool, results in input order, so a rerun waits for the slowest
+    image instead of the sum of all. A single item runs inline. Stages in pool threads are not traced.
+    """
+    items = list(zip(*iterables))
+    if len(items) <= 1:
+        return [fn(*args) for args in items]
+    with span("parallel", images=len(items)):
+        return list(_POOL.map(fn, *zip(*items)))
+
+def render_full_resolution_cached(file_bytes, edits):
+    """Cached equivalent of image_utils.render_full_resolution."""
+    key, img = load_image(file_bytes)
+    return apply_edits_cached(key, img, edits)[1]
+
+def export_source_cached(file_bytes, edits):
+    """Cached equivalent of image_utils.export_source: the original JPEG when only cropped, else the full-resolution render."""
+    passthrough = jpeg_passthrough(file_bytes, edits)
+    return passthrough if passthrough is not None else render_full_resolution_cached(file_bytes, edits)
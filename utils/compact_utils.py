@@ -0,0 +1,192 @@
+import hashlib
+import struct
+import zlib
+from collections import namedtuple
+from io import BytesIO
+from PyPDF2.generic import (
+    ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject,
+)
+
+# Non-stream objects per compressed object stream; readers decompress a whole stream to reach one object
+OBJECTS_PER_STREAM = 200
+# Structural objects whose identity matters: two equal pages are still two pages
+_UNIQUE_TYPES = ("/Page", "/Pages", "/Catalog")
+
+CompactStats = namedtuple("CompactStats", "merged_bytes output_bytes duplicates unused")
+
+class _ByteCounter:
+    """Write-only sink that just counts, to size the plain output without holding it."""
+    def __init__(self):
+        self.n = 0
+
+    def write(self, data):
+        self.n += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.n
+
+def _remap(obj, mapping, pdf):
+    """Point every reference in obj (a direct dict or array, walked recursively) at mapping[idnum] where present."""
+    items = obj.items() if isinstance(obj, DictionaryObject) else enumerate(obj)
+    for key, value in list(items):
+        if isinstance(value, IndirectObject):
+            if value.idnum in mapping:
+                obj[key] = IndirectObject(mapping[value.idnum], 0, pdf)
+        elif isinstance(value, (DictionaryObject, ArrayObject)):
+            _remap(value, mapping, pdf)
+
+def _serialize(obj):
+    buf = BytesIO()
+    if isinstance(obj, StreamObject):
+        DictionaryObject.write_to_stream(obj, buf, None)
+    else:
+        obj.write_to_stream(buf, None)
+    return buf.getvalue()
+
+def _deduplicate(objects, pinned, pdf):
+    """
+    Point references to identical objects at one copy, repeating until nothing changes (two fonts only
+    become equal once their descriptors and font files have been merged). objects: {idnum: object}.
+    Returns the number of objects merged away; they are removed from objects.
+    """
+    data_digests = {}
+    merged = 0
+    while True:
+        seen, mapping = {}, {}
+        for idnum, obj in objects.items():
+            if idnum in pinned or (isinstance(obj, DictionaryObject) and obj.get("/Type") in _UNIQUE_TYPES):
+                continue
+            key = _serialize(obj)
+            if isinstance(obj, StreamObject):
+                if idnum not in data_digests:
+                    data_digests[idnum] = hashlib.blake2b(obj._data, digest_size=20).digest()
+                key += data_digests[idnum]
+            keep = seen.setdefault(key, idnum)
+            if keep != idnum:
+                mapping[idnum] = keep
+        if not mapping:
+            return merged
+        for idnum in mapping:
+            del objects[idnum]
+        for obj in objects.values():
+            if isinstance(obj, (DictionaryObject, ArrayObject)):
+                _remap(obj, mapping, pdf)
+        merged += len(mapping)
+
+def _reachable(objects, roots):
+    """idnums reachable from roots, in first-visit order."""
+    order, seen, todo = [], set(), list(reversed(roots))
+    while todo:
+        idnum = todo.pop()
+        if idnum in seen or idnum not in objects:
+            continue
+        seen.add(idnum)
+        order.append(idnum)
+        refs = []
+        stack = [objects[idnum]]
+        while stack:
+            obj = stack.pop()
+            values = obj.values() if isinstance(obj, DictionaryObject) else obj if isinstance(obj, ArrayObject) else ()
+            for value in values:
+                if isinstance(value, IndirectObject):
+                    refs.append(value.idnum)
+                elif isinstance(value, (DictionaryObject, ArrayObject)):
+                    stack.append(value)
+        todo.extend(reversed(refs))
+    return order
+
+def _flate(obj):
+    """Deflate an unfiltered stream in place if that makes it smaller."""
+    if "/Filter" in obj or len(obj._data) < 64:
+        return
+    packed = zlib.compress(obj._data, 9)
+    if len(packed) < len(obj._data):
+        obj._data = packed
+        obj[NameObject("/Filter")] = NameObject("/FlateDecode")
+
+def _write_object(out, idnum, body):
+    out.write(b"%d 0 obj\n" % idnum)
+    out.write(body)
+    out.write(b"\nendobj\n")
+
+def _stream_body(entries, data):
+    head = DictionaryObject(entries)
+    head[NameObject("/Length")] = NumberObject(len(data))
+    return _serialize(head) + b"\nstream\n" + data + b"\nendstream"
+
+def write_compact(writer, out):
+    """
+    Write writer's document to out as a PDF 1.5 with one copy of each identical object, no unreferenced
+    objects, unfiltered streams deflated, and the remaining objects packed into compressed object streams
+    with a cross-reference stream. Rewrites writer's objects in place, so writer is spent afterwards.
+    Returns CompactStats (merged_bytes: the size writer.write() would have produced).
+    """
+    counter = _ByteCounter()
+    writer.write_stream(counter)  # also pulls every object still referenced from an input into writer
+    objects = {i + 1: obj for i, obj in enumerate(writer._objects) if obj is not None}
+    roots = [writer._root.idnum, writer._info.idnum]
+    duplicates = _deduplicate(objects, set(roots), writer)
+
+    # Renumber the reachable objects 1..n, streams first written as they are, the rest packed
+    order = _reachable(objects, roots)
+    unused = len(objects) - len(order)
+    numbers = {old: new for new, old in enumerate(order, 1)}
+    for old in order:
+        obj = objects[old]
+        if isinstance(obj, (DictionaryObject, ArrayObject)):
+            _remap(obj, numbers, writer)
+
+    start = out.tell()  # offsets are from the start of the PDF, wherever it begins in out
+    out.write(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n")
+    xref = {}  # new idnum -> (1, offset, 0) for top-level objects, (2, object stream, index) for packed ones
+    packed = []
+    for old in order:
+        obj, new = objects[old], numbers[old]
+        if isinstance(obj, StreamObject):
+            _flate(obj)
+            xref[new] = (1, out.tell() - start, 0)
+            buf = BytesIO()
+            obj.write_to_stream(buf, None)
+            _write_object(out, new, buf.getvalue())
+        else:
+            packed.append((new, _serialize(obj)))
+
+    next_id = len(order) + 1
+    for first in range(0, len(packed), OBJECTS_PER_STREAM):
+        chunk = packed[first:first + OBJECTS_PER_STREAM]
+        offsets, body = [], BytesIO()
+        for index, (new, data) in enumerate(chunk):
+            offsets.append(b"%d %d" % (new, body.tell()))
+            body.write(data)
+            body.write(b"\n")
+            xref[new] = (2, next_id, index)
+        header = b" ".join(offsets) + b"\n"
+        data = zlib.compress(header + body.getvalue(), 9)
+        xref[next_id] = (1, out.tell() - start, 0)
+        _write_object(out, next_id, _stream_body({
+            NameObject("/Type"): NameObject("/ObjStm"),
+            NameObject("/N"): NumberObject(len(chunk)),
+            NameObject("/First"): NumberObject(len(header)),
+            NameObject("/Filter"): NameObject("/FlateDecode"),
+        }, data))
+        next_id += 1
+
+    xref_id = next_id
+    xref_offset = out.tell() - start
+    xref[xref_id] = (1, xref_offset, 0)
+    rows = [struct.pack(">BIH", 0, 0, 65535)]
+    rows += [struct.pack(">BIH", *xref[i]) for i in range(1, xref_id + 1)]
+    trailer = {
+        NameObject("/Type"): NameObject("/XRef"),
+        NameObject("/Size"): NumberObject(xref_id + 1),
+        NameObject("/W"): ArrayObject([NumberObject(1), NumberObject(4), NumberObject(2)]),
+        NameObject("/Root"): IndirectObject(numbers[roots[0]], 0, writer),
+        NameObject("/Info"): IndirectObject(numbers[roots[1]], 0, writer),
+        NameObject("/Filter"): NameObject("/FlateDecode"),
+    }
+    if hasattr(writer, "_ID"):
+        trailer[NameObject("/ID")] = writer._ID
+    _write_object(out, xref_id, _stream_body(trailer, zlib.compress(b"".join(rows), 9)))
+    out.write(b"startxref\n%d\n%%%%EOF\n" % xref_offset)
+    return CompactStats(counter.n, out.tell() - start, duplicates, unused)
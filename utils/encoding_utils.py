@@ -0,0 +1,117 @@
+from collections import namedtuple
+from io import BytesIO
+from PIL import ImageChops
+from utils.image_utils import JpegSource
+
+# jpeg_quality None means lossless (Flate) for every image
+EncodingProfile = namedtuple("EncodingProfile", "name max_dpi jpeg_quality")
+
+PROFILE_DEFAULTS = {
+    "draft": {"max_dpi": 150, "jpeg_quality": 60},
+    "office": {"max_dpi": 300, "jpeg_quality": 85},
+    "archival": {"max_dpi": 600, "jpeg_quality": None},
+}
+# Images mostly made of a few flat colors (text, logos, QR codes, bilevel scans) stay lossless: Flate keeps
+# their edges sharp and is smaller than JPEG on flat areas. Line art: its LINE_ART_COLORS most common colors
+# cover LINE_ART_COVERAGE of the pixels (anti-aliased edges add a long tail of rare ones)
+LINE_ART_COLORS = 16
+LINE_ART_COVERAGE = 0.98
+_MAX_COUNTED_COLORS = 4096  # more than this is a photo; PIL stops counting there
+# A JPEG upload is embedded as-is unless it has more than this many times the pixels the profile needs
+PASSTHROUGH_OVERSIZE = 1.5
+# Limits of the fit-under search
+MIN_QUALITY = 30
+MIN_DPI = 72
+
+def encoding_profiles(config):
+    """{name: EncodingProfile} from the pdf_profiles block of config.yaml (PROFILE_DEFAULTS if absent), lowest max_dpi first."""
+    profiles = config.get("pdf_profiles") or PROFILE_DEFAULTS
+    return {
+        name: EncodingProfile(name, int(p["max_dpi"]), None if p.get("jpeg_quality") is None else int(p["jpeg_quality"]))
+        for name, p in sorted(profiles.items(), key=lambda item: item[1]["max_dpi"])
+    }
+
+def profile_for_dpi(config, dpi, name=None):
+    """The named profile, else the first whose max_dpi covers dpi (the DPI slider's mapping), else the highest."""
+    profiles = encoding_profiles(config)
+    if name:
+        if name not in profiles:
+            raise ValueError(f"Unknown PDF profile '{name}' (expected one of {', '.join(profiles)})")
+        return profiles[name]
+    for profile in profiles.values():
+        if dpi <= profile.max_dpi:
+            return profile
+    return profile
+
+def describe_profile(profile):
+    codec = "lossless" if profile.jpeg_quality is None else f"JPEG quality {profile.jpeg_quality}"
+    return f"{profile.name}: {codec}, images up to {profile.max_dpi} DPI"
+
+def capped_dpi(dpi, profile):
+    return dpi if profile is None else min(dpi, profile.max_dpi)
+
+def _is_gray(img):
+    if img.mode == "L":
+        return True
+    r, g, b = img.convert("RGB").split()
+    return ImageChops.difference(r, g).getbbox() is None and ImageChops.difference(g, b).getbbox() is None
+
+def _is_line_art(img):
+    colors = img.getcolors(_MAX_COUNTED_COLORS)
+    if colors is None:
+        return False
+    counts = sorted((n for n, _ in colors), reverse=True)
+    return sum(counts[:LINE_ART_COLORS]) >= LINE_ART_COVERAGE * img.size[0] * img.size[1]
+
+def encode_image(img, px, profile):
+    """
+    What to embed for one image under profile, at px (width, height) pixels or None for its own size:
+    a JpegSource (an upload passed through, or a fresh JPEG) or a PIL Image for reportlab to Flate.
+    Grayscale content is embedded with one channel instead of three.
+    """
+    if isinstance(img, JpegSource):
+        w, h = img.crop_size
+        if profile.jpeg_quality is None or px is None or w * h <= px[0] * px[1] * PASSTHROUGH_OVERSIZE:
+            return img
+        img = img.to_image()
+    line_art = _is_line_art(img)
+    img = img.convert("L") if _is_gray(img) else img.convert("RGB")
+    if px is not None and img.size != px:
+        img = img.resize(px)
+    if profile.jpeg_quality is None or line_art:
+        return img
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=profile.jpeg_quality, optimize=True)
+    return JpegSource(buffer.getvalue(), img.size, (0, 0) + img.size)
+
+def fit_under(build, profile, max_bytes, dpi):
+    """
+    build(profile) -> BytesIO. Without max_bytes, just build(profile). Otherwise find the highest JPEG
+    quality (down to MIN_QUALITY) whose output fits, then lower the image DPI cap (down to MIN_DPI) if even
+    that is too big. Each try is a full build. Returns the first fit, else the smallest output tried.
+    """
+    result = build(profile)
+    if not max_bytes or profile is None or result.getbuffer().nbytes <= max_bytes:
+        return result
+    smallest, fitted = result, None
+    lo, hi = MIN_QUALITY, (profile.jpeg_quality - 1) if profile.jpeg_quality is not None else 95
+    while lo <= hi:
+        quality = (lo + hi) // 2
+        result = build(profile._replace(jpeg_quality=quality))
+        if result.getbuffer().nbytes <= max_bytes:
+            fitted, lo = result, quality + 1
+        else:
+            hi = quality - 1
+            if result.getbuffer().nbytes < smallest.getbuffer().nbytes:
+                smallest = result
+    if fitted is not None:
+        return fitted
+    cap = capped_dpi(dpi, profile)
+    while cap > MIN_DPI:
+        cap = max(MIN_DPI, int(cap * 0.75))
+        result = build(profile._replace(jpeg_quality=MIN_QUALITY, max_dpi=cap))
+        if result.getbuffer().nbytes <= max_bytes:
+            return result
+        if result.getbuffer().nbytes < smallest.getbuffer().nbytes:
+            smallest = result
+    return smallest
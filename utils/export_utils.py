@@ -0,0 +1,206 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from utils.artifact_utils import artifact_key, lookup
+from utils.trace_utils import trace_run
+
+EXPORT_LABELS = {"pdf": "📄 Download PDF", "docx": "📝 Download Word"}
+EXPORT_MIME = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "png": "image/png",
+    "tiff": "image/tiff",
+}
+# Built together on the first download request; any other format (a 1200 DPI raster) only when asked for
+EAGER_FORMATS = ("pdf", "docx")
+
+# Shared by every session; the encoders spend most of their time in zlib, JPEG and PIL code that releases the GIL
+_POOL = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="export")
+
+def export_fingerprint(*parts):
+    """Digest of everything an export depends on (source hashes, edit lists, positions, sizes, DPI, ...)."""
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+class ExportManager:
+    """
+    One tool's downloads for one session. Each rerun registers its inputs with update(); nothing is
+    encoded until a download asks for data(), and outputs are reused until the fingerprint changes.
+    Finished outputs are handed to the session's store (see session_utils), which may spill them to disk.
+    """
+    def __init__(self, name, session_id=None, store=None):
+        self.name = name
+        self.session_id = session_id
+        self.store = store
+        self.fingerprint = None
+        self._prepare = None
+        self._encoders = {}
+        self._futures = {}  # in flight (or done, until moved into the store)
+        self._stored = {}  # format -> fingerprint its stored output was built from
+        self._lock = threading.RLock()  # guards the fields above; re-entered by done callbacks of finished futures
+        self._build_lock = threading.Lock()  # one full-resolution prepare at a time
+
+    def update(self, fingerprint, prepare, encoders):
+        """
+        prepare: callable returning the full-resolution export images (or a callable(index) producing them, see pages_encoders);
+        encoders: {format: callable(images, cache_key=None) -> BytesIO}, e.g. from layout_encoders.
+        Returns True if the inputs changed (earlier outputs are dropped), False if this rerun costs nothing.
+        """
+        with self._lock:
+            if fingerprint == self.fingerprint and encoders.keys() == self._encoders.keys():
+                return False
+            self.fingerprint = fingerprint
+            self._prepare = prepare
+            self._encoders = encoders
+            self._drop_outputs()
+            return True
+
+    def formats(self):
+        with self._lock:
+            return list(self._encoders)
+
+    def clear(self):
+        with self._lock:
+            self.fingerprint = None
+            self._prepare = None
+            self._encoders = {}
+            self._drop_outputs()
+
+    def _store_name(self, fmt):
+        return f"export.{self.name}.{fmt}"
+
+    def _drop_outputs(self):
+        self._futures = {}
+        if self.store is not None:
+            for fmt in self._stored:
+                self.store.pop(self._store_name(fmt))
+        self._stored = {}
+
+    def _encode(self, fmt, encoder, images, cache_key):
+        with trace_run(f"{self.name}.{fmt}", self.session_id):
+            return encoder(images, cache_key=cache_key)
+
+    def _keep(self, fmt, fingerprint, future):
+        """Done callback: move a finished output from its future into the session store."""
+        if self.store is None or future.exception() is not None:
+            return
+        with self._lock:
+            if self.fingerprint != fingerprint or self._futures.get(fmt) is not future:
+                return
+            self.store.put(self._store_name(fmt), future.result())
+            self._stored[fmt] = fingerprint
+            del self._futures[fmt]
+
+    def _submit(self, fmt, fingerprint, future_or_fn, *args):
+        """Record a future for fmt (caller holds _lock)."""
+        if callable(future_or_fn):
+            future = _POOL.submit(future_or_fn, *args)
+        else:
+            future = future_or_fn
+        self._futures[fmt] = future
+        future.add_done_callback(lambda f: self._keep(fmt, fingerprint, f))
+        return future
+
+    def _start(self, fmt):
+        """Submit fmt (plus the eager formats not started yet) for the current inputs; returns its future."""
+        with self._lock:
+            fingerprint, prepare, encoders = self.fingerprint, self._prepare, self._encoders
+            if fmt in self._futures:
+                return self._futures[fmt]
+        # A repeat of an earlier export (any session or process) comes from the artifact cache, before anything is decoded
+        data = lookup(artifact_key("export", fingerprint, fmt))
+        if data is not None:
+            future = Future()
+            with self._lock:
+                if self.fingerprint == fingerprint and fmt not in self._futures:
+                    self._submit(fmt, fingerprint, future)
+            future.set_result(BytesIO(data))
+            return future
+        with self._build_lock:
+            images = prepare()
+        with self._lock:
+            current = self.fingerprint == fingerprint
+            names = [fmt] + ([n for n in EAGER_FORMATS if n in encoders] if fmt in EAGER_FORMATS else [])
+            futures = {}
+            for name in names:
+                if current and (name in self._futures or self._stored.get(name) == fingerprint):
+                    continue
+                args = (name, encoders[name], images, artifact_key("export", fingerprint, name))
+                if current:
+                    futures[name] = self._submit(name, fingerprint, self._encode, *args)
+                else:
+                    # The inputs changed meanwhile: still answer this caller, just do not keep the output
+                    futures[name] = _POOL.submit(self._encode, *args)
+            future = futures.get(fmt) or self._futures.get(fmt)
+        if future is None:
+            # Finished by a concurrent request and already moved into the store
+            future = Future()
+            future.set_result(self.store.get(self._store_name(fmt)))
+        return future
+
+    def data(self, fmt):
+        """The encoded bytes for fmt, built now if the inputs changed since the last build (blocks until done)."""
+        with self._lock:
+            stored = self.store is not None and fmt in self._stored and self._stored[fmt] == self.fingerprint
+        if stored:
+            buffer = self.store.get(self._store_name(fmt))
+            if buffer is not None:
+                return buffer.getvalue()
+        return self._start(fmt).result().getvalue()
+
+    def reader(self, fmt):
+        """Zero-argument callable for st.download_button(data=...), which runs it only on click."""
+        return lambda: self.data(fmt)
+
+def session_exports(state, key, name=None):
+    """The ExportManager stored under key in session state, created on first use (outputs go to the session store)."""
+    if state.get(key) is None:
+        from utils.session_utils import session_store
+        state[key] = ExportManager(name or key, state.get("session_id"), session_store(state))
+    return state[key]
+
+def layout_encoders(positions, page_width_inch, page_height_inch, img_width_inch, img_height_inch, dpi=300, auto_rotate=False, raster_format=None, raster_dpi=None, profile=None, max_bytes=None):
+    """PDF and DOCX encoders (plus the raster one if raster_format is set) for one page layout; profile and max_bytes apply to the PDF."""
+    args = (positions, page_width_inch, page_height_inch, img_width_inch, img_height_inch)
+
+    def pdf(images, cache_key=None):
+        from utils.pdf_utils import save_layout_as_pdf
+        return save_layout_as_pdf(images, *args, dpi=dpi, profile=profile, max_bytes=max_bytes, cache_key=cache_key)
+
+    def docx(images, cache_key=None):
+        from utils.word_utils import save_image_as_word
+        return save_image_as_word(images, *args, dpi=dpi, auto_rotate=auto_rotate, cache_key=cache_key)
+
+    def raster(images, cache_key=None):
+        from utils.raster_utils import save_layout_as_raster
+        return save_layout_as_raster(images, *args, dpi=raster_dpi or dpi, fmt=raster_format, cache_key=cache_key)
+
+    encoders = {"pdf": pdf, "docx": docx}
+    if raster_format:
+        encoders[raster_format] = raster
+    return encoders
+
+def pages_encoders(pages, page_width_inch, page_height_inch, dpi=300, profile=None, max_bytes=None):
+    """
+    PDF encoder for a multi-page layout. pages: list of (image indices, positions, sizes) per page, indices into
+    what prepare() returns: a list (every image is embedded once however many pages use it), or a callable(index)
+    producing each image as its page is drawn, so only one page's images are in memory at a time.
+    """
+    def pdf(images, cache_key=None):
+        from utils.pdf_utils import save_pages_as_pdf
+        if callable(images):
+            layout = lambda: (([images(i) for i in indices], positions, sizes) for indices, positions, sizes in pages)
+        else:
+            layout = [([images[i] for i in indices], positions, sizes) for indices, positions, sizes in pages]
+        return save_pages_as_pdf(layout, page_width_inch, page_height_inch, dpi=dpi, profile=profile, max_bytes=max_bytes, cache_key=cache_key)
+
+    return {"pdf": pdf}
+
+def download_buttons(st, exports, base_name, key):
+    """One download button per registered format; each builds its file only when clicked."""
+    for fmt in exports.formats():
+        st.download_button(
+            EXPORT_LABELS.get(fmt, f"🖨️ Download {fmt.upper()}"), data=exports.reader(fmt),
+            file_name=f"{base_name}.{fmt}", mime=EXPORT_MIME[fmt], key=f"{key}_{fmt}", on_click="ignore",
+        )
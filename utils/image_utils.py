@@ -1,21 +1,78 @@
-from PIL import Image, ImageEnhance, ImageOps
+import numpy as np
+from collections import namedtuple
+from PIL import Image, ImageFilter, ImageOps
+from utils.trace_utils import traced
+from utils.ingest_utils import decode_full, exif_orientation, open_upload
 
+# ImageFilter.SMOOTH weights; Sharpness blends the image against this blur
+_SMOOTH_CENTER, _SMOOTH_TOTAL = 5.0, 13.0
+
+def _blend_lut(lut, degenerate, factor):
+    # Same float32 math and truncation as Image.blend(degenerate, img, factor)
+    out = np.float32(degenerate) + np.float32(factor) * (lut.astype(np.float32) - np.float32(degenerate))
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+def _luma_mean(img, lut=None):
+    """Mean of the "L" conversion of img after lut, as computed by ImageEnhance.Contrast."""
+    if img.mode == "L":
+        hist = np.asarray(img.histogram(), dtype=np.float64)
+        values = np.arange(256) if lut is None else lut
+    else:
+        mapped = img if lut is None else img.point(lut.tolist() * 3)
+        hist = np.asarray(mapped.convert("L").histogram(), dtype=np.float64)
+        values = np.arange(256)
+    return float((hist * values).sum() / max(1.0, hist.sum()))
+
+def _tone_lut(img, brightness, contrast):
+    """Fold Brightness then Contrast into a single 256-entry LUT (None when both are identity)."""
+    if brightness == 1.0 and contrast == 1.0:
+        return None
+    lut = np.arange(256, dtype=np.uint8)
+    if brightness != 1.0:
+        lut = _blend_lut(lut, 0, brightness)
+    if contrast != 1.0:
+        mean = int(_luma_mean(img, lut if brightness != 1.0 else None) + 0.5)
+        lut = _blend_lut(lut, mean, contrast)
+    return lut
+
+def _sharpen_kernel(sharpness):
+    # blend(SMOOTH(img), img, f) folded into one 3x3 convolution; offset mimics blend's truncation.
+    # The chain rounds SMOOTH to 8 bits before blending and that error is scaled by |1 - f|, which the fused
+    # kernel cannot reproduce: results differ by up to 1 level for f <= 3, 2 levels at the slider's 5.0
+    edge = (1.0 - sharpness) / _SMOOTH_TOTAL
+    center = sharpness + (1.0 - sharpness) * _SMOOTH_CENTER / _SMOOTH_TOTAL
+    return ImageFilter.Kernel((3, 3), [edge] * 4 + [center] + [edge] * 4, scale=1, offset=-0.5)
+
+@traced("enhance")
 def enhance_image(img, brightness=1.0, contrast=1.0, sharpness=1.0, grayscale=False, rotate_angle=0, crop_values=(0,0,0,0)):
-    img = img.convert("RGB")
+    """
+    Grayscale, rotate, crop, then brightness/contrast (one LUT pass) and sharpness (one convolution).
+    No-op steps are skipped; the result matches the chained ImageEnhance filters to 1 level per channel,
+    2 for sharpness above 3 (see _sharpen_kernel).
+    """
     if grayscale:
-        img = ImageOps.grayscale(img).convert("RGB")
-    img = img.rotate(rotate_angle, expand=True)
-    width, height = img.size
-    left_crop, top_crop, right_crop, bottom_crop = crop_values
-    img = img.crop((left_crop, top_crop, width - right_crop, height - bottom_crop))
-    img = ImageEnhance.Brightness(img).enhance(brightness)
-    img = ImageEnhance.Contrast(img).enhance(contrast)
-    img = ImageEnhance.Sharpness(img).enhance(sharpness)
+        img = ImageOps.grayscale(img)
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+    if rotate_angle % 360:
+        img = img.rotate(rotate_angle, expand=True)
+    if any(crop_values):
+        width, height = img.size
+        left_crop, top_crop, right_crop, bottom_crop = crop_values
+        img = img.crop((left_crop, top_crop, width - right_crop, height - bottom_crop))
+    lut = _tone_lut(img, brightness, contrast)
+    if lut is not None:
+        img = img.point(lut.tolist() * (1 if img.mode == "L" else 3))
+    if sharpness != 1.0:
+        img = img.filter(_sharpen_kernel(sharpness))
+    if img.mode != "RGB":
+        img = img.convert("RGB")
     return img
 
 def resize_image(img, width_inch, height_inch, dpi=300):
     return img.resize((int(width_inch * dpi), int(height_inch * dpi)))
 
+@traced("crop")
 def crop_image_relative(img, rel_left, rel_top, rel_right, rel_bottom):
     """Crop image using relative coordinates (0-1 floats)."""
     width, height = img.size
@@ -25,6 +82,7 @@ def crop_image_relative(img, rel_left, rel_top, rel_right, rel_bottom):
     bottom = int(height - rel_bottom * height)
     return img.crop((left, top, right, bottom))
 
+@traced("canvas")
 def make_canvas_with_image(page_width_inch, page_height_inch, img, img_width_inch, img_height_inch, position="center", dpi=300):
     page_px = (int(page_width_inch * dpi), int(page_height_inch * dpi))
     img_px = (int(img_width_inch * dpi), int(img_height_inch * dpi))
@@ -36,4 +94,104 @@ def make_canvas_with_image(page_width_inch, page_height_inch, img, img_width_inc
     else:
         x, y = 0, 0  # Top-left by default
     canvas.paste(img_resized, (x, y))
-    return canvas 
\ No newline at end of file
+    return canvas 
+
+@traced("preview")
+def render_layout_preview(images, positions, page_width_inch, page_height_inch, img_width_inch, img_height_inch, width=600, sizes=None):
+    """Compose a small preview of a placement layout (same positions as the PDF/Word exports)."""
+    scale = width / page_width_inch
+    page = Image.new("RGB", (width, max(1, int(page_height_inch * scale))), "white")
+    if sizes is None:
+        sizes = [(img_width_inch, img_height_inch)] * len(positions)
+    thumbs = {}
+    for img, (x_inch, y_inch, rotate90), (img_w, img_h) in zip(images, positions, sizes):
+        key = (id(img), rotate90, img_w, img_h)
+        if key not in thumbs:
+            thumb = img.convert("RGB").rotate(90, expand=True) if rotate90 else img.convert("RGB")
+            w, h = (img_h, img_w) if rotate90 else (img_w, img_h)
+            thumbs[key] = thumb.resize((max(1, int(w * scale)), max(1, int(h * scale))))
+        page.paste(thumbs[key], (int(x_inch * scale), int(y_inch * scale)))
+    return page
+
+@traced("deskew")
+def deskew_image(img, angle):
+    """Rotate by angle degrees counter-clockwise, expanding the canvas and filling the corners with white."""
+    if not angle:
+        return img
+    return img.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor="white")
+
+def apply_edits(img, edits):
+    """
+    Replay an edit list recorded on a preview proxy against another image (e.g. the full-resolution original).
+    edits: list of (op, params): ("deskew", degrees), ("crop", (rel_left, rel_top, rel_right, rel_bottom))
+    or ("enhance", {enhance_image kwargs})
+    """
+    for op, params in edits:
+        if op == "deskew":
+            img = deskew_image(img, params)
+        elif op == "crop":
+            img = crop_image_relative(img, *params)
+        elif op == "enhance":
+            img = enhance_image(img, **params)
+        else:
+            raise ValueError(f"Unknown edit operation: {op}")
+    return img
+
+@traced("full_resolution")
+def render_full_resolution(file_bytes, edits):
+    """Decode the original upload at full resolution (upright) and apply the recorded edits (used only at export time)."""
+    img = decode_full(file_bytes)
+    return apply_edits(img, edits)
+
+class JpegSource(namedtuple("JpegSource", "data size box")):
+    """
+    An unedited (or crop-only) JPEG upload that the PDF exporters embed as-is, without decoding or re-encoding.
+    data: original JPEG bytes or its Upload; size: (width, height) in pixels; box: crop (left, top, right, bottom) in pixels
+    """
+    __slots__ = ()
+
+    @property
+    def crop_size(self):
+        return self.box[2] - self.box[0], self.box[3] - self.box[1]
+
+    def to_image(self):
+        img = Image.open(open_upload(self.data)).convert("RGB")
+        return img if self.box == (0, 0) + self.size else img.crop(self.box)
+
+def jpeg_passthrough(file_bytes, edits):
+    """Return a JpegSource if the upload is a plain RGB/gray JPEG and the edits only crop it, else None."""
+    if not file_bytes.startswith(b"\xff\xd8"):
+        return None
+    crops = []
+    for op, params in edits:
+        if op == "crop":
+            crops.append(params)
+        elif op == "deskew":
+            if params:
+                return None
+        elif op != "enhance" or params.get("grayscale") or any(params.get(k, 1.0) != 1.0 for k in ("brightness", "contrast", "sharpness")):
+            return None
+    if len(crops) > 1:
+        return None
+    img = Image.open(open_upload(file_bytes))  # header only, no pixel decode
+    # EXIF-rotated and CMYK JPEGs would not print as they preview, so they go through decode_full, which uprights them
+    if img.mode not in ("RGB", "L") or exif_orientation(img) != 1:
+        return None
+    width, height = img.size
+    rel_left, rel_top, rel_right, rel_bottom = crops[0] if crops else (0, 0, 0, 0)
+    box = (int(rel_left * width), int(rel_top * height), int(width - rel_right * width), int(height - rel_bottom * height))
+    return JpegSource(file_bytes, (width, height), box)
+
+def as_image(img):
+    """PIL Image for an export source (decodes a JpegSource)."""
+    return img.to_image() if isinstance(img, JpegSource) else img
+
+def export_source(file_bytes, edits):
+    """What the exporters should embed: the original JPEG when no pixel edits apply, else the full-resolution render."""
+    passthrough = jpeg_passthrough(file_bytes, edits)
+    return passthrough if passthrough is not None else render_full_resolution(file_bytes, edits)
+
+def iter_export_sources(sources, edits_list):
+    """Lazily produce each upload's export source (full-resolution render or JPEG passthrough), one at a time."""
+    for file_bytes, edits in zip(sources, edits_list):
+        yield export_source(file_bytes, edits)
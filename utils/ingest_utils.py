@@ -0,0 +1,54 @@
+from io import BytesIO
+from PIL import Image, ImageOps
+
+ORIENTATION_TAG = 0x0112
+# EXIF orientations 5-8 store the picture a quarter turn off, so width and height swap when upright
+_QUARTER_TURNS = (5, 6, 7, 8)
+
+def open_upload(file_bytes):
+    """A file object at offset 0 over upload bytes or an Upload (see upload_utils), without copying them."""
+    return file_bytes.open() if hasattr(file_bytes, "open") else BytesIO(file_bytes)
+
+def exif_orientation(img):
+    return img.getexif().get(ORIENTATION_TAG, 1)
+
+def upright_size(file_bytes):
+    """(width, height) of an upload as it should display, from the header only (no pixel decode)."""
+    img = Image.open(open_upload(file_bytes))
+    width, height = img.size
+    return (height, width) if exif_orientation(img) in _QUARTER_TURNS else (width, height)
+
+def _upright_rgb(img, orientation):
+    if orientation != 1:
+        img = ImageOps.exif_transpose(img)
+    # convert() to the same mode would copy a full-size image for nothing
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.load()
+    return img
+
+def decode_full(file_bytes):
+    """The export handle: the whole upload at native resolution, RGB and upright per its EXIF orientation."""
+    img = Image.open(open_upload(file_bytes))
+    return _upright_rgb(img, exif_orientation(img))
+
+def decode_proxy(file_bytes, max_width):
+    """
+    A preview proxy no wider than max_width, RGB and upright.
+    JPEGs are decoded in draft mode (libjpeg DCT scaling to 1/2, 1/4 or 1/8, never below the target),
+    so a 12 MP photo is never decoded at full size; the rest of the way is a reducing Lanczos resize.
+    """
+    img = Image.open(open_upload(file_bytes))
+    orientation = exif_orientation(img)
+    width, height = img.size
+    upright_width = height if orientation in _QUARTER_TURNS else width
+    if upright_width > max_width:
+        scale = max_width / upright_width
+        # Draft sizes are in stored (not upright) orientation; no-op for formats other than JPEG
+        img.draft("RGB", (max(1, int(width * scale) + 1), max(1, int(height * scale) + 1)))
+    img = _upright_rgb(img, orientation)
+    if img.width > max_width:
+        ratio = max_width / img.width
+        # reducing_gap lets Pillow shrink by whole factors (fast box reduce) before the Lanczos pass
+        img = img.resize((max_width, max(1, int(img.height * ratio))), Image.Resampling.LANCZOS, reducing_gap=3.0)
+    return img
@@ -0,0 +1,264 @@
+import csv
+import os
+import re
+import yaml
+from utils.image_utils import export_source
+from utils.ingest_utils import decode_proxy
+from utils.autocrop_utils import DETECT_SIZE, detect_card, detection_edits
+from utils.layout_utils import get_valid_grids, grid_positions, center_position, front_back_positions, stacked_positions
+from utils.pdf_utils import save_layout_as_pdf, save_images_as_pdf
+from utils.merge_utils import merge_pdfs, merge_pdfs_compact, split_pdf_to_zip
+from utils.artifact_utils import artifact_key, file_digest, lookup, store
+from utils.word_utils import save_image_as_word
+from utils.encoding_utils import encoding_profiles, profile_for_dpi
+
+LAYOUT_MODES = ("grid", "center", "front_back", "multi")
+# Whole-document jobs: one PDF page per image, PDF merge, PDF split (their output format is fixed)
+DOCUMENT_MODES = ("image_to_pdf", "merge", "split")
+JOB_MODES = LAYOUT_MODES + DOCUMENT_MODES
+# Output formats of the layout modes
+JOB_FORMATS = ("pdf", "docx")
+_GRID = re.compile(r"^\s*\d+\s*x\s*\d+\s*$", re.IGNORECASE)
+
+# Job names become output file names (<name>.pdf, split ZIP entries), so they must stay inside the output directory
+_UNSAFE_NAME = re.compile(r"[/\\\x00]|\.\.")
+
+JOB_DEFAULTS = {
+    "mode": "grid",
+    "page_size": "a4",
+    "document_type": "id_card",
+    "dpi": 300,
+    "grid": None,
+    "auto_rotate": False,
+    "auto_crop": False,
+    "spacing": 0.25,
+    "deskew": 0.0,
+    "left_crop": 0,
+    "top_crop": 0,
+    "right_crop": 0,
+    "bottom_crop": 0,
+    "brightness": 1.0,
+    "contrast": 1.0,
+    "sharpness": 1.0,
+    "grayscale": False,
+    "fit_to_page": True,
+    "page_ranges": "",
+    "compact": False,
+    "profile": "",
+    "max_mb": 0,
+    "formats": ["pdf", "docx"],
+}
+
+def _as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y", "on")
+    return bool(value)
+
+def _as_list(value):
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(";") if v.strip()]
+    return list(value or [])
+
+def _check_choice(job, field, choices):
+    if job[field] not in choices:
+        raise ValueError(f"{job['name']}: unknown {field} '{job[field]}' (expected one of {', '.join(choices)})")
+
+def normalize_job(raw, index=0, base_dir=".", config=None):
+    """
+    Fill in defaults and coerce a manifest row (CSV strings or YAML values) into a job dict.
+    With config, page_size, document_type and profile are checked against it, so a typo fails here, not in a worker.
+    """
+    job = dict(JOB_DEFAULTS)
+    job.update({k: v for k, v in raw.items() if v not in (None, "")})
+    job["name"] = str(job.get("name") or f"job_{index + 1}")
+    if _UNSAFE_NAME.search(job["name"]) or os.path.isabs(job["name"]):
+        raise ValueError(f"Job name {job['name']!r} must be a plain file name (no path separators or '..')")
+    if job["mode"] not in JOB_MODES:
+        raise ValueError(f"{job['name']}: unknown mode '{job['mode']}' (expected one of {', '.join(JOB_MODES)})")
+    job["images"] = [p if os.path.isabs(p) else os.path.join(base_dir, p) for p in _as_list(job.get("images"))]
+    if not job["images"]:
+        raise ValueError(f"{job['name']}: no images listed")
+    job["formats"] = [f.lower() for f in _as_list(job["formats"])]
+    unknown = [f for f in job["formats"] if f not in JOB_FORMATS]
+    if unknown:
+        raise ValueError(f"{job['name']}: unknown format(s) '{';'.join(unknown)}' (expected one of {', '.join(JOB_FORMATS)})")
+    if job["mode"] in LAYOUT_MODES and not job["formats"]:
+        raise ValueError(f"{job['name']}: no formats listed")
+    if job["grid"] and not _GRID.match(str(job["grid"])):
+        raise ValueError(f"{job['name']}: grid '{job['grid']}' is not columns x rows (e.g. 2x4)")
+    job["dpi"] = int(job["dpi"])
+    job["spacing"] = float(job["spacing"])
+    for key in ("left_crop", "top_crop", "right_crop", "bottom_crop"):
+        job[key] = float(job[key])
+    for key in ("deskew", "brightness", "contrast", "sharpness"):
+        job[key] = float(job[key])
+    job["grayscale"] = _as_bool(job["grayscale"])
+    job["auto_rotate"] = _as_bool(job["auto_rotate"])
+    job["auto_crop"] = _as_bool(job["auto_crop"])
+    job["fit_to_page"] = _as_bool(job["fit_to_page"])
+    job["compact"] = _as_bool(job["compact"])
+    job["profile"] = str(job["profile"])
+    job["max_mb"] = float(job["max_mb"])
+    job["page_ranges"] = str(job["page_ranges"])
+    if config is not None:
+        if job["mode"] not in ("merge", "split"):
+            _check_choice(job, "page_size", list(config["page_sizes"]))
+        if job["mode"] in LAYOUT_MODES:
+            _check_choice(job, "document_type", list(config["document_sizes"]))
+        if job["profile"]:
+            _check_choice(job, "profile", list(encoding_profiles(config)))
+    return job
+
+def load_manifest(path, config=None):
+    """
+    Read a CSV or YAML manifest into a list of normalized jobs (checked against config if given).
+    Image paths are relative to the manifest. Job names must be unique: they name the output files.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    if path.lower().endswith((".yaml", ".yml")):
+        with open(path, "r") as f:
+            data = yaml.safe_load(f) or []
+        rows = data.get("jobs", []) if isinstance(data, dict) else data
+    else:
+        with open(path, "r", newline="") as f:
+            rows = list(csv.DictReader(f))
+    jobs = [normalize_job(row, i, base_dir, config) for i, row in enumerate(rows)]
+    seen = set()
+    for job in jobs:
+        if job["name"] in seen:
+            raise ValueError(f"{job['name']}: duplicate job name (its outputs would overwrite each other)")
+        seen.add(job["name"])
+    return jobs
+
+def job_edits(job):
+    """The job's deskew, crop (percent, as in the UI) and enhancement as an edit list."""
+    return [
+        ("deskew", job["deskew"]),
+        ("crop", (job["left_crop"] / 100.0, job["top_crop"] / 100.0, job["right_crop"] / 100.0, job["bottom_crop"] / 100.0)),
+        ("enhance", dict(brightness=job["brightness"], contrast=job["contrast"], sharpness=job["sharpness"], grayscale=job["grayscale"])),
+    ]
+
+def load_job_image(path, job):
+    """Read a job image and apply its edits at full resolution (or pass an unedited JPEG through)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    edits = job_edits(job)
+    if job["auto_crop"]:
+        # Detected deskew and crop replace the manual ones; enhancement still applies
+        detection = detect_card(decode_proxy(data, DETECT_SIZE))
+        if detection is not None:
+            edits = detection_edits(detection) + [edit for edit in edits if edit[0] == "enhance"]
+    return export_source(data, edits)
+
+def _pick_grid(job, valid_grids):
+    if job["grid"]:
+        cols, rows = (int(v) for v in str(job["grid"]).lower().split("x"))
+        for grid in valid_grids:
+            if grid[:2] == (cols, rows):
+                return grid
+        raise ValueError(f"{job['name']}: grid {cols}x{rows} does not fit this page and document size")
+    # Default to the grid that fits the most documents, preferring no rotation
+    return max(valid_grids, key=lambda g: (g[0] * g[1], not g[2]))
+
+def layout_job(job, config):
+    """Return (images, positions, rotated) for a job, using the same layout math as the UI tabs."""
+    page = config["page_sizes"][job["page_size"]]
+    doc = config["document_sizes"][job["document_type"]]
+    page_w, page_h = page["width_inch"], page["height_inch"]
+    doc_w, doc_h = doc["width_inch"], doc["height_inch"]
+    dpi = job["dpi"]
+    # grid and center place one image: only the first is decoded
+    paths = job["images"][:1] if job["mode"] in ("grid", "center") else job["images"]
+    if job["mode"] == "front_back" and len(paths) != 2:
+        raise ValueError(f"{job['name']}: front_back needs exactly 2 images (front;back)")
+    images = [load_job_image(p, job) for p in paths]
+    if job["mode"] == "grid":
+        valid_grids = get_valid_grids(page_w, page_h, doc_w, doc_h, allow_rotate=job["auto_rotate"])
+        if not valid_grids:
+            raise ValueError(f"{job['name']}: no valid grid fits this document and page size")
+        columns, rows, rotated = _pick_grid(job, valid_grids)
+        positions = grid_positions(page_w, page_h, doc_w, doc_h, columns, rows, rotate=rotated, dpi=dpi)
+        images = [images[0]] * len(positions)
+    elif job["mode"] == "center":
+        rotated = job["auto_rotate"] and doc_w < doc_h
+        positions = [center_position(page_w, page_h, doc_w, doc_h, rotate=rotated, dpi=dpi)]
+    elif job["mode"] == "front_back":
+        rotated = False
+        positions = front_back_positions(page_w, page_h, doc_w, doc_h, dpi=dpi)
+    else:
+        positions, rotated = stacked_positions(page_w, page_h, doc_w, doc_h, len(images), spacing=job["spacing"], auto_rotate=job["auto_rotate"], dpi=dpi)
+    return images, positions, rotated
+
+def job_cache_key(job, config, fmt, digests):
+    """Artifact cache key for one output of a job: the input files' contents plus every parameter that shapes it."""
+    # The name only changes the output when split writes it into the ZIP's member names
+    skip = ("images", "formats") if job["mode"] == "split" else ("name", "images", "formats")
+    params = sorted((k, v) for k, v in job.items() if k not in skip)
+    profile = job_profile(job, config) if fmt == "pdf" else None
+    return artifact_key("job", fmt, digests, params, profile, config["page_sizes"].get(job["page_size"]), config["document_sizes"].get(job["document_type"]))
+
+def job_profile(job, config):
+    """The job's PDF encoding profile: the one it names, else the one its dpi maps to."""
+    return profile_for_dpi(config, job["dpi"], job["profile"] or None)
+
+def _pdf_options(job, config):
+    return dict(dpi=job["dpi"], profile=job_profile(job, config), max_bytes=int(job["max_mb"] * 1e6) or None)
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+def _cached_build(key, build):
+    """Bytes for key from the artifact cache, else from build() (a BytesIO), stored for next time."""
+    data = lookup(key)
+    if data is None:
+        data = build().getvalue()
+        store(key, data)
+    return data
+
+def _render_document_job(job, config, output_dir, digests):
+    if job["mode"] == "image_to_pdf":
+        page = config["page_sizes"][job["page_size"]]
+        # Generators: one full-resolution page is decoded at a time (a fresh one per pass when fitting under max_mb)
+        pages = lambda: ((load_job_image(p, job), job["fit_to_page"]) for p in job["images"])
+        build = lambda: save_images_as_pdf(pages, page["width_inch"], page["height_inch"], **_pdf_options(job, config))
+        fmt = "pdf"
+    elif job["mode"] == "merge":
+        def build():
+            streams = [open(p, "rb") for p in job["images"]]
+            try:
+                return merge_pdfs_compact(streams)[0] if job["compact"] else merge_pdfs(streams)
+            finally:
+                for stream in streams:
+                    stream.close()
+        fmt = "pdf"
+    else:
+        def build():
+            with open(job["images"][0], "rb") as f:
+                return split_pdf_to_zip(f, job["page_ranges"], base_name=job["name"])[0]
+        fmt = "zip"
+    data = _cached_build(job_cache_key(job, config, fmt, digests), build)
+    return [_write(os.path.join(output_dir, f"{job['name']}.{fmt}"), data)]
+
+def render_job(job, config, output_dir):
+    """
+    Render one job and write its outputs to output_dir. Returns the written file paths.
+    Outputs already in the artifact cache (same files and parameters) are copied out without decoding anything.
+    """
+    digests = [file_digest(p) for p in job["images"]]
+    if job["mode"] in DOCUMENT_MODES:
+        return _render_document_job(job, config, output_dir, digests)
+    page = config["page_sizes"][job["page_size"]]
+    doc = config["document_sizes"][job["document_type"]]
+    formats = [fmt for fmt in JOB_FORMATS if fmt in job["formats"]]
+    keys = {fmt: job_cache_key(job, config, fmt, digests) for fmt in formats}
+    outputs = {fmt: lookup(keys[fmt]) for fmt in formats}
+    if None in outputs.values():
+        images, positions, rotated = layout_job(job, config)
+        args = (images, positions, page["width_inch"], page["height_inch"], doc["width_inch"], doc["height_inch"])
+        if "pdf" in formats and outputs["pdf"] is None:
+            outputs["pdf"] = save_layout_as_pdf(*args, **_pdf_options(job, config), cache_key=keys["pdf"]).getvalue()
+        if "docx" in formats and outputs["docx"] is None:
+            outputs["docx"] = save_image_as_word(*args, dpi=job["dpi"], auto_rotate=rotated, cache_key=keys["docx"]).getvalue()
+    return [_write(os.path.join(output_dir, f"{job['name']}.{fmt}"), outputs[fmt]) for fmt in formats]
@@ -0,0 +1,160 @@
+def get_valid_grids(page_w, page_h, doc_w, doc_h, min_space_inch=0.25, allow_rotate=False):
+    # Try all grid options up to 8 per page, return only those that fit
+    valid = []
+    for cols in range(1, 5):
+        for rows in range(1, 9):
+            n = cols * rows
+            if n > 8: continue
+            # Try without rotation
+            total_w = cols * doc_w + (cols - 1) * min_space_inch
+            total_h = rows * doc_h + (rows - 1) * min_space_inch
+            if total_w <= page_w and total_h <= page_h:
+                valid.append((cols, rows, False))
+            # Try with rotation if allowed
+            if allow_rotate and (doc_w != doc_h):
+                total_w_r = cols * doc_h + (cols - 1) * min_space_inch
+                total_h_r = rows * doc_w + (rows - 1) * min_space_inch
+                if total_w_r <= page_w and total_h_r <= page_h:
+                    valid.append((cols, rows, True))
+    return valid
+
+def grid_positions(page_w, page_h, doc_w, doc_h, columns, rows, rotate=False, dpi=300, spacing=0.25):
+    """Positions (x_inch, y_inch, rotate90) of a centered columns x rows grid, snapped to the dpi pixel grid."""
+    page_px = (int(page_w * dpi), int(page_h * dpi))
+    img_w, img_h = (doc_h, doc_w) if rotate else (doc_w, doc_h)
+    total_width = columns * int(img_w * dpi) + (columns - 1) * int(spacing * dpi)
+    total_height = rows * int(img_h * dpi) + (rows - 1) * int(spacing * dpi)
+    left_margin = (page_px[0] - total_width) // 2
+    top_margin = (page_px[1] - total_height) // 2
+    positions = []
+    for row in range(rows):
+        for col in range(columns):
+            x = left_margin + col * (int(img_w * dpi) + int(spacing * dpi))
+            y = top_margin + row * (int(img_h * dpi) + int(spacing * dpi))
+            positions.append((x / dpi, y / dpi, rotate))
+    return positions
+
+def center_position(page_w, page_h, doc_w, doc_h, rotate=False, dpi=300):
+    """Position (x_inch, y_inch, rotate90) of a single document centered on the page."""
+    return grid_positions(page_w, page_h, doc_w, doc_h, 1, 1, rotate=rotate, dpi=dpi)[0]
+
+def front_back_positions(page_w, page_h, doc_w, doc_h, dpi=300):
+    """Front on the upper half (15% from top), back on the lower half (60% from top), both centered."""
+    page_px = (int(page_w * dpi), int(page_h * dpi))
+    x = (page_px[0] - int(doc_w * dpi)) // 2
+    y_front = int(page_px[1] * 0.15)
+    y_back = int(page_px[1] * 0.6)
+    return [(x / dpi, y_front / dpi, False), (x / dpi, y_back / dpi, False)]
+
+def duplex_positions(page_w, page_h, doc_w, doc_h, columns, rows, rotate=False, flip="long", dpi=300, spacing=0.25):
+    """
+    Slots for double-sided sheets: (front positions, back positions, turn_backs).
+    Back slot i is front slot i mirrored across the axis the sheet is turned over (flip: "long" or "short",
+    the printer's duplex setting), so each back prints behind its front. turn_backs: the backs must also be
+    rotated 180 degrees to read upright when the cut card is turned over side to side.
+    """
+    fronts = grid_positions(page_w, page_h, doc_w, doc_h, columns, rows, rotate=rotate, dpi=dpi, spacing=spacing)
+    box_w, box_h = (doc_h, doc_w) if rotate else (doc_w, doc_h)
+    # Turning a portrait sheet over its long edge (or a landscape one over its short edge) mirrors left-right
+    mirror_x = (flip == "long") == (page_h >= page_w)
+    if mirror_x:
+        backs = [(page_w - x - box_w, y, rot) for x, y, rot in fronts]
+    else:
+        backs = [(x, page_h - y - box_h, rot) for x, y, rot in fronts]
+    # In the card's own frame the sheet turns side to side unless exactly one of mirror_x and rotate holds
+    return fronts, backs, mirror_x == rotate
+
+def stacked_positions(page_w, page_h, doc_w, doc_h, n_images, spacing=0.25, auto_rotate=False, dpi=300):
+    """Documents stacked vertically and centered; rotated when auto_rotate and the rotated stack fits the page width."""
+    use_rotate = auto_rotate and doc_w > doc_h and n_images * doc_h + (n_images - 1) * spacing <= page_w
+    return grid_positions(page_w, page_h, doc_w, doc_h, 1, n_images, rotate=use_rotate, dpi=dpi, spacing=spacing), use_rotate
+
+_EPS = 1e-9
+
+def _contains(a, b):
+    return a[0] <= b[0] + _EPS and a[1] <= b[1] + _EPS and a[0] + a[2] >= b[0] + b[2] - _EPS and a[1] + a[3] >= b[1] + b[3] - _EPS
+
+def _split_free_rects(free, used):
+    """MaxRects split: carve the used rectangle out of every free rectangle it overlaps, then prune contained ones."""
+    ux, uy, uw, uh = used
+    result = []
+    for fx, fy, fw, fh in free:
+        if ux >= fx + fw - _EPS or ux + uw <= fx + _EPS or uy >= fy + fh - _EPS or uy + uh <= fy + _EPS:
+            result.append((fx, fy, fw, fh))
+            continue
+        if ux > fx + _EPS:
+            result.append((fx, fy, ux - fx, fh))
+        if ux + uw < fx + fw - _EPS:
+            result.append((ux + uw, fy, fx + fw - ux - uw, fh))
+        if uy > fy + _EPS:
+            result.append((fx, fy, fw, uy - fy))
+        if uy + uh < fy + fh - _EPS:
+            result.append((fx, uy + uh, fw, fy + fh - uy - uh))
+    return [r for i, r in enumerate(result) if not any(j != i and _contains(o, r) and (o != r or j < i) for j, o in enumerate(result))]
+
+def _best_fit(free, w, h, allow_rotate):
+    """Best-short-side-fit over the free rectangles; returns (score, x, y, rotated) or None."""
+    best = None
+    for fx, fy, fw, fh in free:
+        for rotated, (rw, rh) in ((False, (w, h)), (True, (h, w))):
+            if rotated and (not allow_rotate or w == h):
+                continue
+            if rw <= fw + _EPS and rh <= fh + _EPS:
+                score = (min(fw - rw, fh - rh), max(fw - rw, fh - rh))
+                if best is None or score < best[0]:
+                    best = (score, fx, fy, rotated)
+    return best
+
+def impose(items, page_w, page_h, doc_sizes, spacing=0.25, margin=0.25, allow_rotate=True, center=True):
+    """
+    Pack documents of mixed sizes onto as few pages as possible (MaxRects, best short side fit).
+    items: list of (key, doc_type, copies); key identifies the image and is passed through unchanged
+    doc_sizes: config['document_sizes']
+    Returns a list of pages, each a list of (key, x_inch, y_inch, rotate90, doc_w, doc_h) with doc_w/doc_h before rotation.
+    """
+    pieces = []
+    for key, doc_type, copies in items:
+        size = doc_sizes[doc_type]
+        pieces.extend([(key, size['width_inch'], size['height_inch'])] * int(copies))
+    # Largest first: big documents are hardest to place, small ones fill the gaps
+    pieces.sort(key=lambda p: (max(p[1], p[2]), p[1] * p[2]), reverse=True)
+    # Each document reserves spacing on its right/bottom; the usable area is widened by the same amount
+    usable = (margin, margin, page_w - 2 * margin + spacing, page_h - 2 * margin + spacing)
+    pages, free_rects = [], []
+    for key, w, h in pieces:
+        best = None
+        for index, free in enumerate(free_rects):
+            fit = _best_fit(free, w + spacing, h + spacing, allow_rotate)
+            if fit and (best is None or fit[0] < best[1][0]):
+                best = (index, fit)
+        if best is None:
+            fit = _best_fit([usable], w + spacing, h + spacing, allow_rotate)
+            if fit is None:
+                raise ValueError(f"A {w} x {h} in document does not fit on a {page_w} x {page_h} in page")
+            pages.append([])
+            free_rects.append([usable])
+            best = (len(pages) - 1, fit)
+        index, (_, x, y, rotated) = best
+        box_w, box_h = (h, w) if rotated else (w, h)
+        pages[index].append((key, x, y, rotated, w, h))
+        free_rects[index] = _split_free_rects(free_rects[index], (x, y, box_w + spacing, box_h + spacing))
+    if center:
+        pages = [_center_page(page, page_w, page_h) for page in pages]
+    return pages
+
+def _center_page(page, page_w, page_h):
+    """Shift a packed page so the bounding box of its documents is centered."""
+    right = max(x + (h if rot else w) for _, x, _, rot, w, h in page)
+    bottom = max(y + (w if rot else h) for _, _, y, rot, w, h in page)
+    left = min(x for _, x, _, _, _, _ in page)
+    top = min(y for _, _, y, _, _, _ in page)
+    dx = (page_w - (right - left)) / 2 - left
+    dy = (page_h - (bottom - top)) / 2 - top
+    return [(key, x + dx, y + dy, rot, w, h) for key, x, y, rot, w, h in page]
+
+def unpack_page(page):
+    """Split an imposed page into (keys, positions, sizes) for the PDF/preview writers."""
+    keys = [key for key, *_ in page]
+    positions = [(x, y, rot) for _, x, y, rot, _, _ in page]
+    sizes = [(w, h) for *_, w, h in page]
+    return keys, positions, sizes
@@ -0,0 +1,93 @@
+import os
+import zipfile
+from io import BytesIO
+from PyPDF2 import PdfReader, PdfWriter
+from utils.compact_utils import write_compact
+from utils.trace_utils import traced
+
+def parse_page_ranges(text, n_pages):
+    """
+    Parse "1-3, 5, 8-" (1-based, inclusive, open-ended allowed) into a list of 0-based (start, stop) ranges.
+    An empty string means one range per page.
+    """
+    if not text or not text.strip():
+        return [(i, i + 1) for i in range(n_pages)]
+    ranges = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        bounds = part.split("-", 1) if "-" in part else [part, part]
+        if not all(b.strip().isdigit() for b in bounds if b.strip()):
+            raise ValueError(f"Page range '{part}' is not a page number or range like 1-3, 5 or 8-")
+        first, last = bounds
+        start = int(first) if first.strip() else 1
+        stop = int(last) if last.strip() else n_pages
+        if start > stop:
+            raise ValueError(f"Page range '{part}' is reversed (write {stop}-{start})")
+        if not 1 <= start <= stop <= n_pages:
+            raise ValueError(f"Page range '{part}' is outside 1-{n_pages}")
+        ranges.append((start - 1, stop))
+    return ranges
+
+@traced("pdf.split")
+def split_pdf_to_zip(pdf_stream, page_ranges="", out=None, base_name="page"):
+    """
+    Parse the PDF once and write one PDF per range straight into a ZIP archive.
+    pdf_stream: binary file-like object (e.g. Upload.open(), see upload_utils), read in place without copying
+    out: binary file-like object for the ZIP (default: a new BytesIO)
+    Returns (out, number_of_files).
+    """
+    reader = PdfReader(pdf_stream)
+    ranges = parse_page_ranges(page_ranges, len(reader.pages))
+    out = out if out is not None else BytesIO()
+    # Pages are already compressed inside the PDFs; storing avoids a second deflate pass
+    part = BytesIO()  # one reusable buffer; the PDF writer needs a seekable stream
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf:
+        for start, stop in ranges:
+            writer = PdfWriter()
+            for i in range(start, stop):
+                writer.add_page(reader.pages[i])
+            name = f"{base_name}_{start + 1}.pdf" if stop - start == 1 else f"{base_name}_{start + 1}-{stop}.pdf"
+            part.seek(0)
+            part.truncate()
+            writer.write(part)
+            zf.writestr(name, part.getbuffer())
+    out.seek(0)
+    return out, len(ranges)
+
+def _append_all(pdf_streams):
+    writer = PdfWriter()
+    for stream in pdf_streams:
+        writer.append(stream)
+    return writer
+
+@traced("pdf.merge")
+def merge_pdfs(pdf_streams, out=None):
+    """
+    Append every page of each input, in order, into one PDF.
+    Inputs are parsed in place from their streams, so the upload bytes are never copied.
+    """
+    writer = _append_all(pdf_streams)
+    out = out if out is not None else BytesIO()
+    writer.write(out)
+    writer.close()
+    out.seek(0)
+    return out
+
+@traced("pdf.merge_compact")
+def merge_pdfs_compact(pdf_streams, out=None):
+    """
+    Merge like merge_pdfs, then keep one copy of each identical object across the inputs (fonts, card
+    images, resources), drop unreferenced objects and pack the rest into compressed object streams.
+    Returns (out, CompactStats); merged_bytes - output_bytes is what compaction saved over a plain merge.
+    """
+    writer = _append_all(pdf_streams)
+    out = out if out is not None else BytesIO()
+    stats = write_compact(writer, out)
+    writer.close()
+    out.seek(0)
+    return out, stats
+
+def pdf_basename(filename, default="document"):
+    return os.path.splitext(os.path.basename(filename or ""))[0] or default
@@ -1,15 +1,224 @@
+import threading
+from contextlib import contextmanager
 from io import BytesIO
+from reportlab import rl_config
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
 from PIL import Image
+from utils.cache_utils import hash_bytes
+from utils.image_utils import JpegSource
+from utils.ingest_utils import open_upload
+from utils.encoding_utils import capped_dpi, encode_image, fit_under
+from utils.trace_utils import traced
+from utils.artifact_utils import artifact_cached
 
-def save_image_as_pdf(page_img, page_width_inch, page_height_inch):
-    buffer = BytesIO()
+_a85_lock = threading.Lock()
+_a85_state = {"builds": 0, "saved": None}
+
+@contextmanager
+def _binary_streams():
+    """
+    rl_config.useA85 off while this module builds a PDF: image streams stay binary instead of growing 25% as
+    ASCII85. reportlab reads the flag from drawImage to save(), so it covers the whole build; builds run on
+    several threads, so it is restored to the caller's value only when the last one finishes.
+    """
+    with _a85_lock:
+        if _a85_state["builds"] == 0:
+            _a85_state["saved"] = rl_config.useA85
+            rl_config.useA85 = 0
+        _a85_state["builds"] += 1
+    try:
+        yield
+    finally:
+        with _a85_lock:
+            _a85_state["builds"] -= 1
+            if _a85_state["builds"] == 0:
+                rl_config.useA85 = _a85_state["saved"]
+
+@traced("pdf.bitmap")
+def save_image_as_pdf(page_img, page_width_inch, page_height_inch, dpi=300, profile=None, max_bytes=None):
+    """A composed page bitmap as a one-page PDF; with a profile it is encoded (and capped) as for the layout exporters."""
     page_width = page_width_inch * inch
     page_height = page_height_inch * inch
-    c = canvas.Canvas(buffer, pagesize=(page_width, page_height))
-    c.drawInlineImage(page_img, 0, 0, width=page_width, height=page_height)
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    return buffer 
\ No newline at end of file
+
+    def build(profile):
+        with _binary_streams():
+            buffer = BytesIO()
+            c = canvas.Canvas(buffer, pagesize=(page_width, page_height))
+            if profile is None:
+                # drawInlineImage needs ASCII85 content streams, which are off during builds (see _binary_streams)
+                c.drawImage(ImageReader(page_img), 0, 0, width=page_width, height=page_height)
+            else:
+                cap = capped_dpi(dpi, profile)
+                px = (max(1, int(page_width_inch * cap)), max(1, int(page_height_inch * cap)))
+                _draw_fill(c, page_img, page_width, page_height, px if px[0] < page_img.size[0] else None, profile)
+            c.showPage()
+            c.save()
+            buffer.seek(0)
+            return buffer
+    return fit_under(build, profile, max_bytes, dpi)
+
+class _JpegStream:
+    """JPEG bytes for canvas.drawImage: keyed by str(), read via jpeg_fh(), so reportlab embeds the DCT stream without decoding it."""
+
+    def __init__(self, data):
+        self.data = data
+        self.key = hash_bytes(data)
+
+    def __str__(self):
+        return f"jpeg-{self.key}"
+
+    def jpeg_fh(self):
+        return open_upload(self.data)
+
+def _draw_fill(c, img, width, height, px=None, profile=None):
+    """
+    Draw img over (0, 0, width, height); a JpegSource is embedded as its original DCT stream and clipped to its crop.
+    profile: EncodingProfile choosing JPEG or Flate per image (see encoding_utils); None embeds everything as Flate.
+    """
+    if profile is not None:
+        img = encode_image(img, px, profile)
+    if isinstance(img, JpegSource):
+        left, top, right, bottom = img.box
+        full_w, full_h = img.size
+        crop_w, crop_h = img.crop_size
+        sx, sy = width / crop_w, height / crop_h
+        c.saveState()
+        clip = c.beginPath()
+        clip.rect(0, 0, width, height)
+        c.clipPath(clip, stroke=0, fill=0)
+        c.drawImage(_JpegStream(img.data), -left * sx, -(full_h - bottom) * sy, width=full_w * sx, height=full_h * sy)
+        c.restoreState()
+        return
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    if px is not None and img.size != px:
+        img = img.resize(px)
+    c.drawImage(ImageReader(img), 0, 0, width=width, height=height)
+
+def draw_placements(c, images, positions, page_height_inch, img_width_inch, img_height_inch, dpi=300, forms=None, sizes=None, profile=None):
+    """
+    Draw each placement on the current page of canvas c.
+    Every distinct image (by identity and size) is embedded once as a form XObject and
+    reused for all of its placements; rotation is done with the PDF transform.
+    forms: dict shared across pages so a card is embedded once per document.
+    sizes: optional per-placement (width_inch, height_inch) before rotation, overriding img_width_inch/img_height_inch.
+    profile: optional EncodingProfile; images are embedded at no more than its max_dpi.
+    """
+    dpi = capped_dpi(dpi, profile)
+    if forms is None:
+        forms = {}
+    if sizes is None:
+        sizes = [(img_width_inch, img_height_inch)] * len(positions)
+    for img, (x_inch, y_inch, rotate90), (w_inch, h_inch) in zip(images, positions, sizes):
+        w_pt, h_pt = w_inch * inch, h_inch * inch
+        name = forms.get((id(img), w_inch, h_inch))
+        if name is None:
+            name = f"card{len(forms)}"
+            forms[(id(img), w_inch, h_inch)] = name
+            px = (max(1, int(w_inch * dpi)), max(1, int(h_inch * dpi)))
+            c.beginForm(name, 0, 0, w_pt, h_pt)
+            _draw_fill(c, img, w_pt, h_pt, px, profile)
+            c.endForm()
+        box_w, box_h = (h_pt, w_pt) if rotate90 else (w_pt, h_pt)
+        x = x_inch * inch
+        y = page_height_inch * inch - y_inch * inch - box_h
+        c.saveState()
+        if rotate90:
+            # Same orientation as PIL's rotate(90, expand=True): counter-clockwise
+            c.translate(x + box_w, y)
+            c.rotate(90)
+        else:
+            c.translate(x, y)
+        c.doForm(name)
+        c.restoreState()
+    return forms
+
+@traced("pdf.layout")
+@artifact_cached("pdf.layout")
+def save_layout_as_pdf(images, positions, page_width_inch, page_height_inch, img_width_inch, img_height_inch, dpi=300, profile=None, max_bytes=None):
+    """
+    images: list of PIL Images (already cropped/enhanced) or JpegSource passthroughs, the same object may repeat
+    positions: list of (x_inch, y_inch, rotate90) for each image (top-left corner, in inches, and rotation flag)
+    img_width_inch, img_height_inch: image size (before rotation)
+    dpi: resolution each distinct image is embedded at (capped by the profile's max_dpi)
+    profile: optional EncodingProfile; max_bytes: optional size budget, met by lowering quality (see fit_under)
+    """
+    def build(profile):
+        with _binary_streams():
+            buffer = BytesIO()
+            c = canvas.Canvas(buffer, pagesize=(page_width_inch * inch, page_height_inch * inch))
+            draw_placements(c, images, positions, page_height_inch, img_width_inch, img_height_inch, dpi=dpi, profile=profile)
+            c.showPage()
+            c.save()
+            buffer.seek(0)
+            return buffer
+    return fit_under(build, profile, max_bytes, dpi)
+
+@traced("pdf.pages")
+@artifact_cached("pdf.pages")
+def save_pages_as_pdf(pages, page_width_inch, page_height_inch, dpi=300, profile=None, max_bytes=None):
+    """
+    Write a multi-page PDF from imposed pages.
+    pages: list of (images, positions, sizes) per page, as for draw_placements; images shared across pages are embedded once.
+    Or a zero-argument callable returning a fresh iterable of them, consumed lazily so only one page's images are alive
+    at a time; each page then embeds its own images (an earlier page's may be freed and their ids reused)
+    profile, max_bytes: as for save_layout_as_pdf
+    """
+    def build(profile):
+        with _binary_streams():
+            buffer = BytesIO()
+            c = canvas.Canvas(buffer, pagesize=(page_width_inch * inch, page_height_inch * inch))
+            forms = {}
+            for images, positions, sizes in (pages() if callable(pages) else pages):
+                draw_placements(c, images, positions, page_height_inch, None, None, dpi=dpi, forms=forms, sizes=sizes, profile=profile)
+                c.showPage()
+                del images
+                if callable(pages):
+                    # Keep the form names taken (they must stay unique) but forget the freed images' ids
+                    forms = dict(enumerate(forms.values()))
+            c.save()
+            buffer.seek(0)
+            return buffer
+    return fit_under(build, profile, max_bytes, dpi)
+
+@traced("pdf.images")
+def save_images_as_pdf(pages, page_width_inch, page_height_inch, dpi=300, progress=None, profile=None, max_bytes=None):
+    """
+    Write images as a multi-page PDF, one page at a time.
+    pages: iterable of (img or JpegSource, fit_to_page), consumed lazily so only one decoded page is alive at a time;
+    with max_bytes, a zero-argument callable returning a fresh iterable (TypeError otherwise), since the search makes several passes
+    fit_to_page: stretch over the page (embedded at no more than dpi); otherwise the page takes the image's
+    own size at 72 DPI, as PIL's PDF writer did
+    progress: optional callback(pages_done)
+    profile, max_bytes: as for save_layout_as_pdf
+    """
+    if max_bytes and not callable(pages):
+        # A one-shot iterable would be spent by the first pass, and every later pass would "fit" with no pages
+        raise TypeError("save_images_as_pdf: with max_bytes, pages must be a zero-argument callable returning a fresh iterable")
+    def build(profile):
+        with _binary_streams():
+            buffer = BytesIO()
+            c = canvas.Canvas(buffer, pagesize=(page_width_inch * inch, page_height_inch * inch))
+            cap = capped_dpi(dpi, profile)
+            for done, (img, fit_to_page) in enumerate(pages() if callable(pages) else pages, start=1):
+                size = img.crop_size if isinstance(img, JpegSource) else img.size
+                px = None
+                if fit_to_page:
+                    page_size = (page_width_inch * inch, page_height_inch * inch)
+                    max_px = (int(page_width_inch * cap), int(page_height_inch * cap))
+                    if size[0] > max_px[0] or size[1] > max_px[1]:
+                        px = (min(size[0], max_px[0]), min(size[1], max_px[1]))
+                else:
+                    page_size = size
+                c.setPageSize(page_size)
+                _draw_fill(c, img, page_size[0], page_size[1], px, profile)
+                c.showPage()
+                del img
+                if progress:
+                    progress(done)
+            c.save()
+            buffer.seek(0)
+            return buffer
+    return fit_under(build, profile, max_bytes, dpi)
@@ -0,0 +1,162 @@
+import struct
+import zlib
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from utils.image_utils import as_image
+from utils.trace_utils import traced
+from utils.artifact_utils import artifact_cached
+
+RASTER_FORMATS = ("png", "tiff")
+STRIP_HEIGHT = 256
+
+def _placements(images, positions, page_width_inch, page_height_inch, img_width_inch, img_height_inch, dpi, sizes):
+    """Pixel boxes (left, top, width, height, card_key) in paste order, and the card each key is resized from."""
+    if sizes is None:
+        sizes = [(img_width_inch, img_height_inch)] * len(positions)
+    placements, cards = [], {}
+    for img, (x_inch, y_inch, rotate90), (w, h) in zip(images, positions, sizes):
+        box_w, box_h = (h, w) if rotate90 else (w, h)
+        box_px = (max(1, int(box_w * dpi)), max(1, int(box_h * dpi)))
+        key = (id(img), rotate90, box_px)
+        cards.setdefault(key, (img, rotate90, box_px))
+        # Truncated like the ID tools' canvases (make_canvas_with_image, render_layout_preview)
+        placements.append((int(x_inch * dpi), int(y_inch * dpi), box_px[0], box_px[1], key))
+    return placements, cards
+
+def _render_card(img, rotate90, box_px):
+    img = as_image(img).convert("RGB")
+    if rotate90:
+        # Same orientation as the PDF/Word exports: counter-clockwise
+        img = img.rotate(90, expand=True)
+    return np.asarray(img.resize(box_px))
+
+def compose_page(images, positions, page_width_inch, page_height_inch, img_width_inch, img_height_inch, dpi=300, sizes=None):
+    """Whole-page composition on a white RGB canvas (the reference the strips reproduce; needs page-sized memory)."""
+    page = Image.new("RGB", (int(page_width_inch * dpi), int(page_height_inch * dpi)), "white")
+    placements, cards = _placements(images, positions, page_width_inch, page_height_inch, img_width_inch, img_height_inch, dpi, sizes)
+    rendered = {key: Image.fromarray(_render_card(*card)) for key, card in cards.items()}
+    for left, top, _, _, key in placements:
+        page.paste(rendered[key], (left, top))
+    return page
+
+def iter_page_strips(images, positions, page_width_inch, page_height_inch, img_width_inch, img_height_inch, dpi=300, sizes=None, strip_height=STRIP_HEIGHT):
+    """
+    Yield the composed page as (top_row, uint8 array of shape (rows, width, 3)) strips, top to bottom.
+    Pixels match compose_page. Each card is resized once when the first strip reaches it and dropped after
+    the last strip it touches, so memory is a strip plus the cards crossing it, never the whole page.
+    """
+    page_w, page_h = int(page_width_inch * dpi), int(page_height_inch * dpi)
+    placements, cards = _placements(images, positions, page_width_inch, page_height_inch, img_width_inch, img_height_inch, dpi, sizes)
+    last_row = {}
+    for _, top, _, height, key in placements:
+        last_row[key] = max(last_row.get(key, 0), top + height)
+    rendered = {}
+    for y0 in range(0, page_h, strip_height):
+        y1 = min(page_h, y0 + strip_height)
+        strip = np.full((y1 - y0, page_w, 3), 255, dtype=np.uint8)
+        for left, top, width, height, key in placements:
+            r0, r1 = max(y0, top), min(y1, top + height)
+            c0, c1 = max(0, left), min(page_w, left + width)
+            if r0 >= r1 or c0 >= c1:
+                continue
+            if key not in rendered:
+                rendered[key] = _render_card(*cards[key])
+            strip[r0 - y0:r1 - y0, c0:c1] = rendered[key][r0 - top:r1 - top, c0 - left:c1 - left]
+        for key in [k for k in rendered if last_row[k] <= y1]:
+            del rendered[key]
+        yield y0, strip
+
+def _png_chunk(out, tag, data):
+    out.write(struct.pack(">I", len(data)))
+    out.write(tag + data)
+    out.write(struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF))
+
+def write_png(strips, width, height, dpi, out):
+    """Stream RGB strips into a PNG: one deflate stream, written out as an IDAT chunk whenever zlib emits output."""
+    out.write(b"\x89PNG\r\n\x1a\n")
+    _png_chunk(out, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+    ppm = int(round(dpi / 0.0254))
+    _png_chunk(out, b"pHYs", struct.pack(">IIB", ppm, ppm, 1))
+    compressor = zlib.compressobj(6)
+    for _, strip in strips:
+        # Filter type 0 (None) before every row
+        rows = np.empty((strip.shape[0], width * 3 + 1), dtype=np.uint8)
+        rows[:, 0] = 0
+        rows[:, 1:] = strip.reshape(strip.shape[0], -1)
+        data = compressor.compress(rows.tobytes())
+        if data:
+            _png_chunk(out, b"IDAT", data)
+    _png_chunk(out, b"IDAT", compressor.flush())
+    _png_chunk(out, b"IEND", b"")
+
+def write_tiff(strips, width, height, dpi, out, rows_per_strip=STRIP_HEIGHT):
+    """Stream RGB strips into a striped, Deflate-compressed little-endian TIFF (horizontal predictor)."""
+    start = out.tell()
+    out.write(b"II*\x00" + struct.pack("<I", 0))  # IFD offset patched at the end
+    offsets, counts = [], []
+    for _, strip in strips:
+        # Horizontal differencing (TIFF predictor 2) per sample, wrapping mod 256
+        diff = strip.astype(np.int16)
+        diff[:, 1:] -= strip[:, :-1]
+        data = zlib.compress(diff.astype(np.uint8).tobytes(), 6)
+        offsets.append(out.tell() - start)
+        counts.append(len(data))
+        out.write(data)
+    # Out-of-line values (BitsPerSample, resolution, strip tables), word aligned as TIFF requires
+    if (out.tell() - start) % 2:
+        out.write(b"\x00")
+    bits_at = out.tell() - start
+    res_at = bits_at + 6
+    offsets_at = res_at + 8
+    counts_at = offsets_at + 4 * len(offsets)
+    ifd_at = counts_at + 4 * len(counts)
+    out.write(struct.pack("<3H", 8, 8, 8))
+    out.write(struct.pack("<II", int(round(dpi)), 1))
+    out.write(struct.pack(f"<{len(offsets)}I", *offsets))
+    out.write(struct.pack(f"<{len(counts)}I", *counts))
+    single = len(offsets) == 1
+    tags = [
+        (256, 4, 1, width),
+        (257, 4, 1, height),
+        (258, 3, 3, bits_at),
+        (259, 3, 1, 8),  # Adobe Deflate
+        (262, 3, 1, 2),  # RGB
+        (273, 4, len(offsets), offsets[0] if single else offsets_at),
+        (277, 3, 1, 3),
+        (278, 4, 1, rows_per_strip),
+        (279, 4, len(counts), counts[0] if single else counts_at),
+        (282, 5, 1, res_at),
+        (283, 5, 1, res_at),
+        (284, 3, 1, 1),
+        (296, 3, 1, 2),  # inches
+        (317, 3, 1, 2),  # horizontal predictor
+    ]
+    ifd = struct.pack("<H", len(tags))
+    for tag, typ, count, value in tags:
+        packed = struct.pack("<H", value) + b"\x00\x00" if typ == 3 and count == 1 else struct.pack("<I", value)
+        ifd += struct.pack("<HHI", tag, typ, count) + packed
+    out.write(ifd + struct.pack("<I", 0))
+    end = out.tell()
+    out.seek(start + 4)
+    out.write(struct.pack("<I", ifd_at))
+    out.seek(end)
+
+@traced("raster.layout")
+@artifact_cached("raster.layout")
+def save_layout_as_raster(images, positions, page_width_inch, page_height_inch, img_width_inch, img_height_inch, dpi=300, fmt="png", sizes=None, out=None):
+    """
+    Write the composed page as a PNG or TIFF, generated and encoded strip by strip.
+    Same arguments as save_layout_as_pdf; out: optional seekable binary file (default: a new BytesIO).
+    """
+    if fmt not in RASTER_FORMATS:
+        raise ValueError(f"Unknown raster format '{fmt}' (expected one of {', '.join(RASTER_FORMATS)})")
+    out = out if out is not None else BytesIO()
+    width, height = int(page_width_inch * dpi), int(page_height_inch * dpi)
+    strips = iter_page_strips(images, positions, page_width_inch, page_height_inch, img_width_inch, img_height_inch, dpi=dpi, sizes=sizes)
+    if fmt == "png":
+        write_png(strips, width, height, dpi, out)
+    else:
+        write_tiff(strips, width, height, dpi, out)
+    out.seek(0)
+    return out
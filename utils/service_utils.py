@@ -0,0 +1,305 @@
+import math
+import multiprocessing
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from utils.job_utils import normalize_job
+
+SERVICE_DEFAULTS = {
+    "host": "127.0.0.1",
+    "port": 8600,
+    "workers": 2,
+    "max_queue": 32,
+    "job_timeout_s": 120,
+    "max_request_mb": 64,
+    "max_uploads": 8,
+    "keep_results": 200,
+    "result_ttl_s": 3600,
+    "spool_dir": None,
+}
+
+FINISHED_STATES = ("done", "failed", "timed_out", "cancelled")
+_POLL_S = 0.2
+
+class QueueFull(Exception):
+    """The job queue is at capacity; retry_after is a rough wait in seconds."""
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+def service_settings(config, **overrides):
+    """The service block of config.yaml over SERVICE_DEFAULTS, then any non-None overrides (e.g. CLI flags)."""
+    settings = dict(SERVICE_DEFAULTS)
+    settings.update(config.get("service", {}) or {})
+    settings.update({k: v for k, v in overrides.items() if v is not None})
+    return settings
+
+def _worker_main(conn, config):
+    """Worker process: render the jobs sent over conn, one at a time, until it is closed."""
+    # Rendering libraries are imported once per worker, not per job
+    from utils.artifact_utils import configure_artifacts
+    from utils.job_utils import render_job
+    from utils.trace_utils import configure_tracing, trace_run
+    configure_artifacts(config)
+    configure_tracing(config)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        job_id, job, output_dir = task
+        try:
+            with trace_run(f"service.{job['mode']}", job_id):
+                written = render_job(job, config, output_dir)
+            conn.send(("done", [os.path.basename(p) for p in written], None))
+        except Exception as e:
+            conn.send(("failed", [], f"{type(e).__name__}: {e}"))
+
+def _safe_name(name, index):
+    base = re.sub(r"[^A-Za-z0-9._-]", "_", os.path.basename(name or "")) or "file"
+    return f"{index:03d}_{base}"
+
+def _stats_ms(values):
+    if not values:
+        return {"avg": 0.0, "max": 0.0}
+    return {"avg": round(sum(values) / len(values), 1), "max": round(max(values), 1)}
+
+class RenderService:
+    """
+    Job queue in front of a fixed set of worker processes.
+    Submitting only writes the inputs to the spool directory and enqueues, so request threads never render.
+    Each worker slot is a thread that owns one process; a job past its timeout (or cancelled while running)
+    has its process killed and replaced, so a stuck render cannot hold a slot.
+    """
+    def __init__(self, config, settings):
+        self.config = config
+        self.settings = settings
+        self._own_spool = not settings["spool_dir"]
+        self.spool_dir = tempfile.mkdtemp(prefix="card-print-jobs-") if self._own_spool else settings["spool_dir"]
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._queue = queue.Queue(maxsize=max(1, int(settings["max_queue"])))
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._context = multiprocessing.get_context("spawn")
+        self._threads = []
+        self._running = 0
+        self._totals = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "timed_out": 0, "cancelled": 0, "worker_restarts": 0}
+        self._wait_ms = deque(maxlen=200)
+        self._run_ms = deque(maxlen=200)
+        self._started = time.time()
+
+    def start(self):
+        for slot in range(max(1, int(self.settings["workers"]))):
+            thread = threading.Thread(target=self._slot, name=f"render-slot-{slot}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout=self.settings["job_timeout_s"] + 5)
+        if self._own_spool:
+            shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    # Workers
+
+    def _spawn(self):
+        parent, child = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child, self.config), daemon=True)
+        process.start()
+        child.close()
+        return process, parent
+
+    def _stop_worker(self, process, conn, kill=False):
+        if not kill:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(timeout=2)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        conn.close()
+
+    def _slot(self):
+        process, conn = self._spawn()
+        while not self._stopping.is_set():
+            try:
+                job_id = self._queue.get(timeout=_POLL_S)
+            except queue.Empty:
+                continue
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job["state"] != "queued":
+                    continue
+                job["state"] = "running"
+                job["started"] = time.time()
+                self._running += 1
+                self._wait_ms.append((job["started"] - job["submitted"]) * 1000)
+            state, artifacts, error = self._run(job, process, conn)
+            if state in ("timed_out", "cancelled") or not process.is_alive():
+                # The process may be mid-render (or dead); replace it rather than wait
+                self._stop_worker(process, conn, kill=True)
+                process, conn = self._spawn()
+                with self._lock:
+                    self._totals["worker_restarts"] += 1
+            self._finish(job, state, artifacts, error)
+        self._stop_worker(process, conn)
+
+    def _run(self, job, process, conn):
+        deadline = job["started"] + self.settings["job_timeout_s"]
+        try:
+            conn.send((job["id"], job["spec"], job["dir"]))
+            while True:
+                if conn.poll(_POLL_S):
+                    return conn.recv()
+                if job["cancel"]:
+                    return "cancelled", [], "Cancelled while running"
+                if time.time() > deadline:
+                    return "timed_out", [], f"Exceeded {self.settings['job_timeout_s']}s"
+                if not process.is_alive():
+                    return "failed", [], f"Worker exited with code {process.exitcode}"
+        except (EOFError, OSError) as e:
+            return "failed", [], f"Worker connection lost: {e}"
+
+    def _finish(self, job, state, artifacts, error):
+        with self._lock:
+            if job["state"] == "running":
+                self._running -= 1
+                self._run_ms.append((time.time() - job["started"]) * 1000)
+            job.update(state=state, artifacts=artifacts, error=error, finished=time.time())
+            self._totals[state] += 1
+        shutil.rmtree(os.path.join(job["dir"], "inputs"), ignore_errors=True)
+        job["event"].set()
+        self._prune()
+
+    def _prune(self):
+        """Drop finished jobs past result_ttl_s, and the oldest beyond keep_results, with their files."""
+        now = time.time()
+        with self._lock:
+            finished = sorted((j for j in self._jobs.values() if j["state"] in FINISHED_STATES), key=lambda j: j["finished"])
+            excess = len(finished) - int(self.settings["keep_results"])
+            expired = [j for i, j in enumerate(finished) if i < excess or now - j["finished"] > self.settings["result_ttl_s"]]
+            for job in expired:
+                del self._jobs[job["id"]]
+        for job in expired:
+            shutil.rmtree(job["dir"], ignore_errors=True)
+
+    # Public API (called from request threads)
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up, from recent run times."""
+        avg_s = (sum(self._run_ms) / len(self._run_ms) / 1000) if self._run_ms else 1.0
+        return max(1, math.ceil(avg_s * self._queue.qsize() / max(1, len(self._threads))))
+
+    def submit(self, raw, files):
+        """
+        Validate and enqueue a job. raw: job fields as for a manifest row (without images);
+        files: list of (filename, bytes) inputs, in order. Raises ValueError or QueueFull.
+        """
+        if self._queue.full():
+            with self._lock:
+                self._totals["rejected"] += 1
+            raise QueueFull(self.retry_after())
+        job_id = uuid.uuid4().hex[:16]
+        job_dir = os.path.join(self.spool_dir, job_id)
+        inputs = os.path.join(job_dir, "inputs")
+        os.makedirs(inputs)
+        try:
+            names = []
+            for index, (name, data) in enumerate(files):
+                names.append(_safe_name(name, index))
+                with open(os.path.join(inputs, names[-1]), "wb") as f:
+                    f.write(data)
+            spec = normalize_job(dict(raw, images=names), base_dir=inputs, config=self.config)
+        except Exception:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+        job = {
+            "id": job_id, "name": spec["name"], "mode": spec["mode"], "spec": spec, "dir": job_dir,
+            "state": "queued", "submitted": time.time(), "started": None, "finished": None,
+            "artifacts": [], "error": None, "cancel": False, "event": threading.Event(),
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait(job_id)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+                self._totals["rejected"] += 1
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise QueueFull(self.retry_after())
+        with self._lock:
+            self._totals["submitted"] += 1
+        self._prune()
+        return self.status(job_id)
+
+    def status(self, job_id, wait=0):
+        """Public view of a job (None if unknown); wait: seconds to block for it to finish."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if wait > 0:
+            job["event"].wait(wait)
+        with self._lock:
+            return {
+                "id": job["id"], "name": job["name"], "mode": job["mode"], "state": job["state"],
+                "submitted": job["submitted"], "started": job["started"], "finished": job["finished"],
+                "artifacts": list(job["artifacts"]), "error": job["error"],
+            }
+
+    def artifact_path(self, job_id, name):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["state"] != "done" or name not in job["artifacts"]:
+                return None
+            return os.path.join(job["dir"], name)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job, or delete a finished one and its files. False if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            if job["state"] in FINISHED_STATES:
+                del self._jobs[job_id]
+            elif job["state"] == "running":
+                job["cancel"] = True  # the slot kills its worker on the next poll
+                return True
+            else:
+                job["state"] = "cancelled"
+                job["finished"] = time.time()
+                self._totals["cancelled"] += 1
+                job["event"].set()
+                return True
+        shutil.rmtree(job["dir"], ignore_errors=True)
+        return True
+
+    def metrics(self):
+        with self._lock:
+            states = {}
+            for job in self._jobs.values():
+                states[job["state"]] = states.get(job["state"], 0) + 1
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "running": self._running,
+                "workers": len(self._threads),
+                "jobs": states,
+                "totals": dict(self._totals),
+                "wait_ms": _stats_ms(list(self._wait_ms)),
+                "run_ms": _stats_ms(list(self._run_ms)),
+                "uptime_s": round(time.time() - self._started, 1),
+            }
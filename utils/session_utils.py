@@ -0,0 +1,272 @@
+import atexit
+import contextlib
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image
+from utils.cache_utils import size_of
+
+STORE_KEY = "_session_store"
+SPILL_MIN_BYTES = 256 * 1024  # smaller values (proxies, settings) always stay in memory
+
+_settings = {"session_mb": 256, "global_mb": 2048, "spill_dir": None, "idle_spill_s": 600}
+_lock = threading.RLock()  # one lock for every store, so global enforcement sees consistent totals
+_stores = weakref.WeakSet()
+_totals = {"spills": 0, "rehydrations": 0}
+_file_ids = itertools.count()
+_root = None
+
+def configure_session_store(config):
+    """Apply the session_store settings from config.yaml (session_mb, global_mb, spill_dir, idle_spill_s)."""
+    _settings.update({k: v for k, v in (config.get('session_store', {}) or {}).items() if v is not None})
+
+def _spill_root():
+    global _root
+    with _lock:
+        if _root is None:
+            parent = _settings["spill_dir"] or None
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            _root = tempfile.mkdtemp(prefix="card-print-sessions-", dir=parent)
+            atexit.register(shutil.rmtree, _root, True)
+        return _root
+
+def _remove_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+def _discard(path):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+def _write(path, value):
+    if isinstance(value, Image.Image):
+        # Lossless and quick to write; compression matters less than getting the pixels out of RAM
+        value.save(path, format="PNG", compress_level=1)
+    else:
+        with open(path, "wb") as f:
+            f.write(value.getbuffer() if isinstance(value, BytesIO) else value)
+
+def _read(path, kind):
+    if kind == "image":
+        img = Image.open(path)
+        img.load()
+        return img
+    with open(path, "rb") as f:
+        data = f.read()
+    return BytesIO(data) if kind == "buffer" else data
+
+def _kind(value):
+    if isinstance(value, Image.Image):
+        return "image"
+    if isinstance(value, BytesIO):
+        return "buffer"
+    if isinstance(value, (bytes, bytearray)):
+        return "bytes"
+    return None
+
+class _Entry:
+    # spilling: being written out; the value stays readable until the file is complete
+    __slots__ = ("value", "size", "kind", "path", "spilling")
+
+    def __init__(self, value, size, kind):
+        self.value, self.size, self.kind, self.path, self.spilling = value, size, kind, None, False
+
+class SessionStore:
+    """
+    Large per-session values (upload bytes, bitmaps, export buffers) under a byte budget.
+    Values over SPILL_MIN_BYTES count against the session budget (session_mb) and the budget shared by all
+    sessions (global_mb); past either, the least recently used ones are written to a private temp directory
+    and read back on the next get(). The directory is removed when the session's state is dropped.
+    _lock only guards the bookkeeping: files are written and read with it released.
+    """
+    def __init__(self, session_id=None):
+        self.session_id = session_id
+        self._items = OrderedDict()
+        self._dir = None
+        self.last_used = time.time()
+        with _lock:
+            _stores.add(self)
+
+    def _spill_dir(self):
+        if self._dir is None:
+            self._dir = tempfile.mkdtemp(prefix=f"{self.session_id or 'session'}-", dir=_spill_root())
+            weakref.finalize(self, _remove_dir, self._dir)
+        return self._dir
+
+    @property
+    def memory_bytes(self):
+        return sum(e.size for e in self._items.values() if e.value is not None)
+
+    @property
+    def spilled_bytes(self):
+        return sum(e.size for e in self._items.values() if e.value is None)
+
+    @property
+    def _resident_bytes(self):
+        """memory_bytes less the values already being written out (what the budgets are enforced on)."""
+        return sum(e.size for e in self._items.values() if e.value is not None and not e.spilling)
+
+    def put(self, name, value):
+        """Store value under name (replacing any earlier one); None just removes it."""
+        if value is None:
+            return self.pop(name)
+        kind = _kind(value)
+        size = size_of(value) if kind else 0
+        with _lock:
+            old = self._items.pop(name, None)
+            self._items[name] = _Entry(value, size, kind)
+            self.last_used = time.time()
+            spills = _enforce(self)
+        if old is not None and old.path:
+            _discard(old.path)
+        _write_spills(spills)
+
+    def get(self, name, default=None):
+        """The value stored under name, read back from disk if it was spilled."""
+        while True:
+            with _lock:
+                entry = self._items.get(name)
+                if entry is None:
+                    return default
+                self._items.move_to_end(name)
+                self.last_used = time.time()
+                if entry.value is not None:
+                    return entry.value
+                path = entry.path
+            try:
+                value = _read(path, entry.kind)
+                break
+            except FileNotFoundError:
+                # Read back or removed by another thread meanwhile: look again, unless the file is simply gone
+                with _lock:
+                    if self._items.get(name) is entry and entry.path == path:
+                        raise
+        spills = []
+        with _lock:
+            _totals["rehydrations"] += 1
+            # Keep it in memory again if it fits (and no other reader already did); otherwise the caller's
+            # reference is the only copy
+            swap_in = entry.size <= _settings["session_mb"] * 1024 * 1024 and self._items.get(name) is entry and entry.path == path
+            if swap_in:
+                entry.value, entry.path = value, None
+                spills = _enforce(self, keep=name)
+        if swap_in:
+            _discard(path)
+        _write_spills(spills)
+        return value
+
+    def pop(self, name):
+        with _lock:
+            entry = self._items.pop(name, None)
+        if entry is not None and entry.path:
+            _discard(entry.path)
+
+    def reader(self, name):
+        """Zero-argument callable for st.download_button(data=...), so a spilled buffer is read back only on click."""
+        def read():
+            value = self.get(name)
+            return value.getvalue() if isinstance(value, BytesIO) else value
+        return read
+
+    def __contains__(self, name):
+        return name in self._items
+
+    def new_file(self, suffix=""):
+        """A fresh path in this session's temp directory, removed with it (the caller creates the file)."""
+        return os.path.join(self._spill_dir(), f"{next(_file_ids)}{suffix}")
+
+    def _spill_lru(self, keep=None):
+        """
+        Mark the least recently used large value in memory for spilling (caller holds _lock) and return
+        the (store, name, entry, path) to write for _write_spills; None if there is none.
+        """
+        for name, entry in self._items.items():
+            if name != keep and entry.value is not None and not entry.spilling and entry.size >= SPILL_MIN_BYTES:
+                entry.spilling = True
+                return self, name, entry, self.new_file()
+        return None
+
+    def spill_all(self):
+        with _lock:
+            spills = _spill_store(self)
+        _write_spills(spills)
+
+def _spill_store(store):
+    spills = []
+    spill = store._spill_lru()
+    while spill is not None:
+        spills.append(spill)
+        spill = store._spill_lru()
+    return spills
+
+def _enforce(store, keep=None):
+    """
+    Pick values to spill until store is within the session budget and all stores within the global one.
+    The caller holds _lock, and passes the returned list to _write_spills once it has released it.
+    """
+    spills = []
+    session_budget = _settings["session_mb"] * 1024 * 1024
+    while store._resident_bytes > session_budget:
+        spill = store._spill_lru(keep)
+        if spill is None:
+            break
+        spills.append(spill)
+    # Idle sessions give up their memory first, then whoever holds the most
+    now = time.time()
+    for other in list(_stores):
+        if other is not store and now - other.last_used > _settings["idle_spill_s"]:
+            spills += _spill_store(other)
+    global_budget = _settings["global_mb"] * 1024 * 1024
+    while sum(s._resident_bytes for s in _stores) > global_budget:
+        for candidate in sorted(_stores, key=lambda s: s._resident_bytes, reverse=True):
+            spill = candidate._spill_lru(keep if candidate is store else None)
+            if spill is not None:
+                spills.append(spill)
+                break
+        else:
+            break
+    return spills
+
+def _write_spills(spills):
+    """Write out the values _enforce picked, without holding _lock, then point each entry at its file."""
+    for store, name, entry, path in spills:
+        try:
+            _write(path, entry.value)
+            written = True
+        except OSError:
+            written = False
+        with _lock:
+            entry.spilling = False
+            # Dropped or replaced while it was being written: the file is not needed
+            written = written and store._items.get(name) is entry
+            if written:
+                entry.value, entry.path = None, path
+                _totals["spills"] += 1
+        if not written:
+            _discard(path)
+
+def session_store(state):
+    """The SessionStore kept in this session's state, created on first use (and cleaned up with the state)."""
+    if state.get(STORE_KEY) is None:
+        state[STORE_KEY] = SessionStore(state.get("session_id"))
+    return state[STORE_KEY]
+
+def session_store_stats():
+    """Bytes held in memory and on disk by every live session's store, with budgets and spill counts."""
+    with _lock:
+        stores = list(_stores)
+        return {
+            "sessions": len(stores),
+            "memory_bytes": sum(s.memory_bytes for s in stores),
+            "spilled_bytes": sum(s.spilled_bytes for s in stores),
+            "session_budget_bytes": _settings["session_mb"] * 1024 * 1024,
+            "global_budget_bytes": _settings["global_mb"] * 1024 * 1024,
+            "spills": _totals["spills"],
+            "rehydrations": _totals["rehydrations"],
+        }
@@ -0,0 +1,122 @@
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from io import BytesIO
+
+_state = threading.local()
+_log_lock = threading.Lock()
+_settings = {"enabled": True, "log_file": None}
+
+def configure_tracing(config):
+    """Apply the trace settings from config.yaml (trace.enabled, trace.log_file)."""
+    trace = config.get('trace', {}) or {}
+    _settings["enabled"] = bool(trace.get("enabled", True))
+    _settings["log_file"] = trace.get("log_file") or None
+
+def _rss_bytes():
+    # Current (not peak) resident set size; /proc is cheap to read, other platforms report 0
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def _pixels(value):
+    """Pixels in an image, a JpegSource, or a list/tuple of them (each distinct object counted once)."""
+    size = getattr(value, "size", None)
+    if isinstance(size, tuple) and len(size) == 2:
+        return size[0] * size[1]
+    if isinstance(value, (list, tuple)):
+        distinct = {id(v): v for v in value}
+        return sum(_pixels(v) for v in distinct.values())
+    return 0
+
+def _bytes(value):
+    if isinstance(value, BytesIO):
+        return value.getbuffer().nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, tuple) and value and isinstance(value[0], BytesIO):
+        return value[0].getbuffer().nbytes
+    return 0
+
+@contextmanager
+def span(name, **info):
+    """
+    Time a stage of the current run. Yields the record so the caller can add pixels/bytes.
+    Stages nest; outside a run (e.g. batch.py) or when disabled, nothing is recorded.
+    """
+    stages = getattr(_state, "stages", None)
+    if stages is None or not _settings["enabled"]:
+        yield {}
+        return
+    record = {"stage": name, "depth": _state.depth, "pixels": 0, "bytes": 0}
+    record.update(info)
+    stages.append(record)
+    _state.depth += 1
+    rss = _rss_bytes()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["ms"] = round((time.perf_counter() - start) * 1000, 2)
+        record["mem_delta_mb"] = round((_rss_bytes() - rss) / 1e6, 2)
+        _state.depth -= 1
+
+def traced(name):
+    """Decorator: record a call as a stage, with pixels from its first argument (or result) and bytes from its result."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_state, "stages", None) is None:
+                return func(*args, **kwargs)
+            with span(name) as record:
+                result = func(*args, **kwargs)
+                record["pixels"] = _pixels(args[0]) if args else 0
+                record["pixels"] = record["pixels"] or _pixels(result)
+                record["bytes"] = _bytes(result)
+            return result
+        return wrapper
+    return decorator
+
+@contextmanager
+def trace_run(tab, session_id=None):
+    """
+    Collect every stage run inside the block (one tab's render) and log it as one JSON line.
+    Yields a dict that holds the run record (tab, ms, mem_delta_mb, stages...) once the block exits.
+    """
+    _state.stages = []
+    _state.depth = 0
+    rss = _rss_bytes()
+    start = time.perf_counter()
+    run = {}
+    try:
+        yield run
+    finally:
+        run.update({
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "session": session_id,
+            "tab": tab,
+            "ms": round((time.perf_counter() - start) * 1000, 2),
+            "mem_delta_mb": round((_rss_bytes() - rss) / 1e6, 2),
+            "rss_mb": round(_rss_bytes() / 1e6, 1),
+            "stages": _state.stages,
+        })
+        _state.stages = None
+        _write_log(run)
+
+def _write_log(run):
+    path = _settings["log_file"]
+    if not path or not _settings["enabled"]:
+        return
+    line = json.dumps(run, separators=(",", ":")) + "\n"
+    with _log_lock:
+        with open(path, "a") as f:
+            f.write(line)
+
+def new_session_id():
+    return uuid.uuid4().hex[:12]
@@ -0,0 +1,164 @@
+import io
+import mmap
+import os
+import threading
+import weakref
+from io import BytesIO
+from utils.cache_utils import hash_bytes
+
+UPLOADS_KEY = "_uploads"
+DEFAULT_SPOOL_MB = 8
+
+_settings = {"spool_mb": DEFAULT_SPOOL_MB}
+_lock = threading.Lock()
+_live = weakref.WeakSet()
+
+def configure_uploads(config):
+    """Apply the uploads settings from config.yaml (spool_mb: uploads at least this big are kept on disk)."""
+    _settings.update({k: v for k, v in (config.get('uploads', {}) or {}).items() if v is not None})
+
+def _release(mapped, f, path):
+    try:
+        mapped.close()
+    except BufferError:
+        # A reader or getbuffer() view still open at interpreter exit (readers keep their Upload alive
+        # otherwise); the mapping goes with the process
+        pass
+    f.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class _BufferReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over an Upload's shared buffer: no copy and no new mapping, so nothing
+    is left to unmap if a caller never closes it. Keeps the Upload (and so its mapping) alive while open.
+    """
+    def __init__(self, upload):
+        self._upload = upload
+        self._view = memoryview(upload._buffer)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        if base + offset < 0:
+            raise ValueError("negative seek position")
+        self._pos = base + offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+            self._upload = None
+        super().close()
+
+class Upload:
+    """
+    One uploaded file, read once per session. Small files are kept as bytes; from spool_mb up they are written
+    to the session's temp directory and memory-mapped, so their pages live in the OS file cache rather than
+    the process heap. Either way every reader shares one buffer:
+    - open(): a fresh file object at offset 0 for PIL and the PDF reader (BytesIO over the bytes, or a reader
+      over the one shared map), neither of which copies the data or needs closing to free anything;
+    - digest: the content hash (cache_utils.hash_bytes), computed once, that keys the pipeline and artifact caches;
+    - len() and slicing, for sniffing a header.
+    A spooled file is unmapped and removed once the last reference (session state, a pending export) is gone.
+    """
+    def __init__(self, name, data=None, path=None):
+        self.name = name
+        self.path = path
+        if path is None:
+            self._buffer = data
+        else:
+            self._file = open(path, "rb")
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            weakref.finalize(self, _release, self._buffer, self._file, path)
+        self.size = len(self._buffer)
+        self.digest = hash_bytes(self._buffer)
+        with _lock:
+            _live.add(self)
+
+    @property
+    def spooled(self):
+        return self.path is not None
+
+    def open(self):
+        if self.path is None:
+            return BytesIO(self._buffer)
+        return _BufferReader(self)
+
+    def getbuffer(self):
+        """Zero-copy view of the whole file (for hashing, writing out, or reportlab's JPEG embedding)."""
+        return memoryview(self._buffer)
+
+    def startswith(self, prefix):
+        return self._buffer[:len(prefix)] == prefix
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self._buffer[index]
+
+def _upload_id(uploaded_file):
+    return getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.getbuffer().nbytes)
+
+def _spool(state, uploaded_file):
+    from utils.session_utils import session_store
+    view = uploaded_file.getbuffer()
+    if not view.nbytes or view.nbytes < _settings["spool_mb"] * 1024 * 1024:
+        return Upload(uploaded_file.name, data=uploaded_file.getvalue())
+    path = session_store(state).new_file(os.path.splitext(uploaded_file.name)[1])
+    with open(path, "wb") as f:
+        f.write(view)
+    return Upload(uploaded_file.name, path=path)
+
+def session_uploads(state, key, uploaded_files):
+    """
+    Upload objects for a file_uploader's current value (one file, a list, or None), in the same shape.
+    Each file is read (and spooled) the first rerun it appears under key; later reruns reuse it.
+    Files no longer in the uploader are dropped from the session.
+    """
+    files = uploaded_files if isinstance(uploaded_files, list) else [uploaded_files] if uploaded_files else []
+    registry = state.get(UPLOADS_KEY)
+    if registry is None:
+        registry = state[UPLOADS_KEY] = {}
+    known = registry.get(key, {})
+    current = {}
+    for uploaded_file in files:
+        file_id = _upload_id(uploaded_file)
+        current[file_id] = known[file_id] if file_id in known else _spool(state, uploaded_file)
+    registry[key] = current
+    uploads = [current[_upload_id(f)] for f in files]
+    if isinstance(uploaded_files, list):
+        return uploads
+    return uploads[0] if uploads else None
+
+def forget_uploads(state, key):
+    """Drop key's uploads from the session (e.g. when a tool resets), so their spool files can go."""
+    (state.get(UPLOADS_KEY) or {}).pop(key, None)
+
+def upload_stats():
+    """Uploads alive in any session: how many, and bytes held in memory vs memory-mapped from spool files."""
+    with _lock:
+        uploads = list(_live)
+    return {
+        "uploads": len(uploads),
+        "memory_bytes": sum(u.size for u in uploads if not u.spooled),
+        "spooled_bytes": sum(u.size for u in uploads if u.spooled),
+    }
@@ -1,47 +1,91 @@
 from docx import Document
 from docx.shared import Inches
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls, qn
+from docx.oxml.shape import CT_Picture
 from io import BytesIO
 from PIL import Image
+from utils.image_utils import JpegSource, as_image
+from utils.ingest_utils import open_upload
+from utils.trace_utils import traced
+from utils.artifact_utils import artifact_cached
 
-def save_image_as_word(images, positions, page_width_inch, page_height_inch, img_width_inch, img_height_inch, dpi=300, auto_rotate=False):
+def _anchor_xml(shape_id, x_emu, y_emu, cx, cy):
+    # Floating drawing positioned absolutely from the page's top-left corner, no text wrapping
+    return (
+        '<wp:anchor %s distT="0" distB="0" distL="0" distR="0" simplePos="0" relativeHeight="%d" '
+        'behindDoc="0" locked="1" layoutInCell="1" allowOverlap="1">'
+        '<wp:simplePos x="0" y="0"/>'
+        '<wp:positionH relativeFrom="page"><wp:posOffset>%d</wp:posOffset></wp:positionH>'
+        '<wp:positionV relativeFrom="page"><wp:posOffset>%d</wp:posOffset></wp:positionV>'
+        '<wp:extent cx="%d" cy="%d"/>'
+        '<wp:effectExtent l="0" t="0" r="0" b="0"/>'
+        '<wp:wrapNone/>'
+        '<wp:docPr id="%d" name="Card %d"/>'
+        '<wp:cNvGraphicFramePr><a:graphicFrameLocks noChangeAspect="1"/></wp:cNvGraphicFramePr>'
+        '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture"/></a:graphic>'
+        '</wp:anchor>' % (nsdecls("wp", "a", "pic", "r"), shape_id, x_emu, y_emu, cx, cy, shape_id, shape_id)
+    )
+
+def _src_rect_xml(jpeg):
+    # Crop of the embedded picture, as DrawingML fractions of the full image (100000 = 100%)
+    left, top, right, bottom = jpeg.box
+    full_w, full_h = jpeg.size
+    return '<a:srcRect %s l="%d" t="%d" r="%d" b="%d"/>' % (
+        nsdecls("a"), left * 100000 // full_w, top * 100000 // full_h,
+        (full_w - right) * 100000 // full_w, (full_h - bottom) * 100000 // full_h)
+
+@traced("docx.layout")
+@artifact_cached("docx.layout")
+def save_image_as_word(images, positions, page_width_inch, page_height_inch, img_width_inch, img_height_inch, dpi=300, auto_rotate=False, sizes=None):
     """
-    images: list of PIL Images (already cropped/enhanced)
+    images: list of PIL Images (already cropped/enhanced) or JpegSource passthroughs, the same object may repeat
     positions: list of (x_inch, y_inch, rotate90) for each image (top-left corner, in inches, and rotation flag)
     page_width_inch, page_height_inch: page size
     img_width_inch, img_height_inch: image size (before rotation)
-    auto_rotate: if True, rotate image 90deg if it fits better
+    auto_rotate: if True, rotate image 90deg where the position asks for it
+    sizes: optional per-placement (width_inch, height_inch) before rotation
+    Each distinct image is encoded and stored once; every placement is an absolutely
+    positioned floating drawing referencing it, at the same coordinates as the PDF.
+    An unrotated JpegSource is stored as its original JPEG bytes and cropped by the drawing, as in the PDF.
     """
     doc = Document()
     section = doc.sections[0]
     section.page_width = Inches(page_width_inch)
     section.page_height = Inches(page_height_inch)
     section.top_margin = section.bottom_margin = section.left_margin = section.right_margin = Inches(0)
-    for img, (x_inch, y_inch, rotate90) in zip(images, positions):
-        image_io = BytesIO()
-        if auto_rotate and rotate90:
-            img = img.rotate(90, expand=True)
-            w, h = img_height_inch, img_width_inch
-        else:
-            w, h = img_width_inch, img_height_inch
-        img.save(image_io, format='PNG')
-        image_io.seek(0)
-        # Add a 1x1 table to position the image
-        table = doc.add_table(rows=1, cols=1)
-        table.allow_autofit = False
-        cell = table.cell(0, 0)
-        cell.width = Inches(w)
-        cell.height = Inches(h)
-        paragraph = cell.paragraphs[0]
-        run = paragraph.add_run()
-        run.add_picture(image_io, width=Inches(w), height=Inches(h))
-        # Set table position by adding empty paragraphs (simulate y offset)
-        for _ in range(int(y_inch * dpi / 72)):
-            doc.add_paragraph("")
-        # Set left margin for x offset (simulate x offset)
-        table.style = 'Table Grid'
-        table.autofit = False
-        # Note: Word does not support absolute positioning, so this is a best-effort
+    if sizes is None:
+        sizes = [(img_width_inch, img_height_inch)] * len(positions)
+    paragraph = doc.paragraphs[0] if doc.paragraphs else doc.add_paragraph()
+    parts = {}
+    for shape_id, (img, (x_inch, y_inch, rotate90), (w, h)) in enumerate(zip(images, positions, sizes), start=1):
+        rotate = auto_rotate and rotate90
+        if rotate:
+            w, h = h, w
+        passthrough = isinstance(img, JpegSource) and not rotate
+        key = (id(img), rotate, w, h)
+        if key not in parts and passthrough:
+            rId, image = doc.part.get_or_add_image(open_upload(img.data))
+            parts[key] = (rId, image.filename)
+        elif key not in parts:
+            part_img = as_image(img).convert("RGB")
+            if rotate:
+                part_img = part_img.rotate(90, expand=True)
+            part_img = part_img.resize((max(1, int(w * dpi)), max(1, int(h * dpi))))
+            image_io = BytesIO()
+            part_img.save(image_io, format='PNG', dpi=(dpi, dpi))
+            image_io.seek(0)
+            rId, image = doc.part.get_or_add_image(image_io)
+            parts[key] = (rId, image.filename)
+        rId, filename = parts[key]
+        cx, cy = Inches(w), Inches(h)
+        anchor = parse_xml(_anchor_xml(shape_id, Inches(x_inch), Inches(y_inch), cx, cy))
+        picture = CT_Picture.new(shape_id, filename, rId, cx, cy)
+        if passthrough and img.box != (0, 0) + img.size:
+            picture.blipFill.blip.addnext(parse_xml(_src_rect_xml(img)))
+        anchor.find('.//' + qn('a:graphicData')).append(picture)
+        paragraph.add_run()._r.add_drawing(anchor)
     word_io = BytesIO()
     doc.save(word_io)
     word_io.seek(0)
-    return word_io 
\ No newline at end of file
+    return word_io